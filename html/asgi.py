@@ -0,0 +1,220 @@
+"""Asyncio variant of the match service, as an ASGI app.
+
+    uvicorn asgi:app --port 8080
+
+Serves /api/match/apartments, /api/match/apartments/nearby, /api/match/users
+(as match-engine.py) and /api/match/roommates (as the root engine) from one
+async engine, so an instance overlaps database waits across concurrent feed
+requests instead of parking a worker thread per request. Pool size, overflow, timeout and
+recycle come from the DB_POOL_* variables read in db.py.
+
+Index reads (nearby and ?ranking=mutual) go through asyncpg (aiosqlite for
+a local SQLite DATABASE_URL), with AsyncSession.run_sync so their SQL is
+awaited on the async driver. Routes that score are CPU-bound, so they run
+the synchronous MatchService methods, and encode the JSON, on a worker
+thread over the sync engine; at most MATCH_SCORING_THREADS (the CPU count
+by default) score at once and the rest wait without blocking the event
+loop. ?weights= picks a weight profile as in match-engine.py. With MATCH_WARMUP=1 the
+pool, preference store and busiest cities are warmed at start-up and
+/api/health reports readiness (warmup.py). ?ranking=mutual serves the
+stable_match.py ranking on the apartment and roommate feeds. POST
+/api/match/{apartments,users,roommates}:batch serve many users per request
+(feeds.parse_batch). With
+MATCH_CHANGE_FEED set, feeds rank from memory kept current by
+change_feed.py, whose consumer runs on a thread over the sync engine.
+"""
+import asyncio
+import contextlib
+import os
+
+import anyio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+from change_feed import consumer
+from db import DATABASE_URL, SessionLocal, async_url, engine, pool_options
+from feeds import APARTMENT_DETAILS, USER_DETAILS, parse_batch, parse_nearby, parse_ranking
+from match_service import MatchService
+from serialization import ROOMMATE_RECORD, dumps, parse_fields
+from warmup import WARMUP_ENABLED, warm_apartments, warm_async_pool, warm_connections, warm_preferences, warmup
+from weight_profiles import profiles
+
+async_engine = create_async_engine(async_url(DATABASE_URL), **pool_options(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Worker threads scoring at once; more would only contend for the GIL and the CPUs
+SCORING_THREADS = int(os.environ.get("MATCH_SCORING_THREADS", os.cpu_count() or 4))
+scoring_limiter = anyio.CapacityLimiter(SCORING_THREADS)
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status_code=status, media_type="application/json")
+
+
+def encoded_response(body):
+    return Response(body, media_type="application/json")
+
+
+def _profile(params):
+    """The requested weight profile name; raises ValueError for an unknown one"""
+    name = params.get("weights")
+    if name is not None:
+        profiles.plan(name)
+    return name
+
+
+async def _run(method, profile, *args):
+    async with AsyncSessionLocal() as session:
+        return await session.run_sync(lambda db: method(MatchService(db, profile), *args))
+
+
+def _scored(method, profile, args):
+    # On a worker thread: score with a sync session, then encode
+    with SessionLocal() as db:
+        payload = method(MatchService(db, profile), *args)
+    return payload, None if payload is None else dumps(payload)
+
+
+async def _score(method, profile, *args):
+    """(payload, encoded JSON) of a scoring MatchService call, run off the event loop"""
+    return await anyio.to_thread.run_sync(_scored, method, profile, args, limiter=scoring_limiter)
+
+
+async def _paged_feed(request, feeds, details):
+    params = request.query_params
+    min_score = int(params.get("min_score", 0))
+    page = int(params.get("page", 1))
+    per_page = int(params.get("per_page", 10))
+    try:
+        details = details.project(parse_fields(params.get("fields")))
+        ranking = parse_ranking(params, tuple(feeds))
+        profile = _profile(params)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    args = (request.path_params["user_id"], min_score, page, per_page, details)
+    if ranking == "mutual":
+        payload = await _run(feeds[ranking], profile, *args)
+        if payload is None:
+            return json_response({"error": "No mutual ranking for this user"}, 404)
+        return json_response(payload)
+    payload, body = await _score(feeds[ranking], profile, *args)
+    if payload is None:
+        return json_response({"error": "User preferences not found"}, 404)
+    return encoded_response(body)
+
+
+async def match_apartments(request):
+    return await _paged_feed(request, {"score": MatchService.apartment_feed,
+                                       "mutual": MatchService.mutual_apartment_feed}, APARTMENT_DETAILS)
+
+
+async def match_users(request):
+    return await _paged_feed(request, {"score": MatchService.user_feed}, USER_DETAILS)
+
+
+async def nearby_apartments(request):
+    try:
+        latitude, longitude, radius_km, limit = parse_nearby(request.query_params)
+        details = APARTMENT_DETAILS.project(parse_fields(request.query_params.get("fields")))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    return json_response(await _run(MatchService.nearby_feed, None, latitude, longitude, radius_km, limit, details))
+
+
+async def match_roommates(request):
+    try:
+        record = ROOMMATE_RECORD.project(parse_fields(request.query_params.get("fields")))
+        ranking = parse_ranking(request.query_params)
+        profile = _profile(request.query_params)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    if ranking == "mutual":
+        return json_response(await _run(MatchService.mutual_roommate_feed, profile,
+                                        request.path_params["user_id"], record))
+    _, body = await _score(MatchService.roommate_feed, profile, request.path_params["user_id"], record)
+    return encoded_response(body)
+
+
+async def _batch(request, method, details):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    try:
+        batch = parse_batch(body, request.query_params)
+        details = details.project(parse_fields(request.query_params.get("fields")))
+        profile = _profile(request.query_params)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    _, body = await _score(method, profile, batch, details)
+    return encoded_response(body)
+
+
+async def match_apartments_batch(request):
+    return await _batch(request, MatchService.apartment_feed_batch, APARTMENT_DETAILS)
+
+
+async def match_users_batch(request):
+    return await _batch(request, MatchService.user_feed_batch, USER_DETAILS)
+
+
+def _roommates_batch(service, batch, record):
+    # Top 5 per owner, as match_roommates
+    return {"results": service.top_roommates_batch([user_id for user_id, _, _, _ in batch], record)}
+
+
+async def match_roommates_batch(request):
+    return await _batch(request, _roommates_batch, ROOMMATE_RECORD)
+
+
+async def health(request):
+    ready = warmup.ready and consumer.ready
+    return json_response(dict(warmup.snapshot(), change_feed=consumer.snapshot()), 200 if ready else 503)
+
+
+async def warm():
+    """warmup.Warmup.run over the async engine"""
+    warmup.begin()
+    try:
+        with warmup.step("connections"):
+            await warm_async_pool(async_engine, warm_connections(async_engine.sync_engine))
+        async with AsyncSessionLocal() as session:
+            with warmup.step("preferences"):
+                await session.run_sync(warm_preferences)
+            with warmup.step("apartments"):
+                await session.run_sync(warm_apartments)
+    except Exception as e:
+        warmup.finish(e)
+    else:
+        warmup.finish()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Warm in the background so /api/health answers while it runs
+    task = asyncio.create_task(warm()) if WARMUP_ENABLED else None
+    if consumer.mode:
+        consumer.start(engine, SessionLocal)
+    yield
+    if task is not None:
+        task.cancel()
+    consumer.stop()
+    await async_engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/match/apartments/nearby", nearby_apartments),
+        Route("/api/match/apartments/{user_id:int}", match_apartments),
+        Route("/api/match/users/{user_id:int}", match_users),
+        Route("/api/match/roommates/{user_id:int}", match_roommates),
+        Route("/api/match/apartments:batch", match_apartments_batch, methods=["POST"]),
+        Route("/api/match/users:batch", match_users_batch, methods=["POST"]),
+        Route("/api/match/roommates:batch", match_roommates_batch, methods=["POST"]),
+        Route("/api/health", health),
+    ],
+    lifespan=lifespan,
+)
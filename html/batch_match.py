@@ -0,0 +1,184 @@
+"""Nightly all-pairs roommate scoring on every core.
+
+    python batch_match.py --output matches.ndjson [--top-n 100]
+    python batch_match.py --table                 # replace match_index "users" rows
+
+Lifestyle preferences are packed once into PreferenceStore records (14 bytes
+per user, see preference_store.py) in a shared memory segment that every
+worker process maps read-only, so no rows are pickled. Users are split into
+blocks; a task takes one row block, scores it against every column block
+with score_user_pairs and keeps each user's top N (best score first, ties by
+lower user id, as in ranking.py). Tasks are independent, so results stream
+out as they finish and throughput grows with the number of workers. Pairs
+are scored from both sides rather than merging half-results across tasks.
+Throughput (pairs/second) is reported at the end.
+
+With --table, only the top N per user is stored, so match_index pages for
+the "users" mode stop after N results.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import MatchIndex
+from match_index import USERS, create_tables
+from scoring import USER_WEIGHTS
+from weight_profiles import profiles
+from preference_store import RECORD_DTYPE, load_preference_store
+from vector_scoring import score_user_pairs
+
+# Sort key of a pair that must never be selected (self-pairs, unscorable pairs)
+EXCLUDED = np.iinfo(np.int64).max
+
+# Worker state, set by _attach
+_shared = None
+_records = None
+
+
+def _attach(name, shape):
+    global _shared, _records
+    _shared = shared_memory.SharedMemory(name=name)
+    _records = np.ndarray(shape, dtype=RECORD_DTYPE, buffer=_shared.buf)
+
+
+def top_block(records, start, stop, top_n, block_size, weights=USER_WEIGHTS):
+    """Top top_n (column indices, scores) for rows start:stop against all rows.
+
+    Rows are ordered by user id, so ordering by (score desc, index asc)
+    breaks ties by lower user id. Unused slots have index -1.
+    """
+    n = len(records)
+    rows = np.arange(start, stop)
+    best = np.full((stop - start, 0), EXCLUDED, dtype=np.int64)
+    for column_start in range(0, n, block_size):
+        column_stop = min(n, column_start + block_size)
+        scores = score_user_pairs(records[start:stop], records[column_start:column_stop], weights)
+        columns = np.arange(column_start, column_stop)
+        # Smaller key = better: higher score first, then lower index
+        keys = (100 - scores) * n + columns
+        keys[(scores < 0) | (rows[:, None] == columns[None, :])] = EXCLUDED
+        keys = np.concatenate([best, keys], axis=1)
+        if keys.shape[1] > top_n:
+            keys = np.partition(keys, top_n - 1, axis=1)[:, :top_n]
+        best = keys
+    best.sort(axis=1)
+    excluded = best == EXCLUDED
+    indices = np.where(excluded, -1, best % n)
+    scores = np.where(excluded, -1, 100 - best // n)
+    return indices, scores
+
+
+def _top_block_task(start, stop, top_n, block_size, weights):
+    indices, scores = top_block(_records, start, stop, top_n, block_size, weights)
+    return start, indices.astype(np.int32), scores.astype(np.int16)
+
+
+def score_population(records, workers, block_size, top_n, weights=USER_WEIGHTS):
+    """Yield (user_id, [(target_id, score), ...]) for every user, block by block"""
+    ids = records['user_id']
+    shared = shared_memory.SharedMemory(create=True, size=max(1, records.nbytes))
+    try:
+        np.ndarray(records.shape, dtype=RECORD_DTYPE, buffer=shared.buf)[:] = records
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(shared.name, records.shape)) as pool:
+            futures = [
+                pool.submit(_top_block_task, start, min(len(ids), start + block_size),
+                            top_n, block_size, weights)
+                for start in range(0, len(ids), block_size)
+            ]
+            for future in as_completed(futures):
+                start, indices, scores = future.result()
+                for offset in range(len(indices)):
+                    keep = indices[offset] >= 0
+                    yield int(ids[start + offset]), list(zip(
+                        ids[indices[offset][keep]].tolist(), scores[offset][keep].tolist()))
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def write_ndjson(results, path):
+    out = sys.stdout if path == "-" else open(path, "w")
+    try:
+        for user_id, matches in results:
+            out.write(json.dumps({"user_id": user_id, "matches": matches}) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def write_table(results, db, batch_size=10000):
+    """Replace the "users" rows of match_index with results, in one transaction"""
+    db.execute(delete(MatchIndex).where(MatchIndex.mode == USERS))
+    batch = []
+    for user_id, matches in results:
+        batch.extend({"user_id": user_id, "mode": USERS, "target_id": target_id, "score": score}
+                     for target_id, score in matches)
+        if len(batch) >= batch_size:
+            db.execute(insert(MatchIndex), batch)
+            batch = []
+    if batch:
+        db.execute(insert(MatchIndex), batch)
+    db.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score every pair of users on all cores")
+    parser.add_argument("--database-url", help="defaults to the service database (db.py)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--block-size", type=int, default=1024, help="users per block")
+    parser.add_argument("--top-n", type=int, default=100, help="matches kept per user")
+    parser.add_argument("--profile",
+                        help="weight profile (weight_profiles.py); defaults to the default one")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="write NDJSON here ('-' for stdout)")
+    target.add_argument("--table", action="store_true", help="replace match_index users rows")
+    args = parser.parse_args(argv)
+    if args.top_n < 1 or args.block_size < 1:
+        parser.error("--top-n and --block-size must be positive")
+    try:
+        plan = profiles.plan(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.table and plan is not profiles.plan():
+        parser.error("--table serves the default profile; use --output for others")
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        session_factory = sessionmaker(bind=engine)
+    else:
+        from db import engine, SessionLocal as session_factory
+
+    db = session_factory()
+    try:
+        start = time.perf_counter()
+        records = load_preference_store(db).records
+        loaded = time.perf_counter()
+        results = score_population(records, args.workers, args.block_size, args.top_n,
+                                   plan.user_weights)
+        if args.table:
+            create_tables(engine)
+            write_table(results, db)
+        else:
+            write_ndjson(results, args.output)
+        elapsed = time.perf_counter() - loaded
+    finally:
+        db.close()
+
+    pairs = len(records) * (len(records) - 1)
+    print(f"{len(records)} users, {pairs} pairs in {elapsed:.2f}s with {args.workers} workers "
+          f"({pairs / elapsed if elapsed else 0:,.0f} pairs/s; load {loaded - start:.2f}s)",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
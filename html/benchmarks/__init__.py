@@ -0,0 +1,13 @@
+"""Benchmarks for the match engines.
+
+    cd html && python -m benchmarks --apartments 10000 --users 5000 --output results.json
+
+Generates a synthetic population (benchmarks.synthetic), loads it into
+SQLite or a local Postgres, times every match endpoint of match-engine.py
+and html/match-engine.py end to end plus the scoring functions on their own,
+and writes JSON results that can be compared against a stored baseline.
+benchmarks.coldstart times start-up to readiness against a budget,
+benchmarks.ann reports recall vs latency of the preference ANN index, and
+benchmarks.loadtest drives an engine with open-loop traffic against
+latency, error-rate and throughput SLOs.
+"""
@@ -0,0 +1,103 @@
+"""Recall and latency of the preference ANN index against exhaustive scoring.
+
+    cd html && python -m benchmarks.ann --users 100000 --k 10 --probes 1 2 4 8 16 0
+
+Encodes a synthetic population in memory (no database), builds
+preference_ann.PreferenceANN over it and runs the same query users through
+exhaustive score_user_pairs ranking and through the index at each nprobe
+(0 scans every list). Per nprobe it reports latency, the share of users
+scanned, and recall@k two ways: by id, and tie-aware (results scoring at
+least the exact k-th score, since users with equal scores are
+interchangeable).
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks.run import summarize
+from benchmarks.synthetic import user_preferences
+from preference_ann import PreferenceANN
+from preference_store import PreferenceStore
+from ranking import rank_scores
+from vector_scoring import score_user_pairs
+from weight_profiles import profiles
+
+
+def exhaustive(store, user_id, weights, k, min_score):
+    """What user_feed ranks without the index"""
+    i = store.index_of(user_id)
+    scores = score_user_pairs(store.records[i:i + 1], store.records, weights)[0]
+    keep = (store.ids != user_id) & (scores >= 0)
+    ids, scores = rank_scores(scores[keep], store.ids[keep], min_score)
+    return ids[:k], scores[:k]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.ann",
+                                     description="Recall vs latency of the preference ANN index")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-score", type=int, default=0)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 0])
+    parser.add_argument("--lists", type=int, help="IVF lists (default: sqrt of the distinct codes)")
+    parser.add_argument("--profile", help="weight profile (default: the default profile)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    rows = [SimpleNamespace(**row) for row in user_preferences(rng, range(1, args.users + 1))]
+    store = PreferenceStore.from_rows(rows)
+    weights = profiles.plan(args.profile).user_weights
+
+    start = time.perf_counter()
+    index = PreferenceANN(store, lists=args.lists, seed=args.seed)
+    build_s = time.perf_counter() - start
+
+    queries = [int(user_id) for user_id in rng.sample(list(store.ids), min(args.queries, len(store)))]
+    samples, truth = [], {}
+    for user_id in queries:
+        start = time.perf_counter()
+        truth[user_id] = exhaustive(store, user_id, weights, args.k, args.min_score)
+        samples.append(time.perf_counter() - start)
+    results = {"exhaustive": summarize(samples)}
+
+    for probes in args.probes:
+        samples, by_id, by_score, scanned = [], [], [], []
+        for user_id in queries:
+            start = time.perf_counter()
+            ids, scores, candidates = index.search(user_id, weights, args.k, args.min_score, probes)
+            samples.append(time.perf_counter() - start)
+            exact_ids, exact_scores = truth[user_id]
+            if len(exact_ids):
+                by_id.append(len(np.intersect1d(ids, exact_ids)) / len(exact_ids))
+                by_score.append(min(1.0, int((scores >= exact_scores[-1]).sum()) / len(exact_ids)))
+            scanned.append(candidates / (len(store) - 1))
+        results[f"probes={probes}"] = dict(
+            summarize(samples),
+            recall=float(np.mean(by_id)) if by_id else None,
+            recall_tie_aware=float(np.mean(by_score)) if by_score else None,
+            scanned=float(np.mean(scanned)),
+        )
+
+    out = json.dumps({
+        "users": len(store), "indexed": len(index), "codes": len(index.counts), "lists": index.lists,
+        "build_s": build_s, "k": args.k, "min_score": args.min_score, "queries": len(queries),
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Cold-start gate for the match service.
+
+    cd html && python -m benchmarks.coldstart --budget 5 --import-budget 1.5
+
+Loads a synthetic population (or uses --database-url), then starts the
+engine in fresh interpreters with MATCH_WARMUP=1 and times, per run, the
+engine import and the wall time from spawning the process to /api/health
+answering 200. Exits 1 if any run is over either budget, so it can gate a
+deploy like `python -m benchmarks --baseline` does. The defaults come from
+MATCH_COLD_START_BUDGET and MATCH_IMPORT_BUDGET (seconds);
+tests/test_coldstart.py runs it against both engines in CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.engines import HTML_DIR
+
+# Runs in the fresh interpreter: import the engine, then poll its health endpoint
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from benchmarks.engines import load_engine
+client = load_engine(sys.argv[1]).app.test_client()
+imported = time.perf_counter()
+deadline = imported + float(sys.argv[2])
+while True:
+    response = client.get("/api/health")
+    if response.status_code == 200 or time.perf_counter() > deadline:
+        break
+    time.sleep(0.01)
+print(json.dumps({"import_s": imported - start, "status": response.status_code, "health": response.get_json()}))
+"""
+
+
+def cold_start(engine, database_url, timeout):
+    """One cold start: import time, spawn-to-ready time and the final health payload"""
+    env = dict(os.environ, DATABASE_URL=database_url, MATCH_WARMUP="1")
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, engine, str(timeout)], cwd=HTML_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    if result["status"] == 200:
+        # The child exits right after reporting ready
+        result["ready_s"] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.coldstart",
+                                     description="Time the match service from process start to ready")
+    parser.add_argument("--engine", default="html", help="engine to start (benchmarks.engines)")
+    parser.add_argument("--apartments", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--database-url", help="loaded database to warm from (default: synthetic SQLite)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("MATCH_COLD_START_BUDGET", 10)),
+                        help="seconds from process start to ready")
+    parser.add_argument("--import-budget", type=float, default=float(os.environ.get("MATCH_IMPORT_BUDGET", 2)),
+                        help="seconds to import the engine")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        args.database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="roomatch-coldstart-"), "bench.db")
+        os.environ["DATABASE_URL"] = args.database_url
+        from db import SessionLocal, engine
+        from models import Base
+        from benchmarks.synthetic import generate
+
+        Base.metadata.create_all(engine)
+        db = SessionLocal()
+        try:
+            generate(db, args.apartments, args.users)
+        finally:
+            db.close()
+        engine.dispose()
+
+    runs = [cold_start(args.engine, args.database_url, 3 * args.budget) for _ in range(args.runs)]
+    print(json.dumps({"engine": args.engine, "budget_s": args.budget, "import_budget_s": args.import_budget,
+                      "runs": runs}, indent=2))
+
+    failures = []
+    for i, run in enumerate(runs):
+        if "ready_s" not in run:
+            failures.append(f"run {i}: not ready ({run['health']})")
+        elif run["ready_s"] > args.budget:
+            failures.append(f"run {i}: ready after {run['ready_s']:.2f}s, budget {args.budget:.2f}s")
+        if run["import_s"] > args.import_budget:
+            failures.append(f"run {i}: import took {run['import_s']:.2f}s, budget {args.import_budget:.2f}s")
+    for line in failures:
+        print(f"OVER BUDGET {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
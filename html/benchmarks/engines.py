@@ -0,0 +1,18 @@
+import importlib.util
+import os
+
+HTML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Flask match services, by short name
+ENGINE_PATHS = {
+    "root": os.path.join(os.path.dirname(HTML_DIR), "match-engine.py"),
+    "html": os.path.join(HTML_DIR, "match-engine.py"),
+}
+
+
+def load_engine(name):
+    """Import a match-engine.py module (its file name is not importable as is)"""
+    spec = importlib.util.spec_from_file_location(f"match_engine_{name}", ENGINE_PATHS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,285 @@
+"""Open-loop load test of one match engine, gated on latency SLOs.
+
+    cd html && python -m benchmarks.loadtest --engine html --scale 10k --rate 40 --duration 30 \\
+        --mix apartments=3,users=1 --slo-p95-ms 300 --slo-p99-ms 800
+
+Seeds a synthetic population (benchmarks.synthetic) into a temporary SQLite
+file, or with --postgres into a throwaway PostgreSQL cluster started from
+the local initdb and pg_ctl (--pg-bin), or into --database-url. The engine
+(match-engine.py as "root", html/match-engine.py as "html") is served by
+Werkzeug's threaded server in its own process, so the load generator
+doesn't share its interpreter.
+
+Requests arrive open-loop: a Poisson process at --rate per second, whatever
+the responses do, over at most --clients concurrent connections. Latency
+runs from a request's scheduled arrival, so time spent queued behind a
+saturated server counts. The report has throughput, p50/p95/p99 and the
+error rate (5xx and failed connections), overall and per route, and the
+run exits 1 when any SLO is breached, so it can gate merges like
+`python -m benchmarks --baseline`. Everything runs offline. SLO defaults
+come from MATCH_SLO_P95_MS, MATCH_SLO_P99_MS, MATCH_SLO_ERROR_RATE and
+MATCH_SLO_THROUGHPUT (share of the offered rate that must be served;
+it falls when the server can't keep up and responses trail the arrivals).
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.engines import HTML_DIR
+from benchmarks.run import SCALES, summarize
+
+# Routes each engine serves, with the users that make sense to request
+ROUTES = {
+    "root": {"apartments": "seekers", "roommates": "owners"},
+    "html": {"apartments": "seekers", "users": "everyone"},
+}
+DEFAULT_MIX = {"root": "apartments=3,roommates=1", "html": "apartments=3,users=1"}
+
+# Runs in the server process: bind an ephemeral port, report it, serve
+SERVER = """
+import logging, sys
+from werkzeug.serving import make_server
+from benchmarks.engines import load_engine
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+server = make_server("127.0.0.1", 0, load_engine(sys.argv[1]).app, threaded=True)
+print(server.port, flush=True)
+server.serve_forever()
+"""
+
+
+def parse_mix(text, engine):
+    """{route: weight} from "route=weight,..."; raises ValueError for routes the engine lacks"""
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES[engine]:
+            raise ValueError(f"{engine} engine serves {', '.join(ROUTES[engine])}, not {route!r}")
+        mix[route] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("mix needs a positive weight")
+    return mix
+
+
+def start_postgres(directory, pg_bin=None):
+    """Throwaway PostgreSQL cluster in directory on a Unix socket; returns (url, stop)"""
+    tool = lambda name: os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not tool("initdb") or not os.path.exists(tool("initdb")):
+        raise SystemExit("initdb not found: install PostgreSQL, pass --pg-bin, or drop --postgres for SQLite")
+    data = os.path.join(directory, "data")
+
+    def run(*command):
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode:
+            raise SystemExit(f"{os.path.basename(command[0])} failed: {result.stderr.strip()}")
+
+    run(tool("initdb"), "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8")
+    run(tool("pg_ctl"), "-D", data, "-l", os.path.join(directory, "postgres.log"), "-w",
+        "-o", f"-k {directory} -c listen_addresses=''", "start")
+
+    def stop():
+        subprocess.run([tool("pg_ctl"), "-D", data, "-m", "fast", "-w", "stop"], capture_output=True)
+    return f"postgresql+psycopg2://postgres@/postgres?host={directory}", stop
+
+
+def seed(database_url, apartments, users, seed_value):
+    """Create the schema (plus migrations on Postgres) and load a population; returns its ids"""
+    os.environ["DATABASE_URL"] = database_url
+    from db import SessionLocal, engine
+    from models import Base
+    from benchmarks.synthetic import generate
+
+    Base.metadata.create_all(engine)
+    if engine.dialect.name == "postgresql":
+        from migrate import migrate
+        migrate(engine)
+    db = SessionLocal()
+    try:
+        ids = generate(db, apartments, users, seed_value)
+    finally:
+        db.close()
+    engine.dispose()
+    ids["everyone"] = ids["seekers"] + ids["owners"]
+    return ids
+
+
+def start_server(engine, database_url):
+    """The engine behind a threaded HTTP server in a child process; returns (process, port)"""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    process = subprocess.Popen([sys.executable, "-c", SERVER, engine], cwd=HTML_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    if not line.strip().isdigit():
+        process.kill()
+        raise SystemExit(f"{engine} engine failed to start")
+    return process, int(line)
+
+
+def arrivals(rng, rate, duration, mix, ids, routes):
+    """(offset seconds, route, path) of a Poisson arrival process over duration"""
+    names, weights = list(mix), list(mix.values())
+    schedule, t = [], rng.expovariate(rate)
+    while t < duration:
+        route = rng.choices(names, weights)[0]
+        user_id = rng.choice(ids[routes[route]])
+        schedule.append((t, route, f"/api/match/{route}/{user_id}"))
+        t += rng.expovariate(rate)
+    return schedule
+
+
+def fetch(port, path, timeout):
+    """Status of one GET (0 when the connection failed)"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException):
+        return 0
+    finally:
+        conn.close()
+
+
+def drive(port, schedule, clients, timeout, warmup):
+    """Fire the schedule open-loop; returns (route, latency, status, completed offset) after warmup"""
+    samples, lock = [], threading.Lock()
+    start = time.perf_counter() + 0.1
+
+    def call(offset, route, path):
+        status = fetch(port, path, timeout)
+        done = time.perf_counter() - start
+        if offset >= warmup:
+            with lock:
+                samples.append((route, done - offset, status, done))
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for offset, route, path in schedule:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(call, offset, route, path)
+    return samples
+
+
+def report(samples, window):
+    """Throughput, latency and error rate of a set of samples"""
+    errors = sum(1 for _, _, status, _ in samples if status == 0 or status >= 500)
+    result = summarize([latency for _, latency, _, _ in samples], errors)
+    result["throughput_rps"] = (len(samples) - errors) / window if window > 0 else None
+    result["error_rate"] = errors / len(samples) if samples else 0.0
+    return result
+
+
+def breaches(name, result, args, offered):
+    """SLO breaches of one report, as printable lines"""
+    found = []
+    for key, limit in (("p95_ms", args.slo_p95_ms), ("p99_ms", args.slo_p99_ms)):
+        if limit and result[key] is not None and result[key] > limit:
+            found.append(f"{name}: {key} {result[key]:.1f} > {limit:.1f}")
+    if result["error_rate"] > args.slo_error_rate:
+        found.append(f"{name}: error rate {result['error_rate']:.2%} > {args.slo_error_rate:.2%}")
+    if offered and result["throughput_rps"] is not None and result["throughput_rps"] < args.slo_throughput * offered:
+        found.append(f"{name}: {result['throughput_rps']:.1f} req/s < {args.slo_throughput:.0%} "
+                     f"of {offered:.1f} offered")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest",
+                                     description="Open-loop load test of a match engine with SLO gates")
+    parser.add_argument("--engine", choices=ROUTES, default="html")
+    parser.add_argument("--mix", help="route=weight,... (default: %s)" % DEFAULT_MIX)
+    parser.add_argument("--scale", choices=SCALES, help="apartments and users (overrides counts)")
+    parser.add_argument("--apartments", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="empty database to load (default: temporary SQLite)")
+    parser.add_argument("--postgres", action="store_true", help="start a throwaway local PostgreSQL instead")
+    parser.add_argument("--pg-bin", help="directory holding initdb and pg_ctl (default: PATH)")
+    parser.add_argument("--rate", type=float, default=20.0, help="arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals")
+    parser.add_argument("--warmup", type=float, default=2.0, help="leading seconds left out of the report")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections at most")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request fails")
+    parser.add_argument("--slo-p95-ms", type=float, default=float(os.environ.get("MATCH_SLO_P95_MS", 500)))
+    parser.add_argument("--slo-p99-ms", type=float, default=float(os.environ.get("MATCH_SLO_P99_MS", 1000)))
+    parser.add_argument("--slo-error-rate", type=float,
+                        default=float(os.environ.get("MATCH_SLO_ERROR_RATE", 0.01)))
+    parser.add_argument("--slo-throughput", type=float,
+                        default=float(os.environ.get("MATCH_SLO_THROUGHPUT", 0.95)))
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+    if args.scale:
+        args.apartments = args.users = SCALES[args.scale]
+    try:
+        mix = parse_mix(args.mix or DEFAULT_MIX[args.engine], args.engine)
+    except ValueError as e:
+        parser.error(str(e))
+
+    tmpdir = tempfile.mkdtemp(prefix="roomatch-load-")
+    stop_postgres = None
+    server = None
+    try:
+        if args.postgres:
+            args.database_url, stop_postgres = start_postgres(tmpdir, args.pg_bin)
+        elif not args.database_url:
+            args.database_url = "sqlite:///" + os.path.join(tmpdir, "load.db")
+        start = time.perf_counter()
+        ids = seed(args.database_url, args.apartments, args.users, args.seed)
+        load_seconds = time.perf_counter() - start
+
+        server, port = start_server(args.engine, args.database_url)
+        rng = random.Random(args.seed)
+        schedule = arrivals(rng, args.rate, args.duration, mix, ids, ROUTES[args.engine])
+        samples = drive(port, schedule, args.clients, args.timeout, args.warmup)
+    finally:
+        if server is not None:
+            server.kill()
+        if stop_postgres is not None:
+            stop_postgres()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # Throughput over the measured window: end of warm-up to the last response
+    window = max((done for _, _, _, done in samples), default=args.warmup) - args.warmup
+    groups = {"all": samples, **{route: [s for s in samples if s[0] == route] for route in mix}}
+    results = {name: report(group, window) for name, group in groups.items()}
+    # Offered: the arrivals actually drawn, so Poisson noise doesn't count against the server
+    offered = {name: len(group) / (args.duration - args.warmup) for name, group in groups.items()}
+    for name, result in results.items():
+        result["offered_rps"] = offered[name]
+
+    out = json.dumps({
+        "meta": {
+            "engine": args.engine, "mix": mix, "rate": args.rate, "duration": args.duration,
+            "warmup": args.warmup, "clients": args.clients, "apartments": args.apartments,
+            "users": args.users, "database": args.database_url.split(":", 1)[0].split("+", 1)[0],
+            "load_seconds": load_seconds, "seed": args.seed,
+        },
+        "slo": {"p95_ms": args.slo_p95_ms, "p99_ms": args.slo_p99_ms, "error_rate": args.slo_error_rate,
+                "throughput": args.slo_throughput},
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+    failures = [line for name, result in results.items() for line in breaches(name, result, args, offered[name])]
+    for line in failures:
+        print(f"SLO BREACH {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
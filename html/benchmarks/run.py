@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+
+
+def summarize(samples, errors=0):
+    """Latency summary in milliseconds"""
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else None
+    return {
+        "n": len(samples),
+        "errors": errors,
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else None,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000 if ordered else None,
+    }
+
+
+def time_calls(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def time_endpoint(client, urls, before=None):
+    samples, errors = [], 0
+    for url in urls:
+        if before:
+            before()
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors += 1
+    return summarize(samples, errors)
+
+
+def bench_scoring(db, ids, count, rng):
+    """The scoring functions on their own, on rows already in memory"""
+    from models import Apartment, UserApartmentPref, UserPreference
+    from scoring import APARTMENT_WEIGHTS, match_user_to_apartment, match_users
+    from vector_scoring import load_apartment_catalog, score_apartments
+
+    prefs = db.query(UserApartmentPref).filter(
+        UserApartmentPref.user_id.in_(rng.sample(ids["seekers"], min(count, len(ids["seekers"]))))).all()
+    apartments = db.query(Apartment).limit(1000).all()
+    lifestyles = db.query(UserPreference).limit(1000).all()
+    catalog = load_apartment_catalog(db)
+    pairs = [(rng.choice(prefs), rng.choice(apartments)) for _ in range(count * 100)]
+    people = [(rng.choice(lifestyles), rng.choice(lifestyles)) for _ in range(count * 100)]
+    return {
+        "scoring.match_user_to_apartment": time_calls(match_user_to_apartment, pairs),
+        "scoring.match_users": time_calls(match_users, people),
+        f"vector_scoring.score_apartments[{len(catalog)}]": time_calls(
+            score_apartments, [(pref, catalog, APARTMENT_WEIGHTS) for pref in prefs]),
+    }
+
+
+def bench_endpoints(ids, count, rng):
+    """Every match endpoint of both engines, end to end through Flask"""
+    from benchmarks.engines import load_engine
+    from match_cache import match_cache
+
+    seekers = rng.sample(ids["seekers"], min(count, len(ids["seekers"])))
+    owners = rng.sample(ids["owners"], min(count, len(ids["owners"])))
+    everyone = seekers + owners
+    results = {}
+    for name, routes in (
+        ("root", [("apartments", seekers), ("roommates", owners)]),
+        ("html", [("apartments", seekers), ("users", everyone)]),
+    ):
+        client = load_engine(name).app.test_client()
+        for route, users in routes:
+            # Cold: clear the result cache so every request does the full work
+            results[f"{name}:/api/match/{route}"] = time_endpoint(
+                client, [f"/api/match/{route}/{u}" for u in users], match_cache.invalidate)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of p50 latency beyond tolerance, as printable lines"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before or not before.get("p50_ms") or result.get("p50_ms") is None:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: p50 {before['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms "
+                               f"({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark the match engines")
+    parser.add_argument("--scale", choices=SCALES, help="apartments and users (overrides counts)")
+    parser.add_argument("--apartments", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--database-url", help="empty database to load (default: temporary SQLite)")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown")
+    parser.add_argument("--save-baseline", help="also write the results as the new baseline")
+    args = parser.parse_args(argv)
+    if args.scale:
+        args.apartments = args.users = SCALES[args.scale]
+
+    tmpdir = None
+    if not args.database_url:
+        tmpdir = tempfile.mkdtemp(prefix="roomatch-bench-")
+        args.database_url = "sqlite:///" + os.path.join(tmpdir, "bench.db")
+    # db.py reads the URL at import, so set it before anything imports it
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from db import SessionLocal, engine
+    from models import Base
+    from benchmarks.synthetic import generate
+
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    rng = random.Random(args.seed)
+    try:
+        start = time.perf_counter()
+        ids = generate(db, args.apartments, args.users, args.seed)
+        load_seconds = time.perf_counter() - start
+        results = bench_scoring(db, ids, args.requests, rng)
+    finally:
+        db.close()
+    results.update(bench_endpoints(ids, args.requests, rng))
+
+    report = {
+        "meta": {
+            "apartments": args.apartments,
+            "users": args.users,
+            "seed": args.seed,
+            "requests": args.requests,
+            "database": engine.dialect.name,
+            "load_seconds": load_seconds,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("apartments", "users", "database"):
+            if baseline.get("meta", {}).get(key) != report["meta"][key]:
+                print(f"warning: baseline {key} is {baseline.get('meta', {}).get(key)!r}, "
+                      f"this run used {report['meta'][key]!r}", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
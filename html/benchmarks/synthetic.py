@@ -0,0 +1,166 @@
+"""Synthetic RooMatch populations with the frontend's value distributions.
+
+Cities, areas, contract types, features, room counts and quiz answers are
+the options offered by upload-apt.html, apt-pref.html and onboarding.html,
+drawn with skewed (not uniform) frequencies so candidate sets per city look
+like production.
+"""
+import datetime
+import random
+
+from sqlalchemy import insert
+
+from features import features_mask
+from geo import grid_cell
+from models import Apartment, User, UserApartmentPref, UserPreference
+
+CITIES = {"Tel Aviv": 0.5, "Jerusalem": 0.3, "Haifa": 0.2}
+# Median monthly rent per city
+CITY_RENT = {"Tel Aviv": 6500, "Jerusalem": 5000, "Haifa": 3800}
+# City centres; listings scatter around them (about 3 km standard deviation)
+CITY_CENTERS = {"Tel Aviv": (32.0853, 34.7818), "Jerusalem": (31.7683, 35.2137), "Haifa": (32.7940, 34.9896)}
+SCATTER_DEGREES = 0.03
+# Share of seekers who picked a spot on the map
+PREFERRED_LOCATION_RATE = 0.5
+AREAS = {"Center": 0.5, "North": 0.3, "South": 0.2}
+CONTRACT_TYPES = {"Long term": 0.7, "Short term": 0.2, "Sublet": 0.1}
+# Probability that a listing has each feature
+FEATURES = {
+    "Balcony": 0.6, "Elevator": 0.5, "Mamad": 0.45, "Wifi": 0.7,
+    "Parking": 0.35, "Storage": 0.25, "Accessible": 0.1,
+}
+ROOMS = {1: 0.1, 2: 0.25, 3: 0.35, 4: 0.2, 5: 0.1}
+FREQUENCIES = ["Once a week", "Once every two weeks", "Once a month"]
+NOISE = ["very sensitive", "acceptable to me", "Not sensitive at all"]
+
+LOOKING_FOR_APT = "Looking for Apt"
+LOOKING_FOR_ROOMMATE = "Looking for Roomate"
+
+BATCH_SIZE = 10000
+
+
+def _pick(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _rent(rng, city):
+    return int(round(rng.lognormvariate(0, 0.3) * CITY_RENT[city], -2))
+
+
+def _near(rng, city):
+    latitude, longitude = CITY_CENTERS[city]
+    return rng.gauss(latitude, SCATTER_DEGREES), rng.gauss(longitude, SCATTER_DEGREES)
+
+
+def _entry_date(rng, today):
+    return today + datetime.timedelta(days=rng.randint(0, 180))
+
+
+def users(rng, count):
+    for user_id in range(1, count + 1):
+        user_type = LOOKING_FOR_APT if rng.random() < 0.6 else LOOKING_FOR_ROOMMATE
+        yield {
+            "id": user_id, "name": f"User {user_id}", "email": f"user{user_id}@example.com",
+            "age": rng.randint(19, 40), "interests": [], "user_type": user_type,
+        }
+
+
+def user_preferences(rng, user_ids):
+    for user_id in user_ids:
+        smokes = rng.random() < 0.2
+        yield {
+            "user_id": user_id,
+            "works_from_home": rng.random() < 0.4,
+            "shares_cleaning": rng.random() < 0.7,
+            "has_or_wants_pet": rng.random() < 0.3,
+            "smokes": smokes,
+            "ok_with_smoker": smokes or rng.random() < 0.35,
+            "cleanliness_importance": rng.choices([1, 2, 3, 4, 5], weights=[1, 2, 4, 5, 4])[0],
+            "cleaning_frequency": rng.choice(FREQUENCIES),
+            "guest_frequency": rng.choice(FREQUENCIES),
+            "noise_sensitivity": rng.choice(NOISE),
+        }
+
+
+def apartment_preferences(rng, user_ids, today):
+    for user_id in user_ids:
+        city = _pick(rng, CITIES)
+        rent = CITY_RENT[city]
+        low = int(round(rent * rng.uniform(0.5, 1.0), -2))
+        wanted = [f for f, p in FEATURES.items() if rng.random() < p * 0.6]
+        rooms = sorted({_pick(rng, ROOMS) for _ in range(rng.randint(1, 2))})
+        latitude, longitude = _near(rng, city) if rng.random() < PREFERRED_LOCATION_RATE else (None, None)
+        yield {
+            "id": user_id, "user_id": user_id,
+            "preferred_city": city,
+            "preferred_area": _pick(rng, AREAS),
+            "preferred_contract_type": _pick(rng, CONTRACT_TYPES),
+            "preferred_features": wanted,
+            "preferred_features_mask": features_mask(wanted),
+            "preferred_num_rooms": [float(r) for r in rooms],
+            "preferred_price_min": low,
+            "preferred_price_max": low + int(round(rent * rng.uniform(0.3, 1.0), -2)),
+            "preferred_date_of_entry": _entry_date(rng, today),
+            "preferred_latitude": latitude,
+            "preferred_longitude": longitude,
+        }
+
+
+def apartments(rng, count, owner_ids, today):
+    for apartment_id in range(1, count + 1):
+        city = _pick(rng, CITIES)
+        features = [f for f, p in FEATURES.items() if rng.random() < p]
+        latitude, longitude = _near(rng, city)
+        yield {
+            "id": apartment_id,
+            "address": f"{rng.randint(1, 200)} Herzl St",
+            "city": city,
+            "area": _pick(rng, AREAS),
+            "contract_type": _pick(rng, CONTRACT_TYPES),
+            "price_per_month": _rent(rng, city),
+            "num_rooms": _pick(rng, ROOMS),
+            "features": features,
+            "features_mask": features_mask(features),
+            "latitude": latitude,
+            "longitude": longitude,
+            "geo_cell": grid_cell(latitude, longitude),
+            "description": "Furnished",
+            "date_of_entry": _entry_date(rng, today),
+            "image_urls": [],
+            "roommate_id": [rng.choice(owner_ids)] if owner_ids else [],
+        }
+
+
+def _bulk_insert(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.execute(insert(model), batch)
+
+
+def generate(db, apartment_count, user_count, seed=0, today=None):
+    """Insert a synthetic population; returns ids useful for driving requests"""
+    rng = random.Random(seed)
+    today = today or datetime.date(2025, 1, 1)
+
+    people = list(users(rng, user_count))
+    seekers = [u["id"] for u in people if u["user_type"] == LOOKING_FOR_APT]
+    owners = [u["id"] for u in people if u["user_type"] == LOOKING_FOR_ROOMMATE]
+
+    _bulk_insert(db, User, people)
+    _bulk_insert(db, UserPreference, user_preferences(rng, [u["id"] for u in people]))
+    _bulk_insert(db, UserApartmentPref, apartment_preferences(rng, seekers, today))
+    listed = set()
+
+    def track_owners(rows):
+        for row in rows:
+            listed.update(row["roommate_id"])
+            yield row
+
+    _bulk_insert(db, Apartment, track_owners(apartments(rng, apartment_count, owners, today)))
+    db.commit()
+    return {"seekers": seekers, "owners": sorted(listed)}
@@ -0,0 +1,315 @@
+"""Change feed that keeps the match service's in-memory data current.
+
+The frontend writes users, preferences and listings straight to Postgres, so
+anything the service holds in memory goes stale at once. With
+MATCH_CHANGE_FEED set, the service loads the data feeds are scored from into
+`live` once:
+
+- preferences: every user's lifestyle preferences (a PreferenceStore);
+- catalog: every apartment's scoring columns (an ApartmentCatalog);
+- search_prefs: every seeker's apartment search preferences;
+
+and a consumer thread applies row-level upserts and deletes to them in
+micro-batches: changes are collected for up to MATCH_CHANGE_WINDOW seconds
+(or MATCH_CHANGE_BATCH rows), the changed rows are reread in one query per
+table, and a new store/catalogue is swapped in. Feeds then rank from memory
+(feeds.py checks live.ready) and stay consistent within about a second.
+
+MATCH_CHANGE_FEED=notify listens on the match_changes channel, which the
+triggers of migrations/0005_change_feed.sql notify per written row (this
+needs psycopg2). MATCH_CHANGE_FEED=poll, for databases without
+notifications, reads rows whose updated_at passed the last watermark every
+MATCH_CHANGE_POLL seconds. updated_at can't show deletes, so both modes
+also compare the keys held against the table's every MATCH_CHANGE_RESYNC
+seconds, which also covers notifications lost while disconnected.
+"""
+import datetime
+import logging
+import os
+import select
+import threading
+import time
+
+from sqlalchemy import func, select as sql_select
+
+from match_cache import match_cache
+from models import Apartment, User, UserApartmentPref, UserPreference
+from preference_store import PREFERENCE_COLUMNS, load_preference_store
+from vector_scoring import CATALOG_COLUMNS, load_apartment_catalog
+
+log = logging.getLogger(__name__)
+
+MODE = os.environ.get("MATCH_CHANGE_FEED")
+CHANNEL = "match_changes"
+BATCH_SIZE = int(os.environ.get("MATCH_CHANGE_BATCH", 500))
+BATCH_WINDOW = float(os.environ.get("MATCH_CHANGE_WINDOW", 0.2))
+POLL_INTERVAL = float(os.environ.get("MATCH_CHANGE_POLL", 1.0))
+RESYNC_INTERVAL = float(os.environ.get("MATCH_CHANGE_RESYNC", 60.0))
+
+# Rows stamped this long before the watermark are read again, for
+# transactions that commit after a later one (updated_at is the
+# transaction's start time)
+POLL_OVERLAP = datetime.timedelta(seconds=float(os.environ.get("MATCH_CHANGE_POLL_OVERLAP", 5)))
+
+# Tables the feed follows, with the column identifying a row
+TABLES = {
+    Apartment.__tablename__: Apartment.id,
+    UserApartmentPref.__tablename__: UserApartmentPref.user_id,
+    UserPreference.__tablename__: UserPreference.user_id,
+    User.__tablename__: User.id,
+}
+MODELS = {Apartment.__tablename__: Apartment, UserApartmentPref.__tablename__: UserApartmentPref,
+          UserPreference.__tablename__: UserPreference, User.__tablename__: User}
+
+
+class LiveData:
+    """The in-memory data feeds rank from, and a version per table.
+
+    A change replaces the data first and bumps the version after, so a
+    reader that takes the version before the data never caches new data
+    under an old version.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.preferences = None
+        self.catalog = None
+        self.search_prefs = {}
+        self.versions = dict.fromkeys(TABLES, 0)
+
+    def version(self, model):
+        return self.versions[model.__tablename__]
+
+    def load(self, db):
+        """Load everything from scratch"""
+        self.preferences = load_preference_store(db)
+        self.catalog = load_apartment_catalog(db)
+        self.search_prefs = {pref.user_id: pref for pref in db.query(UserApartmentPref)}
+        db.expunge_all()
+        for table in self.versions:
+            self.versions[table] += 1
+        self.ready = True
+
+    def keys(self, table):
+        """Keys of the rows held for table (None for tables only invalidated)"""
+        if table == Apartment.__tablename__:
+            return set(self.catalog.ids.tolist())
+        if table == UserApartmentPref.__tablename__:
+            return set(self.search_prefs)
+        if table == UserPreference.__tablename__:
+            return set(self.preferences.ids.tolist())
+        return None
+
+    def apply(self, db, changes):
+        """Reread the changed rows ({table: keys}) and apply them; returns rows applied"""
+        applied = 0
+        for table, keys in changes.items():
+            if not keys:
+                continue
+            key = TABLES[table]
+            keys = list(keys)
+            if table == Apartment.__tablename__:
+                rows = db.query(*CATALOG_COLUMNS).filter(key.in_(keys)).all()
+                self.catalog = self.catalog.updated(rows, set(keys) - {row.id for row in rows})
+            elif table == UserPreference.__tablename__:
+                rows = db.query(*PREFERENCE_COLUMNS).filter(key.in_(keys)).all()
+                self.preferences = self.preferences.updated(rows, set(keys) - {row.user_id for row in rows})
+            elif table == UserApartmentPref.__tablename__:
+                rows = {pref.user_id: pref for pref in db.query(UserApartmentPref).filter(key.in_(keys))}
+                db.expunge_all()
+                search_prefs = dict(self.search_prefs)
+                for user_id in keys:
+                    if user_id in rows:
+                        search_prefs[user_id] = rows[user_id]
+                    else:
+                        search_prefs.pop(user_id, None)
+                self.search_prefs = search_prefs
+            if table != Apartment.__tablename__:
+                # Cached rankings of these users; everyone else's follow the versions
+                for user_id in keys:
+                    match_cache.invalidate(user_id)
+            self.versions[table] += 1
+            applied += len(keys)
+        return applied
+
+
+def changed_since(db, table, watermark, seen):
+    """Keys of rows in table with updated_at past watermark - POLL_OVERLAP.
+
+    seen maps key -> updated_at of rows already returned inside the overlap,
+    so each write comes back once; returns (keys, new watermark).
+    """
+    model = MODELS[table]
+    query = db.query(TABLES[table], model.updated_at)
+    if watermark is not None:
+        query = query.filter(model.updated_at > watermark - POLL_OVERLAP)
+    keys = []
+    for key, stamp in query:
+        if stamp is None or seen.get(key) == stamp:
+            continue
+        seen[key] = stamp
+        keys.append(key)
+        if watermark is None or stamp > watermark:
+            watermark = stamp
+    if watermark is not None:
+        for key in [key for key, stamp in seen.items() if stamp <= watermark - POLL_OVERLAP]:
+            del seen[key]
+    return keys, watermark
+
+
+class ChangeConsumer:
+    """Loads `data` and keeps it current from NOTIFY or updated_at polling"""
+
+    def __init__(self, data, mode=MODE, clock=time.monotonic):
+        self.data = data
+        self.mode = mode
+        self.clock = clock
+        self.stats = {"batches": 0, "rows": 0, "resyncs": 0, "errors": 0, "connects": 0,
+                      "lag_seconds": 0.0, "last_batch_seconds": 0.0}
+        self.error = None
+        self.watermarks = dict.fromkeys(TABLES)
+        self._seen = {table: {} for table in TABLES}
+        self._next_resync = None
+        self._stop = threading.Event()
+
+    @property
+    def ready(self):
+        return not self.mode or self.data.ready
+
+    def poll(self, db):
+        """Keys written since the watermarks, per table"""
+        changes = {}
+        for table in TABLES:
+            keys, self.watermarks[table] = changed_since(db, table, self.watermarks[table], self._seen[table])
+            changes[table] = set(keys)
+        db.rollback()
+        return changes
+
+    def resync(self, db):
+        """Keys held but no longer in the database (deletes polling can't see), per table"""
+        changes = {}
+        for table, key in TABLES.items():
+            held = self.data.keys(table)
+            if held is not None:
+                changes[table] = held - set(db.scalars(sql_select(key)))
+        db.rollback()
+        self.stats["resyncs"] += 1
+        self._next_resync = self.clock() + RESYNC_INTERVAL
+        return changes
+
+    def apply(self, db, changes, received=None):
+        """Apply one micro-batch; received is when its first change arrived"""
+        if not any(changes.values()):
+            return 0
+        start = self.clock()
+        rows = self.data.apply(db, changes)
+        db.rollback()
+        now = self.clock()
+        self.stats["batches"] += 1
+        self.stats["rows"] += rows
+        self.stats["last_batch_seconds"] = now - start
+        self.stats["lag_seconds"] = now - (received if received is not None else start)
+        return rows
+
+    def load(self, db):
+        """Load the data, taking the watermarks first so no write in between is missed"""
+        for table, model in MODELS.items():
+            self.watermarks[table] = db.query(func.max(model.updated_at)).scalar()
+        self.data.load(db)
+        db.rollback()
+        self._next_resync = self.clock() + RESYNC_INTERVAL
+
+    def run(self, engine, session_factory):
+        """Load, then follow changes until stop(); reconnects after errors"""
+        while not self._stop.is_set():
+            db = session_factory()
+            try:
+                if not self.data.ready:
+                    self.load(db)
+                if self.mode == "notify":
+                    self._listen(engine, db)
+                else:
+                    self._poll_loop(db)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.error = f"{type(e).__name__}: {e}"
+                log.exception("change feed failed, reconnecting")
+                self._stop.wait(POLL_INTERVAL)
+            finally:
+                db.close()
+
+    def _due_resync(self, db, changes, catch_up=False):
+        if self.clock() >= self._next_resync:
+            found = [self.resync(db)] + ([self.poll(db)] if catch_up else [])
+            for batch in found:
+                for table, keys in batch.items():
+                    changes.setdefault(table, set()).update(keys)
+
+    def _poll_loop(self, db):
+        while not self._stop.is_set():
+            received = self.clock()
+            changes = self.poll(db)
+            self._due_resync(db, changes)
+            self.apply(db, changes, received)
+            self._stop.wait(POLL_INTERVAL)
+
+    def _listen(self, engine, db):
+        raw = engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            if not hasattr(conn, "notifies"):
+                log.warning("%s can't LISTEN, polling instead", type(conn).__module__)
+                self.mode = "poll"
+                return
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self.stats["connects"] += 1
+            # Catch up on writes made before LISTEN took effect
+            self.apply(db, self.poll(db))
+            while not self._stop.is_set():
+                changes, received = self._collect(conn)
+                # Also read what updated_at shows, in case a notification was lost
+                self._due_resync(db, changes, catch_up=True)
+                self.apply(db, changes, received)
+        finally:
+            raw.invalidate()
+
+    def _collect(self, conn):
+        """Notifications for up to BATCH_WINDOW after the first, or BATCH_SIZE of them"""
+        changes, received, count = {}, None, 0
+        deadline = self.clock() + POLL_INTERVAL
+        while count < BATCH_SIZE and not self._stop.is_set():
+            timeout = deadline - self.clock()
+            if timeout <= 0:
+                break
+            if select.select([conn], [], [], timeout)[0]:
+                conn.poll()
+            for notify in conn.notifies:
+                table, _, key = notify.payload.partition(":")
+                if table in TABLES and key:
+                    changes.setdefault(table, set()).add(int(key))
+                    count += 1
+                    if received is None:
+                        received = self.clock()
+                        deadline = received + BATCH_WINDOW
+            conn.notifies.clear()
+        return changes, received
+
+    def start(self, engine, session_factory):
+        """run() on a background thread"""
+        thread = threading.Thread(target=self.run, args=(engine, session_factory),
+                                  name="match-change-feed", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self):
+        return dict(self.stats, mode=self.mode, ready=int(self.ready), error=self.error,
+                    **{f"{table}_version": version for table, version in self.data.versions.items()})
+
+
+live = LiveData()
+consumer = ChangeConsumer(live)
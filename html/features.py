@@ -0,0 +1,46 @@
+"""Apartment feature vocabulary and feature bitmasks.
+
+The frontend offers a fixed set of features (apt-pref.html, upload-apt.html,
+emojis stripped client-side), so each gets a bit. Apartments and apartment
+preferences persist their features as a BIGINT mask next to the array
+(features_mask / preferred_features_mask), kept in sync by ORM events in
+models.py and by triggers from migrations/0002_feature_masks.sql; bulk
+inserts that skip ORM events must set them (see benchmarks/synthetic.py).
+
+Features outside the vocabulary set OTHER_FEATURES instead of a bit of their
+own. When both sides carry it, the overlap is counted from the arrays, so
+scores stay identical to the set-intersection rule.
+"""
+
+# Bit i is FEATURES[i]; keep migrations/0002_feature_masks.sql in sync
+FEATURES = ('Balcony', 'Elevator', 'Mamad', 'Wifi', 'Parking', 'Storage', 'Accessible')
+FEATURE_BITS = {name: 1 << bit for bit, name in enumerate(FEATURES)}
+
+# Set when a feature list has anything not in FEATURES
+OTHER_FEATURES = 1 << 62
+
+REGISTERED_FEATURES = (1 << len(FEATURES)) - 1
+
+
+def features_mask(features):
+    """Mask for a feature list; None stays None"""
+    if features is None:
+        return None
+    mask = 0
+    for feature in features:
+        mask |= FEATURE_BITS.get(feature, OTHER_FEATURES)
+    return mask
+
+
+def feature_overlap(user_pref, apt):
+    """Number of distinct preferred features the apartment has"""
+    wanted = getattr(user_pref, 'preferred_features_mask', None)
+    have = getattr(apt, 'features_mask', None)
+    if wanted is not None and have is not None and not wanted & have & OTHER_FEATURES:
+        return (wanted & have & REGISTERED_FEATURES).bit_count()
+    return len(set(user_pref.preferred_features).intersection(set(apt.features)))
+
+
+def mask_bits(mask):
+    """The single-bit masks set in mask"""
+    return [1 << bit for bit in range(mask.bit_length()) if mask >> bit & 1]
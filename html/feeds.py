@@ -0,0 +1,634 @@
+"""Match feed pages, shared by the Flask engine and the ASGI service.
+
+Each function takes a synchronous Session and returns the response payload,
+or None when the user has no preferences. Scores follow `plan`, a
+ScoringPlan (the user's profile from weight_profiles when not given);
+match_service.MatchService is the usual way in. The ASGI service runs the
+ones that score on worker threads and the index reads through
+AsyncSession.run_sync, over the async driver.
+"""
+import heapq
+import math
+import os
+
+from models import Apartment, User, UserApartmentPref, UserPreference
+from weight_profiles import profiles
+from preference_store import PREFERENCE_COLUMNS, PreferenceStore, load_preference_store
+from vector_scoring import (CATALOG_COLUMNS, ApartmentCatalog, load_apartment_catalog, score_apartments,
+                            score_user_pairs)
+from query_planner import ApartmentQueryPlan, UserQueryPlan, ranked_prefix, ranked_users
+from ranking import bounded_top_k, rank_scores
+from match_index import APARTMENTS, USERS, built_for, read_page
+from change_feed import live
+from match_cache import match_cache, preference_index, preference_snapshot, row_fingerprint, candidate_set_version
+from geo import distance_km, near
+from instrumentation import count, phase
+from serialization import RecordSerializer
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import joinedload
+
+# Serve feed pages from the precomputed match index (kept fresh by match_index.py)
+USE_MATCH_INDEX = os.environ.get("MATCH_INDEX") == "1"
+
+# Rank user feeds through the approximate preference index (preference_ann.py)
+USE_USER_ANN = os.environ.get("MATCH_USER_ANN") == "1"
+
+# Minimum number of ranked apartments computed per cache fill
+RANK_PREFETCH = 50
+
+# Rows fetched per round trip by the streaming exports
+STREAM_CHUNK = 1000
+
+# Nearby search without a radius starts here and doubles up to the maximum
+NEARBY_START_KM = 2
+NEARBY_MAX_KM = 50
+
+# Most users one batch request may ask for (MATCH_BATCH_MAX_USERS)
+BATCH_MAX_USERS = int(os.environ.get("MATCH_BATCH_MAX_USERS", 1000))
+
+# ?ranking=: one-sided scores, or the two-sided batch ranking of stable_match.py
+RANKINGS = ("score", "mutual")
+
+# "details" of each match; ?fields= picks a subset
+APARTMENT_DETAILS = RecordSerializer({
+    "city": "city",
+    "area": "area",
+    "price": "price_per_month",
+    "rooms": "num_rooms",
+    "features": "features",
+    "date_of_entry": "date_of_entry",
+})
+USER_DETAILS = RecordSerializer({
+    "works_from_home": "works_from_home",
+    "shares_cleaning": "shares_cleaning",
+    "has_or_wants_pet": "has_or_wants_pet",
+    "cleanliness_importance": "cleanliness_importance",
+    "cleaning_frequency": "cleaning_frequency",
+    "guest_frequency": "guest_frequency",
+    "noise_sensitivity": "noise_sensitivity",
+})
+
+
+def parse_ranking(params, allowed=RANKINGS):
+    """The requested ranking; raises ValueError if it isn't one of allowed"""
+    ranking = params.get("ranking", "score")
+    if ranking not in allowed:
+        raise ValueError(f"ranking must be one of: {', '.join(allowed)}")
+    return ranking
+
+
+def _pagination(page, per_page, total_results):
+    return {
+        "current_page": page,
+        "total_pages": math.ceil(total_results / per_page),
+        "total_results": total_results,
+        "per_page": per_page
+    }
+
+
+def _page_slice(ids, scores, page, per_page):
+    start = max(0, (page - 1) * per_page)
+    return list(zip(ids[start:start + per_page].tolist(), scores[start:start + per_page].tolist()))
+
+
+def _index_serves(db, plan):
+    # Only while the index holds this plan's scores; after a profile change it
+    # is skipped until the worker has rebuilt it
+    return USE_MATCH_INDEX and built_for(db, plan)
+
+
+def _rank_catalog(user_pref, catalog, plan, min_score, need):
+    # A prefix a few pages deep of a whole catalogue, scored in memory
+    ids, scores = rank_scores(score_apartments(user_pref, catalog, plan.apartment_weights), catalog.ids, min_score)
+    prefix = max(2 * need, RANK_PREFETCH)
+    return ids[:prefix], scores[:prefix], len(ids)
+
+
+def apartment_feed(db, user_id, min_score=0, page=1, per_page=10, details=APARTMENT_DETAILS, plan=None):
+    """One page of a seeker's apartment matches"""
+    if live.ready:
+        user_pref = live.search_prefs.get(user_id)
+    else:
+        user_pref = db.query(UserApartmentPref).filter_by(user_id=user_id).first()
+    if not user_pref:
+        return None
+    plan = plan or profiles.plan(user_id=user_id)
+
+    if _index_serves(db, plan):
+        # Read the page straight from the index
+        page_rows, total_results = read_page(db, user_id, APARTMENTS, page, per_page, min_score)
+    else:
+        if live.ready:
+            # Score the whole in-memory catalogue (kept current by change_feed.py)
+            candidates = live.version(Apartment)
+            catalog = live.catalog
+
+            def rank(need):
+                return _rank_catalog(user_pref, catalog, plan, min_score, need)
+        else:
+            # Rank a prefix a few pages deep, filtering and paginating in SQL; pages
+            # inside it are served from the cache without scoring
+            candidates = candidate_set_version(db, Apartment.id)
+
+            def rank(need):
+                query_plan = ApartmentQueryPlan(user_pref, plan.apartment_weights, min_score)
+                return ranked_prefix(db, query_plan, user_pref, plan.apartment_weights,
+                                     max(2 * need, RANK_PREFETCH))
+        version = (row_fingerprint(user_pref), candidates, plan.fingerprint)
+        with phase("scoring"):
+            ids, scores, total_results = match_cache.get_or_rank(
+                (user_id, APARTMENTS, min_score, plan.name), version, rank, page * per_page)
+        page_rows = _page_slice(ids, scores, page, per_page)
+
+    # Fetch just the columns shown for the apartments on this page
+    apartments = {
+        apt.id: apt
+        for apt in db.query(*details.columns(Apartment, "id")).filter(
+            Apartment.id.in_([target_id for target_id, _ in page_rows])
+        )
+    }
+    return {
+        "results": [
+            {"apartment_id": target_id, "match_score": score, "details": details(apartments[target_id])}
+            for target_id, score in page_rows if target_id in apartments
+        ],
+        "pagination": _pagination(page, per_page, total_results)
+    }
+
+
+def shared_preference_store(db, current, population):
+    """The shared preference store, reloaded if its copy of the user's own row is stale"""
+    store = preference_snapshot.get_or_load(population, lambda: load_preference_store(db))
+    record = store.get(current.user_id)
+    if record is None or any(getattr(record, column.key) != getattr(current, column.key)
+                             for column in PREFERENCE_COLUMNS):
+        preference_snapshot.invalidate()
+        store = preference_snapshot.get_or_load(population, lambda: load_preference_store(db))
+    return store
+
+
+def _rank_users(store, user_id, plan, min_score, need):
+    # Every other user in the store, ranked against user_id
+    if USE_USER_ANN:
+        # Candidates from the nearest lists, rescored exactly; the total
+        # is exact too, as in the other rankings
+        from preference_ann import PreferenceANN
+        index = preference_index.get_or_load(store, lambda: PreferenceANN(store))
+        ids, scores, _ = index.search(user_id, plan.user_weights, max(2 * need, RANK_PREFETCH), min_score)
+        return ids, scores, index.count(user_id, plan.user_weights, min_score)
+    i = store.index_of(user_id)
+    scores = score_user_pairs(store.records[i:i + 1], store.records, plan.user_weights)[0]
+    # Skip the user themselves and pairs match_users can't score
+    keep = (store.ids != user_id) & (scores >= 0)
+    ids, scores = rank_scores(scores[keep], store.ids[keep], min_score)
+    return ids, scores, len(ids)
+
+
+def _rank_user_feed(db, current, plan, min_score, need, load_store):
+    # user_feed's ranking, shared with user_feed_batch
+    if not (live.ready or USE_USER_ANN):
+        query_plan = UserQueryPlan(current, plan.user_weights, min_score)
+        if query_plan.selective:
+            # min_score rules some users out: filter, rank and cut off in SQL
+            return ranked_users(db, query_plan, max(2 * need, RANK_PREFETCH))
+    return _rank_users(load_store(), current.user_id, plan, min_score, need)
+
+
+def user_feed(db, user_id, min_score=0, page=1, per_page=10, details=USER_DETAILS, plan=None):
+    """One page of a user's roommate-compatibility matches"""
+    if live.ready:
+        current = live.preferences.get(user_id)
+    else:
+        current = db.query(UserPreference).filter_by(user_id=user_id).first()
+    if not current:
+        return None
+    plan = plan or profiles.plan(user_id=user_id)
+
+    if _index_serves(db, plan):
+        # Read the page straight from the index
+        page_rows, total_results = read_page(db, user_id, USERS, page, per_page, min_score)
+    else:
+        # Rank all other users once per preference/population version; later
+        # pages are served from the cache without scoring
+        if live.ready:
+            # The in-memory store (kept current by change_feed.py) covers the user's own row
+            version = (live.version(UserPreference), plan.fingerprint)
+            store = live.preferences
+            load_store = lambda: store
+        else:
+            population = candidate_set_version(db, UserPreference.user_id)
+            version = (row_fingerprint(current), population, plan.fingerprint)
+            load_store = lambda: shared_preference_store(db, current, population)
+
+        def rank(need):
+            return _rank_user_feed(db, current, plan, min_score, need, load_store)
+        with phase("scoring"):
+            ids, scores, total_results = match_cache.get_or_rank(
+                (user_id, USERS, min_score, plan.name), version, rank, page * per_page)
+        page_rows = _page_slice(ids, scores, page, per_page)
+
+    # Fetch just the columns shown for the users on this page
+    others = {
+        other.user_id: other
+        for other in db.query(*details.columns(UserPreference, "user_id")).filter(
+            UserPreference.user_id.in_([target_id for target_id, _ in page_rows])
+        )
+    }
+    return {
+        "results": [
+            {"user_id": target_id, "match_score": score, "details": details(others[target_id])}
+            for target_id, score in page_rows if target_id in others
+        ],
+        "pagination": _pagination(page, per_page, total_results)
+    }
+
+
+def mutual_apartment_feed(db, user_id, min_score=0, page=1, per_page=10, details=APARTMENT_DETAILS):
+    """One page of a seeker's stable_match.py ranking: the assigned listing
+    first, then by mutual score. None if the batch hasn't ranked them"""
+    # Imported here: mutual rankings are opt-in and off the startup path
+    import stable_match
+    page_rows, total_results = stable_match.read_page(
+        db, user_id, stable_match.APARTMENTS, page, per_page, min_score)
+    if not total_results and not stable_match.has_ranking(db, user_id, stable_match.APARTMENTS):
+        return None
+    apartments = {
+        apt.id: apt
+        for apt in db.query(*details.columns(Apartment, "id")).filter(
+            Apartment.id.in_([target_id for target_id, _, _ in page_rows])
+        )
+    }
+    return {
+        "results": [
+            {"apartment_id": target_id, "match_score": score, "assigned": assigned,
+             "details": details(apartments[target_id])}
+            for target_id, score, assigned in page_rows if target_id in apartments
+        ],
+        "pagination": _pagination(page, per_page, total_results)
+    }
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def apartment_stream(db, user_id, min_score=0, details=APARTMENT_DETAILS, plan=None):
+    """Every apartment scoring at least min_score for a seeker, in id order.
+
+    Returns None when the user has no preferences, else a generator of
+    records that reads candidates through a server-side cursor STREAM_CHUNK
+    rows at a time and scores each chunk as it arrives, so memory stays flat
+    and the first records are out before the scan ends. Unranked: consumers
+    that need the order sort on match_score themselves.
+    """
+    user_pref = db.query(UserApartmentPref).filter_by(user_id=user_id).first()
+    if not user_pref:
+        return None
+    plan = plan or profiles.plan(user_id=user_id)
+    query_plan = ApartmentQueryPlan(user_pref, plan.apartment_weights, min_score)
+    catalog_keys = {column.key for column in CATALOG_COLUMNS}
+    extra = [column for column in details.columns(Apartment) if column.key not in catalog_keys]
+    rows = db.query(*CATALOG_COLUMNS, *extra).filter(*query_plan.criteria) \
+        .order_by(Apartment.id).yield_per(STREAM_CHUNK)
+
+    def records():
+        for chunk in _chunks(rows, STREAM_CHUNK):
+            scores = score_apartments(user_pref, ApartmentCatalog(chunk), plan.apartment_weights).tolist()
+            for row, score in zip(chunk, scores):
+                if score >= min_score:
+                    yield {"apartment_id": row.id, "match_score": score, "details": details(row)}
+    return records()
+
+
+def user_stream(db, user_id, min_score=0, details=USER_DETAILS, plan=None):
+    """Every other user scoring at least min_score with a user, in id order.
+
+    Same contract as apartment_stream; each chunk is packed into a small
+    PreferenceStore together with the user's own row, so category codes agree.
+    """
+    current = db.query(*PREFERENCE_COLUMNS).filter(UserPreference.user_id == user_id).first()
+    if not current:
+        return None
+    plan = plan or profiles.plan(user_id=user_id)
+    rows = db.query(*PREFERENCE_COLUMNS).filter(UserPreference.user_id != user_id) \
+        .order_by(UserPreference.user_id).yield_per(STREAM_CHUNK)
+
+    def records():
+        for chunk in _chunks(rows, STREAM_CHUNK):
+            store = PreferenceStore.from_rows([current, *chunk])
+            i = store.index_of(user_id)
+            scores = score_user_pairs(store.records[i:i + 1], store.records, plan.user_weights)[0]
+            by_id = {row.user_id: row for row in chunk}
+            for other_id, score in zip(store.ids.tolist(), scores.tolist()):
+                # Skip the user themselves and pairs match_users can't score
+                if other_id != user_id and score >= 0 and score >= min_score:
+                    yield {"user_id": other_id, "match_score": score, "details": details(by_id[other_id])}
+    return records()
+
+
+def parse_nearby(params):
+    """(latitude, longitude, radius_km, limit) from lat, lon, radius_km and limit query parameters"""
+    try:
+        latitude, longitude = float(params["lat"]), float(params["lon"])
+    except (KeyError, ValueError):
+        raise ValueError("lat and lon are required numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("lat/lon out of range")
+    radius_km = params.get("radius_km")
+    radius_km = float(radius_km) if radius_km is not None else None
+    if radius_km is not None and not 0 < radius_km <= NEARBY_MAX_KM:
+        raise ValueError(f"radius_km must be in (0, {NEARBY_MAX_KM}]")
+    return latitude, longitude, radius_km, int(params.get("limit", 10))
+
+
+def parse_batch(body, params, max_users=BATCH_MAX_USERS):
+    """(user_id, min_score, page, per_page) per user of a batch request body.
+
+    body is {"users": [...]}, each entry a user id or an object with
+    user_id and any of min_score, page and per_page; missing values come
+    from the query parameters, as on the single-user feeds.
+    """
+    users = body.get("users") if isinstance(body, dict) else None
+    if not isinstance(users, list) or not users:
+        raise ValueError('body must be {"users": [user_id or {"user_id", "page", "per_page", "min_score"}, ...]}')
+    if len(users) > max_users:
+        raise ValueError(f"at most {max_users} users per batch")
+    defaults = {"min_score": int(params.get("min_score", 0)), "page": int(params.get("page", 1)),
+                "per_page": int(params.get("per_page", 10))}
+    requests = []
+    for entry in users:
+        if not isinstance(entry, dict):
+            entry = {"user_id": entry}
+        values = dict(defaults, **entry)
+        if not all(isinstance(values[key], int) and not isinstance(values[key], bool)
+                   for key in ("user_id", *defaults)):
+            raise ValueError("user_id, min_score, page and per_page must be integers")
+        if values["page"] < 1 or values["per_page"] < 1:
+            raise ValueError("page and per_page must be at least 1")
+        requests.append((values["user_id"], values["min_score"], values["page"], values["per_page"]))
+    return requests
+
+
+def nearby_feed(db, latitude, longitude, radius_km=None, limit=10, details=APARTMENT_DETAILS):
+    """Nearest `limit` apartments to a point, within radius_km if given.
+
+    Without a radius the search starts at NEARBY_START_KM and doubles until
+    it has `limit` apartments or reaches NEARBY_MAX_KM. Either way only the
+    rows in the grid cells around the point are read (see geo.near).
+    """
+    radius = radius_km or NEARBY_START_KM
+    columns = details.columns(Apartment, "id", "latitude", "longitude")
+    with phase("scoring"):
+        while True:
+            rows = db.query(*columns).filter(near(Apartment, latitude, longitude, radius)).all()
+            found = []
+            for row in rows:
+                distance = distance_km(latitude, longitude, row.latitude, row.longitude)
+                if distance <= radius:
+                    found.append((distance, row.id, row))
+            if radius_km or len(found) >= limit or radius >= NEARBY_MAX_KM:
+                break
+            radius = min(2 * radius, NEARBY_MAX_KM)
+        nearest = heapq.nsmallest(limit, found, key=lambda f: f[:2])
+    return {
+        "results": [
+            {"apartment_id": id, "distance_km": round(distance, 3), "details": details(row)}
+            for distance, id, row in nearest
+        ]
+    }
+
+
+def _owned_by(db, user_id):
+    if db.get_bind().dialect.name == "sqlite":
+        # roommate_id is a JSON array there (see models.array_of)
+        return text(
+            "EXISTS (SELECT 1 FROM json_each(apartments.roommate_id) WHERE value = :owner)"
+        ).bindparams(owner=user_id)
+    return Apartment.roommate_id.contains([user_id])
+
+
+def _owned_by_any(db, user_ids):
+    if db.get_bind().dialect.name == "sqlite":
+        return text(
+            "EXISTS (SELECT 1 FROM json_each(apartments.roommate_id) WHERE value IN :owners)"
+        ).bindparams(bindparam("owners", list(user_ids), expanding=True))
+    return Apartment.roommate_id.overlap(list(user_ids))
+
+
+def mutual_roommate_feed(db, user_id, record, k=5):
+    """An owner's top k seekers from stable_match.py, assigned ones first"""
+    import stable_match
+    page_rows, _ = stable_match.read_page(db, user_id, stable_match.ROOMMATES, 1, k)
+    seekers = {user.id: user for user in db.query(User).filter(
+        User.id.in_([target_id for target_id, _, _ in page_rows]))}
+    return {
+        "results": [
+            {"roommate": record(seekers[target_id]), "match_score": score, "assigned": assigned}
+            for target_id, score, assigned in page_rows if target_id in seekers
+        ]
+    }
+
+
+def roommate_feed(db, user_id, record, k=5, plan=None):
+    """Top k apartment seekers for an owner's listing.
+
+    A seeker qualifies when the listing scores at least the plan's
+    roommate_threshold against their apartment preferences; they are then
+    ranked by lifestyle compatibility with the owner (ScoringPlan.roommate_score).
+
+    Seekers are ranked branch-and-bound style: a cheap upper bound from city
+    and price (the apartment gate) and smoking and cleanliness (lifestyle)
+    orders them, and full scores are computed only while a bound can still
+    reach the top k. The ranking is the same as scoring every seeker; the
+    number skipped is counted as "roommate_candidates_pruned".
+    """
+    user_apt = db.query(Apartment).filter(_owned_by(db, user_id)).order_by(Apartment.id).first()
+    if not user_apt:
+        return {"results": []}
+    owner_prefs = db.query(UserPreference).filter(UserPreference.user_id == user_id).first()
+    seekers = _seekers(db).filter(User.id != user_id).all()
+    return _top_seekers(user_id, user_apt, owner_prefs, seekers, record, k, plan or profiles.plan(user_id=user_id))
+
+
+def _seekers(db):
+    return db.query(User).options(
+        joinedload(User.apartment_preferences),
+        joinedload(User.user_preferences)
+    ).filter(User.user_type == "Looking for Apt")
+
+
+def _top_seekers(user_id, user_apt, owner_prefs, seekers, record, k, plan):
+    def bound(seeker):
+        return plan.roommate_score_bound(user_apt, owner_prefs, seeker)
+
+    def full_score(seeker):
+        return plan.roommate_score(user_apt, owner_prefs, seeker)
+
+    with phase("scoring"):
+        best, pruned = bounded_top_k(
+            ((seeker.id, seeker) for seeker in seekers if seeker.apartment_preferences and seeker.id != user_id),
+            k, bound, full_score)
+    count("roommate_candidates_pruned", pruned)
+    return {
+        "results": [
+            {"roommate": record(seeker), "match_score": score}
+            for score, _, seeker in best
+        ]
+    }
+
+
+def _batch_results(requests, pages, details, id_key, rows):
+    # Each user's payload in request order; rows holds the details of every match shown
+    results = []
+    for i, (user_id, _, page, per_page) in enumerate(requests):
+        if i not in pages:
+            results.append({"user_id": user_id, "error": "User preferences not found"})
+            continue
+        page_rows, total_results = pages[i]
+        results.append({
+            "user_id": user_id,
+            "results": [
+                {id_key: target_id, "match_score": score, "details": details(rows[target_id])}
+                for target_id, score in page_rows if target_id in rows
+            ],
+            "pagination": _pagination(page, per_page, total_results)
+        })
+    return {"results": results}
+
+
+def apartment_feed_batch(db, requests, details=APARTMENT_DETAILS, plan_for=None):
+    """apartment_feed for many seekers at once, for prefetching and notification runs.
+
+    requests are (user_id, min_score, page, per_page) tuples (parse_batch);
+    each user gets the page apartment_feed would return, or an error entry.
+    All search preferences come in one query. Seekers are grouped by
+    preferred_city and each group's candidates are read in one scan: the
+    city's apartments when no other apartment can reach their min_score
+    (city is a mandatory criterion of their query plans), else every
+    apartment, read at most once per batch. Rankings share the match cache
+    with apartment_feed; the apartments shown are fetched in one query.
+    """
+    plan_for = plan_for or (lambda user_id: profiles.plan(user_id=user_id))
+    user_ids = list({user_id for user_id, _, _, _ in requests})
+    if live.ready:
+        prefs = {user_id: live.search_prefs[user_id] for user_id in user_ids if user_id in live.search_prefs}
+        candidates = live.version(Apartment)
+    else:
+        prefs = {pref.user_id: pref for pref in
+                 db.query(UserApartmentPref).filter(UserApartmentPref.user_id.in_(user_ids))}
+        candidates = candidate_set_version(db, Apartment.id)
+
+    scans = {}
+
+    def scan(city_only, city):
+        # One candidate read per city group, plus one of every apartment
+        if live.ready:
+            return live.catalog
+        key = (city_only, city if city_only else None)
+        if key not in scans:
+            scans[key] = load_apartment_catalog(db, *([Apartment.city == city] if city_only else []))
+        return scans[key]
+
+    pages = {}
+    with phase("scoring"):
+        for i, (user_id, min_score, page, per_page) in enumerate(requests):
+            if user_id not in prefs:
+                continue
+            user_pref = prefs[user_id]
+            plan = plan_for(user_id)
+            if _index_serves(db, plan):
+                pages[i] = read_page(db, user_id, APARTMENTS, page, per_page, min_score)
+                continue
+
+            def rank(need, user_pref=user_pref, plan=plan, min_score=min_score):
+                query_plan = ApartmentQueryPlan(user_pref, plan.apartment_weights, min_score)
+                catalog = scan('city' in query_plan.mandatory, user_pref.preferred_city)
+                return _rank_catalog(user_pref, catalog, plan, min_score, need)
+            version = (row_fingerprint(user_pref), candidates, plan.fingerprint)
+            ids, scores, total_results = match_cache.get_or_rank(
+                (user_id, APARTMENTS, min_score, plan.name), version, rank, page * per_page)
+            pages[i] = (_page_slice(ids, scores, page, per_page), total_results)
+
+    # Fetch the columns shown for every page at once
+    shown = {target_id for page_rows, _ in pages.values() for target_id, _ in page_rows}
+    apartments = {apt.id: apt for apt in db.query(*details.columns(Apartment, "id")).filter(Apartment.id.in_(shown))}
+    return _batch_results(requests, pages, details, "apartment_id", apartments)
+
+
+def user_feed_batch(db, requests, details=USER_DETAILS, plan_for=None):
+    """user_feed for many users at once; requests as for apartment_feed_batch.
+
+    Their preference rows come in one query and each user is ranked as in
+    user_feed (in SQL when min_score is selective, else against the one
+    shared preference store), sharing the match cache with it.
+    """
+    plan_for = plan_for or (lambda user_id: profiles.plan(user_id=user_id))
+    user_ids = list({user_id for user_id, _, _, _ in requests})
+    if live.ready:
+        store = live.preferences
+        population = live.version(UserPreference)
+        prefs = {user_id: record for user_id, record in ((user_id, store.get(user_id)) for user_id in user_ids)
+                 if record is not None}
+    else:
+        population = candidate_set_version(db, UserPreference.user_id)
+        prefs = {pref.user_id: pref for pref in
+                 db.query(UserPreference).filter(UserPreference.user_id.in_(user_ids))}
+
+    pages = {}
+    with phase("scoring"):
+        for i, (user_id, min_score, page, per_page) in enumerate(requests):
+            if user_id not in prefs:
+                continue
+            current = prefs[user_id]
+            plan = plan_for(user_id)
+            if _index_serves(db, plan):
+                pages[i] = read_page(db, user_id, USERS, page, per_page, min_score)
+                continue
+            if live.ready:
+                version = (population, plan.fingerprint)
+                load_store = lambda: store
+            else:
+                version = (row_fingerprint(current), population, plan.fingerprint)
+                load_store = lambda current=current: shared_preference_store(db, current, population)
+
+            def rank(need, current=current, plan=plan, min_score=min_score, load_store=load_store):
+                return _rank_user_feed(db, current, plan, min_score, need, load_store)
+            ids, scores, total_results = match_cache.get_or_rank(
+                (user_id, USERS, min_score, plan.name), version, rank, page * per_page)
+            pages[i] = (_page_slice(ids, scores, page, per_page), total_results)
+
+    shown = {target_id for page_rows, _ in pages.values() for target_id, _ in page_rows}
+    others = {other.user_id: other for other in db.query(*details.columns(UserPreference, "user_id")).filter(
+        UserPreference.user_id.in_(shown))}
+    return _batch_results(requests, pages, details, "user_id", others)
+
+
+def roommate_feed_batch(db, user_ids, record, k=5, plan_for=None):
+    """roommate_feed for many owners: {user_id: {"results": [...]}}.
+
+    The owners' listings and preference rows come in one query each and the
+    seekers are loaded once for the whole batch.
+    """
+    plan_for = plan_for or (lambda user_id: profiles.plan(user_id=user_id))
+    user_ids = list(dict.fromkeys(user_ids))
+    listings = {}
+    for apartment in db.query(Apartment).filter(_owned_by_any(db, user_ids)).order_by(Apartment.id):
+        for owner in apartment.roommate_id or ():
+            listings.setdefault(owner, apartment)
+    owners = [user_id for user_id in user_ids if user_id in listings]
+    owner_prefs = {pref.user_id: pref for pref in
+                   db.query(UserPreference).filter(UserPreference.user_id.in_(owners))}
+    seekers = _seekers(db).all() if owners else []
+    return {
+        user_id: _top_seekers(user_id, listings[user_id], owner_prefs.get(user_id), seekers, record, k,
+                              plan_for(user_id))
+        if user_id in listings else {"results": []}
+        for user_id in user_ids
+    }
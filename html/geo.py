@@ -0,0 +1,114 @@
+"""Apartment coordinates, distances and the grid cell index.
+
+Apartments carry latitude/longitude (set from the reverse-geocoded position
+in apt-feed.html / roomate.html) and a geo_cell: the key of the
+1/CELLS_PER_DEGREE degree grid square they fall in. geo_cell is B-tree
+indexed, so "apartments within r km" is a lookup of the few cells covering
+the circle's bounding box, then an exact distance check on those rows only.
+It is kept in sync by ORM events in models.py and by the trigger from
+migrations/0003_apartment_location.sql; bulk inserts that skip ORM events
+must set it (see benchmarks/synthetic.py). With MATCH_POSTGIS=1 (after
+migrations/0004_postgis.sql) the lookup is ST_DWithin on a GiST index instead.
+
+Distances are equirectangular: exact enough at city scale, and made of
++ - * / and sqrt only, so scoring.py and vector_scoring.py get bit-identical
+results from the same formula.
+"""
+import math
+import os
+
+from sqlalchemy import Float, cast, func, literal
+from sqlalchemy.types import UserDefinedType
+
+# Serve radius queries with PostGIS (needs migrations/0004_postgis.sql)
+USE_POSTGIS = os.environ.get("MATCH_POSTGIS") == "1"
+
+# Location score falls linearly from full weight at 0 km to nothing here
+LOCATION_RADIUS_KM = float(os.environ.get("MATCH_LOCATION_RADIUS_KM", 5))
+
+# ST_DWithin measures on the ellipsoid; widen it so it never drops a point
+# distance_km puts inside the radius
+POSTGIS_SLACK = 1.01
+
+# Length of a degree of latitude (mean Earth radius * pi / 180)
+KM_PER_DEGREE = 111.195
+
+# Grid squares per degree; keep migrations/0003_apartment_location.sql in sync
+CELLS_PER_DEGREE = 20
+_LON_CELLS = 360 * CELLS_PER_DEGREE
+
+
+def grid_cell(latitude, longitude):
+    """Key of the grid square holding a point; None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    row = math.floor(latitude * CELLS_PER_DEGREE) + 90 * CELLS_PER_DEGREE
+    column = (math.floor(longitude * CELLS_PER_DEGREE) + 180 * CELLS_PER_DEGREE) % _LON_CELLS
+    return row * _LON_CELLS + column
+
+
+def preferred_location(user_pref):
+    """(latitude, longitude) a seeker wants to live near, or None"""
+    latitude = getattr(user_pref, 'preferred_latitude', None)
+    longitude = getattr(user_pref, 'preferred_longitude', None)
+    if latitude is None or longitude is None:
+        return None
+    return latitude, longitude
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    """Distance between two points; the other point may be NumPy arrays"""
+    km_per_degree_lon = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    north = (other_latitude - latitude) * KM_PER_DEGREE
+    east = (other_longitude - longitude) * km_per_degree_lon
+    return (north * north + east * east) ** 0.5
+
+
+def location_decay(distance):
+    """Share of the location weight earned at this distance"""
+    if distance < LOCATION_RADIUS_KM:
+        return 1.0 - distance / LOCATION_RADIUS_KM
+    return 0.0
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, north, west, east) degrees around a circle of radius_km"""
+    lat_delta = radius_km / KM_PER_DEGREE
+    # Widest at the edge nearest the pole
+    edge = min(89.0, abs(latitude) + lat_delta)
+    lon_delta = min(180.0, radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge))))
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Keys of every grid square that a circle of radius_km can touch"""
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    rows = range(math.floor(south * CELLS_PER_DEGREE), math.floor(north * CELLS_PER_DEGREE) + 1)
+    columns = range(math.floor(west * CELLS_PER_DEGREE), math.floor(east * CELLS_PER_DEGREE) + 1)
+    return [
+        (row + 90 * CELLS_PER_DEGREE) * _LON_CELLS + (column + 180 * CELLS_PER_DEGREE) % _LON_CELLS
+        for row in rows for column in columns
+    ]
+
+
+class Geography(UserDefinedType):
+    """PostGIS geography, for CASTs only (no GeoAlchemy dependency)"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "geography"
+
+
+def _geography(longitude, latitude):
+    # Same expression as the ix_apartments_geography index
+    return cast(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326), Geography())
+
+
+def near(model, latitude, longitude, radius_km):
+    """SQL criterion for model rows (with latitude/longitude/geo_cell) that
+    may lie within radius_km; callers check distance_km on what it returns"""
+    if USE_POSTGIS:
+        return func.ST_DWithin(_geography(model.longitude, model.latitude),
+                               _geography(literal(longitude, Float), literal(latitude, Float)),
+                               radius_km * 1000 * POSTGIS_SLACK)
+    return model.geo_cell.in_(covering_cells(latitude, longitude, radius_km))
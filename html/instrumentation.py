@@ -0,0 +1,209 @@
+"""Request-level instrumentation for the match services.
+
+init_app(app) records, for every request: wall time, time spent in SQL,
+number of SQL statements, rows fetched (as reported by the driver), and the
+time of any phase wrapped in `with phase("scoring"):` (excluding SQL run
+inside it), plus any counters bumped with count() (e.g. candidates pruned
+by the roommate ranking). Totals are served at /metrics in Prometheus text
+format.
+
+Setting MATCH_PROFILING=1 lets a request opt in to cProfile with the
+`X-Profile: 1` header or `?profile=1`; the response is then the pstats
+summary for that request instead of the normal body.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILING_ENABLED = os.environ.get("MATCH_PROFILING") == "1"
+
+# Request duration histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Thread-safe totals per endpoint, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)           # (endpoint, status) -> count
+        self.duration_buckets = defaultdict(int)   # (endpoint, le) -> count
+        self.duration_sum = defaultdict(float)     # endpoint -> seconds
+        self.duration_count = defaultdict(int)     # endpoint -> count
+        self.phase_sum = defaultdict(float)        # (endpoint, phase) -> seconds
+        self.phase_count = defaultdict(int)        # (endpoint, phase) -> count
+        self.statements = defaultdict(int)         # endpoint -> count
+        self.rows = defaultdict(int)               # endpoint -> count
+        self.counters = defaultdict(int)           # (name, endpoint) -> total
+        self.collectors = []                       # callables returning extra lines
+
+    def observe(self, endpoint, status, stats):
+        with self._lock:
+            self.requests[(endpoint, status)] += 1
+            self.duration_sum[endpoint] += stats["duration"]
+            self.duration_count[endpoint] += 1
+            for le in BUCKETS:
+                if stats["duration"] <= le:
+                    self.duration_buckets[(endpoint, le)] += 1
+            for name, seconds in stats["phases"].items():
+                self.phase_sum[(endpoint, name)] += seconds
+                self.phase_count[(endpoint, name)] += 1
+            self.statements[endpoint] += stats["statements"]
+            self.rows[endpoint] += stats["rows"]
+            for name, value in stats["counters"].items():
+                self.counters[(name, endpoint)] += value
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            metric("match_requests_total", "counter", "Requests served.",
+                   [((("endpoint", e), ("status", s)), n) for (e, s), n in sorted(self.requests.items())])
+            histogram = []
+            for endpoint in sorted(self.duration_count):
+                for le in BUCKETS:
+                    histogram.append(((("endpoint", endpoint), ("le", le)),
+                                      self.duration_buckets[(endpoint, le)]))
+                histogram.append(((("endpoint", endpoint), ("le", "+Inf")), self.duration_count[endpoint]))
+            lines.append("# HELP match_request_duration_seconds Request wall time.")
+            lines.append("# TYPE match_request_duration_seconds histogram")
+            for labels, value in histogram:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"match_request_duration_seconds_bucket{{{label_text}}} {value}")
+            for endpoint in sorted(self.duration_count):
+                lines.append(f'match_request_duration_seconds_sum{{endpoint="{endpoint}"}} '
+                             f'{self.duration_sum[endpoint]}')
+                lines.append(f'match_request_duration_seconds_count{{endpoint="{endpoint}"}} '
+                             f'{self.duration_count[endpoint]}')
+            metric("match_phase_seconds_total", "counter", "Time per request phase (db, scoring, serialization).",
+                   [((("endpoint", e), ("phase", p)), v) for (e, p), v in sorted(self.phase_sum.items())])
+            metric("match_phase_observations_total", "counter", "Requests that went through each phase.",
+                   [((("endpoint", e), ("phase", p)), v) for (e, p), v in sorted(self.phase_count.items())])
+            metric("match_sql_statements_total", "counter", "SQL statements executed.",
+                   [((("endpoint", e),), v) for e, v in sorted(self.statements.items())])
+            metric("match_rows_fetched_total", "counter", "Rows returned by SQL statements.",
+                   [((("endpoint", e),), v) for e, v in sorted(self.rows.items())])
+            for name in sorted({name for name, _ in self.counters}):
+                metric(f"match_{name}_total", "counter", f"Total of the {name} request counter.",
+                       [((("endpoint", e),), v) for (n, e), v in sorted(self.counters.items()) if n == name])
+            collectors = list(self.collectors)
+        for collect in collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def register_gauges(prefix, snapshot):
+    """Also expose the numeric values of snapshot() (a dict) at /metrics"""
+    def collect():
+        return [f"{prefix}_{key} {value}" for key, value in sorted(snapshot().items())
+                if isinstance(value, (int, float))]
+    metrics.collectors.append(collect)
+
+
+def _request_stats():
+    if has_app_context():
+        return g.get("match_stats")
+    return None
+
+
+@contextmanager
+def phase(name):
+    """Time a block of the current request, not counting SQL run inside it"""
+    stats = _request_stats()
+    if stats is None:
+        yield
+        return
+    start, db_before = time.perf_counter(), stats["phases"].get("db", 0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (stats["phases"].get("db", 0.0) - db_before)
+        stats["phases"][name] = stats["phases"].get(name, 0.0) + elapsed
+
+
+def count(name, value=1):
+    """Add value to a named counter of the current request"""
+    stats = _request_stats()
+    if stats is not None:
+        stats["counters"][name] = stats["counters"].get(name, 0) + value
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    if stats is not None:
+        conn.info.setdefault("match_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    starts = conn.info.get("match_query_start")
+    if stats is None or not starts:
+        return
+    stats["phases"]["db"] = stats["phases"].get("db", 0.0) + time.perf_counter() - starts.pop()
+    stats["statements"] += 1
+    if cursor.rowcount and cursor.rowcount > 0:
+        stats["rows"] += cursor.rowcount
+
+
+def _profiling_requested():
+    return PROFILING_ENABLED and (
+        request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1")
+
+
+def init_app(app):
+    """Instrument every request of a Flask app and expose /metrics"""
+
+    @app.before_request
+    def _start():
+        g.match_stats = {"start": time.perf_counter(), "phases": {}, "counters": {},
+                         "statements": 0, "rows": 0}
+        if _profiling_requested():
+            # Imported here: profiling is rare and off the startup path
+            import cProfile
+            g.match_profiler = cProfile.Profile()
+            g.match_profiler.enable()
+
+    @app.after_request
+    def _finish(response):
+        stats = g.pop("match_stats", None)
+        profiler = g.pop("match_profiler", None)
+        if stats is None:
+            return response
+        stats["duration"] = time.perf_counter() - stats["start"]
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        if endpoint != "/metrics":
+            metrics.observe(endpoint, response.status_code, stats)
+        if profiler is None:
+            return response
+        profiler.disable()
+        import io
+        import pstats
+        out = io.StringIO()
+        out.write(f"duration={stats['duration']:.6f}s statements={stats['statements']} "
+                  f"rows={stats['rows']} phases={stats['phases']} counters={stats['counters']}\n\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        return Response(out.getvalue(), mimetype="text/plain")
+
+    @app.route("/metrics")
+    def _metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
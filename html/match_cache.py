@@ -0,0 +1,242 @@
+"""In-process cache of ranked match lists.
+
+Entries are keyed by (user_id, mode, min_score) and hold a ranked prefix of
+the id list together with the exact number of results, so pages inside the
+prefix are a slice with no scoring work; a page beyond it re-ranks a longer
+prefix. Each entry also records the version it was computed against (the
+user's preference row plus the candidate set); a lookup with a different
+version drops the entry. Entries are evicted least-recently-used once the
+memory budget is exceeded, and expire after a TTL to bound staleness from
+edits the version cannot see (writers that don't touch updated_at).
+
+The candidate set's version is read from its table: row count, highest key
+and latest updated_at, so edits in place by other instances change it too.
+It is reused for MATCH_CANDIDATE_VERSION_TTL seconds rather than read per
+request; writes made through this process drop it at once.
+
+preference_snapshot holds the encoded preference store the same way, so a
+user feed ranks against it instead of reloading every user's preferences;
+preference_index holds the ANN index built over it (preference_ann.py).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, func
+
+from models import Apartment, UserApartmentPref, UserPreference
+
+# Rough per-entry overhead on top of the id/score arrays
+ENTRY_OVERHEAD_BYTES = 512
+
+
+def row_fingerprint(row):
+    """Column values of an ORM row, used to detect preference edits"""
+    return [getattr(row, column.key) for column in row.__mapper__.column_attrs]
+
+
+class CandidateVersions:
+    """candidate_set_version per key column, reused for `ttl` seconds"""
+
+    def __init__(self, ttl=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = {"hits": 0, "reads": 0}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, db, key_column):
+        key = str(key_column.expression)
+        with self._lock:
+            entry = self._versions.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.stats["hits"] += 1
+                return entry[1]
+        updated_at = key_column.expression.table.c.updated_at
+        version = tuple(db.query(func.count(key_column), func.max(key_column), func.max(updated_at)).one())
+        with self._lock:
+            self._versions[key] = (self.clock() + self.ttl, version)
+            self.stats["reads"] += 1
+        return version
+
+    def invalidate(self, key_column=None):
+        """Drop one column's version, or all of them"""
+        with self._lock:
+            if key_column is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(str(key_column.expression), None)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, ttl=self.ttl)
+
+
+def candidate_set_version(db, key_column):
+    """Cheap version of a candidate table: row count, highest key and last
+    write (updated_at, so edits in place by other writers show too)"""
+    return candidate_versions.get(db, key_column)
+
+
+class MatchCache:
+    """LRU + TTL cache of ranked (ids, scores, total) entries under a memory budget"""
+
+    def __init__(self, max_bytes=64 << 20, ttl=300.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """Ranked (ids, scores, total) for key if cached at this version, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires, entry_version, ranked = entry
+            if expires <= self.clock():
+                self._drop(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            if entry_version != version:
+                self._drop(key)
+                self.stats["invalidations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return ranked
+
+    def put(self, key, version, ranked):
+        """Store a ranked (ids, scores, total), evicting least recently used entries to fit"""
+        size = _size(ranked)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while self._entries and self.bytes + size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            self._entries[key] = (self.clock() + self.ttl, version, ranked)
+            self.bytes += size
+
+    def get_or_rank(self, key, version, rank, need):
+        """Cached ranking covering the first `need` results, calling rank(need) on a miss"""
+        ranked = self.get(key, version)
+        if ranked is not None and len(ranked[0]) < min(need, ranked[2]):
+            # Cached prefix is too short for this page
+            with self._lock:
+                self.stats["hits"] -= 1
+                self.stats["misses"] += 1
+            ranked = None
+        if ranked is None:
+            ranked = rank(need)
+            self.put(key, version, ranked)
+        return ranked
+
+    def invalidate(self, user_id=None):
+        """Drop one user's entries, or everything (e.g. the listing set changed)"""
+        with self._lock:
+            if user_id is None:
+                self.stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+                self.bytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == user_id]:
+                self._drop(key)
+                self.stats["invalidations"] += 1
+
+    def snapshot(self):
+        """Counters for dashboards"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self.bytes,
+                        max_bytes=self.max_bytes, ttl=self.ttl)
+
+    def _drop(self, key):
+        _, _, ranked = self._entries.pop(key)
+        self.bytes -= _size(ranked)
+
+
+class SharedSnapshot:
+    """One object shared by all requests (e.g. the encoded preference store),
+    reloaded when its version changes or after the TTL"""
+
+    def __init__(self, ttl=300.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = {"loads": 0, "hits": 0}
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get_or_load(self, version, load):
+        """The object loaded at this version, calling load() if there is none"""
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[0] > self.clock() and entry[1] == version:
+                self.stats["hits"] += 1
+                return entry[2]
+        value = load()
+        with self._lock:
+            self._entry = (self.clock() + self.ttl, version, value)
+            self.stats["loads"] += 1
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, loaded=int(self._entry is not None), ttl=self.ttl)
+
+
+def _size(ranked):
+    ids, scores, _ = ranked
+    return ids.nbytes + scores.nbytes + ENTRY_OVERHEAD_BYTES
+
+
+match_cache = MatchCache(
+    max_bytes=int(os.environ.get("MATCH_CACHE_BYTES", 64 << 20)),
+    ttl=float(os.environ.get("MATCH_CACHE_TTL", 300)),
+)
+
+# Versions of the candidate tables, read at most once a second by default
+candidate_versions = CandidateVersions(ttl=float(os.environ.get("MATCH_CANDIDATE_VERSION_TTL", 1)))
+
+# Every user's lifestyle preferences, encoded for score_user_pairs
+preference_snapshot = SharedSnapshot(ttl=match_cache.ttl)
+
+# The ANN index over that store, rebuilt when the store is reloaded
+preference_index = SharedSnapshot(ttl=match_cache.ttl)
+
+
+def _on_candidate_change(mapper, connection, target):
+    match_cache.invalidate()
+    candidate_versions.invalidate(mapper.primary_key[0])
+    if isinstance(target, UserPreference):
+        preference_snapshot.invalidate()
+        preference_index.invalidate()
+
+
+def _on_search_preference_change(mapper, connection, target):
+    match_cache.invalidate(target.user_id)
+
+
+# Writes made through this process invalidate right away; other writers are
+# caught by the version check or, failing that, the TTL. Apartments and
+# lifestyle preferences are candidate sets, so a change there affects
+# everyone's rankings.
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Apartment, _event, _on_candidate_change)
+    event.listen(UserPreference, _event, _on_candidate_change)
+    event.listen(UserApartmentPref, _event, _on_search_preference_change)
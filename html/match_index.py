@@ -0,0 +1,258 @@
+"""Materialized match index.
+
+Keeps one (user_id, mode, target_id, score) row per scored pair so the feed
+endpoints can read a page with an indexed range scan instead of rescoring.
+Writes to apartments and preference rows are recorded in
+match_index_changes (by ORM events in-process, by triggers on Postgres) and
+the worker below rescores only the pairs those rows take part in.
+
+Scores follow the default weight profile. match_index_state records the
+weights the index was built with (plan_version); feeds only read the index
+for a plan with those weights, and the worker rebuilds it when the default
+profile changes.
+
+Run as a worker:  python match_index.py [--database-url URL] [--rebuild] [--once]
+"""
+import argparse
+import hashlib
+import time
+
+from sqlalchemy import create_engine, delete, event, insert, or_, text
+from sqlalchemy.orm import sessionmaker
+
+from models import (Base, Apartment, UserApartmentPref, UserPreference,
+                    MatchIndex, MatchIndexChange, MatchIndexState)
+from weight_profiles import profiles
+from vector_scoring import SEEKER_COLUMNS, load_apartment_catalog, score_apartments, score_seekers
+
+APARTMENTS = 'apartments'
+USERS = 'users'
+
+# Tables whose rows feed the index, with the column identifying a row
+TRACKED_TABLES = {
+    Apartment.__tablename__: 'id',
+    UserApartmentPref.__tablename__: 'user_id',
+    UserPreference.__tablename__: 'user_id',
+}
+
+CHANGE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION match_index_record_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO match_index_changes (table_name, row_id)
+        VALUES (TG_TABLE_NAME, (to_jsonb(OLD) ->> TG_ARGV[0])::int);
+    ELSE
+        INSERT INTO match_index_changes (table_name, row_id)
+        VALUES (TG_TABLE_NAME, (to_jsonb(NEW) ->> TG_ARGV[0])::int);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def _record_change(mapper, connection, target):
+    # On Postgres the triggers record every write, including the frontend's
+    if connection.dialect.name == 'postgresql':
+        return
+    connection.execute(insert(MatchIndexChange).values(
+        table_name=mapper.local_table.name,
+        row_id=mapper.primary_key_from_instance(target)[0]
+    ))
+
+
+for _model in (Apartment, UserApartmentPref, UserPreference):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _record_change)
+
+
+def create_tables(engine):
+    """Create the index tables, plus the change triggers on Postgres"""
+    Base.metadata.create_all(engine, tables=[MatchIndex.__table__, MatchIndexChange.__table__,
+                                             MatchIndexState.__table__])
+    if engine.dialect.name != 'postgresql':
+        return
+    with engine.begin() as conn:
+        conn.execute(text(CHANGE_TRIGGER_SQL))
+        for table, key in TRACKED_TABLES.items():
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_match_index ON {table}"))
+            conn.execute(text(
+                f"CREATE TRIGGER {table}_match_index AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION match_index_record_change('{key}')"
+            ))
+
+
+def plan_version(plan):
+    """Short digest of everything in a ScoringPlan that affects a score"""
+    return hashlib.sha1(repr(plan.fingerprint).encode()).hexdigest()
+
+
+def built_for(db, plan):
+    """Whether the index holds plan's scores, i.e. was last rebuilt with the same weights"""
+    state = db.get(MatchIndexState, 1)
+    return state is not None and state.plan_version == plan_version(plan)
+
+
+def _insert(db, rows):
+    if rows:
+        db.execute(insert(MatchIndex), rows)
+    return len(rows)
+
+
+def refresh_user_apartments(db, user_id, plan, catalog=None):
+    """Rescore every apartment for one user's search preferences"""
+    db.execute(delete(MatchIndex).where(
+        MatchIndex.user_id == user_id, MatchIndex.mode == APARTMENTS))
+    user_pref = db.get(UserApartmentPref, user_id)
+    if user_pref is None:
+        return 0
+    if catalog is None:
+        catalog = load_apartment_catalog(db)
+    scores = score_apartments(user_pref, catalog, plan.apartment_weights)
+    return _insert(db, [
+        {"user_id": user_id, "mode": APARTMENTS, "target_id": apt_id, "score": score}
+        for apt_id, score in zip(catalog.ids.tolist(), scores.tolist())
+    ])
+
+
+def refresh_apartment(db, apartment_id, plan):
+    """Rescore one apartment for every user's search preferences"""
+    db.execute(delete(MatchIndex).where(
+        MatchIndex.target_id == apartment_id, MatchIndex.mode == APARTMENTS))
+    catalog = load_apartment_catalog(db, Apartment.id == apartment_id)
+    if not len(catalog):
+        return 0
+    seekers = db.query(*SEEKER_COLUMNS).all()
+    scores = score_seekers(seekers, catalog, plan.apartment_weights)
+    return _insert(db, [
+        {"user_id": seeker.user_id, "mode": APARTMENTS, "target_id": apartment_id, "score": score}
+        for seeker, score in zip(seekers, scores.tolist())
+    ])
+
+
+def _roommate_rows(current, others, plan):
+    """Index rows for current against each of others, in both directions"""
+    rows = []
+    match_users = plan.match_users
+    for other in others:
+        try:
+            score = match_users(current, other)
+        except TypeError:
+            # Preference row not filled in yet (onboarding inserts a blank row first)
+            continue
+        rows.append({"user_id": current.user_id, "mode": USERS, "target_id": other.user_id, "score": score})
+        rows.append({"user_id": other.user_id, "mode": USERS, "target_id": current.user_id, "score": score})
+    return rows
+
+
+def refresh_user_roommates(db, user_id, plan):
+    """Rescore one user's lifestyle preferences against everyone else, both ways"""
+    db.execute(delete(MatchIndex).where(
+        MatchIndex.mode == USERS,
+        or_(MatchIndex.user_id == user_id, MatchIndex.target_id == user_id)))
+    current = db.get(UserPreference, user_id)
+    if current is None:
+        return 0
+    return _insert(db, _roommate_rows(
+        current, db.query(UserPreference).filter(UserPreference.user_id != user_id), plan))
+
+
+REFRESHERS = {
+    Apartment.__tablename__: refresh_apartment,
+    UserApartmentPref.__tablename__: refresh_user_apartments,
+    UserPreference.__tablename__: refresh_user_roommates,
+}
+
+
+def apply_changes(db, batch_size=500):
+    """Apply one batch of recorded changes; returns how many were consumed.
+
+    If the default profile no longer has the weights the index was built
+    with, rebuilds it instead (which consumes every recorded change).
+    """
+    plan = profiles.plan()
+    if not built_for(db, plan):
+        rebuild(db, plan)
+        return 0
+    changes = db.query(MatchIndexChange).order_by(MatchIndexChange.id).limit(batch_size).all()
+    if not changes:
+        return 0
+    for table_name, row_id in dict.fromkeys((c.table_name, c.row_id) for c in changes):
+        REFRESHERS[table_name](db, row_id, plan)
+    # Only the ids read: a sequence id is taken at insert, so a lower one can
+    # still commit after this batch and must be left for the next
+    db.execute(delete(MatchIndexChange).where(MatchIndexChange.id.in_([c.id for c in changes])))
+    db.commit()
+    return len(changes)
+
+
+def rebuild(db, plan=None):
+    """Recompute the whole index from scratch, with plan (the default profile by default)"""
+    plan = plan or profiles.plan()
+    db.execute(delete(MatchIndex))
+    db.execute(delete(MatchIndexChange))
+    catalog = load_apartment_catalog(db)
+    for (user_id,) in db.query(UserApartmentPref.user_id).all():
+        refresh_user_apartments(db, user_id, plan, catalog)
+    for current in db.query(UserPreference).all():
+        # Rows go both ways, so score each pair once
+        _insert(db, _roommate_rows(
+            current, db.query(UserPreference).filter(UserPreference.user_id > current.user_id), plan))
+    db.merge(MatchIndexState(id=1, plan_version=plan_version(plan)))
+    db.commit()
+
+
+def read_page(db, user_id, mode, page, per_page, min_score=0):
+    """One page of (target_id, score) from the index, best first, and the total"""
+    query = db.query(MatchIndex.target_id, MatchIndex.score).filter(
+        MatchIndex.user_id == user_id,
+        MatchIndex.mode == mode,
+        MatchIndex.score >= min_score
+    )
+    total = query.count()
+    rows = query.order_by(MatchIndex.score.desc(), MatchIndex.target_id).offset(
+        max(0, (page - 1) * per_page)).limit(per_page).all()
+    return rows, total
+
+
+def run_worker(session_factory, interval=5.0, batch_size=500, once=False):
+    """Drain the change log, then poll it every interval seconds"""
+    while True:
+        db = session_factory()
+        try:
+            while apply_changes(db, batch_size):
+                pass
+        finally:
+            db.close()
+        if once:
+            return
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the precomputed match index")
+    parser.add_argument("--database-url", help="defaults to the service database (db.py)")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the whole index first")
+    parser.add_argument("--once", action="store_true", help="drain pending changes and exit")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        session_factory = sessionmaker(bind=engine)
+    else:
+        from db import engine, SessionLocal as session_factory
+
+    create_tables(engine)
+    if args.rebuild:
+        db = session_factory()
+        try:
+            rebuild(db)
+        finally:
+            db.close()
+    run_worker(session_factory, args.interval, args.batch_size, args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""The matching core behind app.py, match-engine.py, html/match-engine.py and asgi.py.
+
+    service = MatchService(db, profile=request.args.get("weights"))
+    service.apartment_feed(user_id, min_score, page, per_page)
+    service.top_apartments(user_id, APARTMENT_RECORD)      # root engine shape
+
+Every engine scores through the same ScoringPlan (scoring.py) and the same
+feeds (feeds.py), so there is one rule per criterion. The plan comes from
+weight_profiles: the named profile, else the user's A/B split share, else
+the configured default. An unknown profile name raises ValueError. The
+mutual_* methods (and ranking="mutual") read the two-sided ranking that
+stable_match.py precomputes instead. The *_batch methods serve many users
+from one set of queries (feeds.parse_batch builds their requests).
+"""
+from feeds import (APARTMENT_DETAILS, USER_DETAILS, apartment_feed, apartment_feed_batch, apartment_stream,
+                   mutual_apartment_feed, mutual_roommate_feed, nearby_feed, roommate_feed, roommate_feed_batch,
+                   user_feed, user_feed_batch, user_stream)
+from weight_profiles import profiles
+
+
+class MatchService:
+    """Match feeds for one session, scored with one weight profile"""
+
+    def __init__(self, db, profile=None, weight_profiles=profiles):
+        self.db = db
+        self.profile = profile
+        self.weight_profiles = weight_profiles
+        if profile is not None:
+            # Fail on a bad name before any work is done
+            weight_profiles.plan(profile)
+
+    def plan(self, user_id=None):
+        return self.weight_profiles.plan(self.profile, user_id)
+
+    def apartment_feed(self, user_id, min_score=0, page=1, per_page=10, details=APARTMENT_DETAILS):
+        return apartment_feed(self.db, user_id, min_score, page, per_page, details, self.plan(user_id))
+
+    def user_feed(self, user_id, min_score=0, page=1, per_page=10, details=USER_DETAILS):
+        return user_feed(self.db, user_id, min_score, page, per_page, details, self.plan(user_id))
+
+    def apartment_stream(self, user_id, min_score=0, details=APARTMENT_DETAILS):
+        return apartment_stream(self.db, user_id, min_score, details, self.plan(user_id))
+
+    def user_stream(self, user_id, min_score=0, details=USER_DETAILS):
+        return user_stream(self.db, user_id, min_score, details, self.plan(user_id))
+
+    def roommate_feed(self, user_id, record, k=5):
+        return roommate_feed(self.db, user_id, record, k, self.plan(user_id))
+
+    def mutual_apartment_feed(self, user_id, min_score=0, page=1, per_page=10, details=APARTMENT_DETAILS):
+        return mutual_apartment_feed(self.db, user_id, min_score, page, per_page, details)
+
+    def mutual_roommate_feed(self, user_id, record, k=5):
+        return mutual_roommate_feed(self.db, user_id, record, k)
+
+    def apartment_feed_batch(self, requests, details=APARTMENT_DETAILS):
+        return apartment_feed_batch(self.db, requests, details, self.plan)
+
+    def user_feed_batch(self, requests, details=USER_DETAILS):
+        return user_feed_batch(self.db, requests, details, self.plan)
+
+    def nearby_feed(self, latitude, longitude, radius_km=None, limit=10, details=APARTMENT_DETAILS):
+        return nearby_feed(self.db, latitude, longitude, radius_km, limit, details)
+
+    def top_apartments(self, user_id, record, k=5, ranking="score"):
+        """Best k apartments as {"apartment": record, "match_score"}; [] without preferences.
+        ranking="mutual" reads the stable_match.py ranking (with "assigned")"""
+        if ranking == "mutual":
+            payload = self.mutual_apartment_feed(user_id, per_page=k, details=record)
+        else:
+            payload = self.apartment_feed(user_id, per_page=k, details=record)
+        if payload is None:
+            return []
+        return _top_apartments(payload)
+
+    def top_apartments_batch(self, user_ids, record, k=5):
+        """top_apartments for many users, as [{"user_id", "results"}]"""
+        payload = self.apartment_feed_batch([(user_id, 0, 1, k) for user_id in user_ids], record)
+        return [{"user_id": entry["user_id"], "results": _top_apartments(entry) if "results" in entry else []}
+                for entry in payload["results"]]
+
+    def top_roommates(self, user_id, record, k=5, ranking="score"):
+        """Best k seekers for an owner's listing as {"roommate": record, "match_score"}"""
+        if ranking == "mutual":
+            return self.mutual_roommate_feed(user_id, record, k)["results"]
+        return self.roommate_feed(user_id, record, k)["results"]
+
+    def top_roommates_batch(self, user_ids, record, k=5):
+        """top_roommates for many owners, as [{"user_id", "results"}]"""
+        feeds = roommate_feed_batch(self.db, user_ids, record, k, self.plan)
+        return [{"user_id": user_id, "results": feeds[user_id]["results"]} for user_id in user_ids]
+
+
+def _top_apartments(payload):
+    results = []
+    for match in payload["results"]:
+        result = {"apartment": match["details"], "match_score": match["match_score"]}
+        if "assigned" in match:
+            result["assigned"] = match["assigned"]
+        results.append(result)
+    return results
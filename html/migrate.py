@@ -0,0 +1,169 @@
+"""Apply the SQL migrations in migrations/ and check hot-path query plans.
+
+    python migrate.py [--database-url URL]           apply pending migrations
+    python migrate.py [--database-url URL] --check   fail if a matching query
+                                                     can only be run as a
+                                                     sequential scan, or if
+                                                     SQL features_mask() or
+                                                     geo_cell() disagrees with
+                                                     features.py / geo.py
+
+Migrations run in file-name order with autocommit (so CREATE INDEX
+CONCURRENTLY works) and are recorded in schema_migrations. The checks also
+run as tests/test_migrate.py when DATABASE_URL points at PostgreSQL.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+from sqlalchemy import create_engine, or_, select, text
+
+from features import FEATURES, FEATURE_BITS, features_mask
+from geo import LOCATION_RADIUS_KM, covering_cells, grid_cell
+from models import Apartment, User
+from vector_scoring import CATALOG_COLUMNS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def split_statements(sql):
+    """Split a SQL script on semicolons, leaving $$-quoted bodies intact"""
+    statements, current, quoted = [], [], False
+    for line in sql.splitlines():
+        if line.strip().startswith("--") and not quoted:
+            continue
+        current.append(line)
+        quoted ^= line.count("$$") % 2 == 1
+        if not quoted and line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip())
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def pending_migrations(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR PRIMARY KEY, applied_at TIMESTAMP)"
+    )
+    applied = {row[0] for row in conn.exec_driver_sql("SELECT name FROM schema_migrations")}
+    return [name for name in sorted(os.listdir(MIGRATIONS_DIR))
+            if name.endswith(".sql") and name not in applied]
+
+
+def migrate(engine):
+    """Apply every pending migration; returns the names applied"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        names = pending_migrations(conn)
+        for name in names:
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                for statement in split_statements(f.read()):
+                    conn.exec_driver_sql(statement)
+            conn.execute(text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :at)"),
+                         {"name": name, "at": datetime.datetime.utcnow()})
+    return names
+
+
+def hot_path_queries():
+    """The candidate queries of the match engines, with representative values"""
+    return {
+        "apartment candidates": select(*CATALOG_COLUMNS).where(
+            Apartment.city == "Tel Aviv",
+            Apartment.price_per_month >= 3000,
+            Apartment.price_per_month <= 6000,
+            Apartment.date_of_entry <= datetime.date(2030, 1, 1)
+        ),
+        "owner apartment": select(Apartment.id).where(Apartment.roommate_id.contains([1])),
+        "feature overlap": select(Apartment.id).where(Apartment.features.overlap(["Balcony"])),
+        "feature mask pre-filter": select(Apartment.id).where(or_(
+            Apartment.features_mask.op('&')(FEATURE_BITS["Balcony"]) != 0,
+            Apartment.features_mask.op('&')(FEATURE_BITS["Wifi"]) != 0,
+        )),
+        "nearby apartments": select(Apartment.id).where(
+            Apartment.geo_cell.in_(covering_cells(32.0853, 34.7818, LOCATION_RADIUS_KM))
+        ),
+        "roommate candidates": select(User.id).where(
+            User.id != 1, User.user_type == "Looking for Apt"
+        ),
+    }
+
+
+def _seq_scans(plan):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", ()):
+        yield from _seq_scans(child)
+
+
+def check_query_plans(engine):
+    """Names of hot-path queries that still need a sequential scan.
+
+    Sequential scans are disabled for the check, so the planner only falls
+    back to one when no index can serve the query; small tables therefore
+    don't produce false alarms.
+    """
+    failures = []
+    with engine.begin() as conn:
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for name, query in hot_path_queries().items():
+            compiled = query.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+            plan = conn.exec_driver_sql(
+                "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+            ).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = [t for t in _seq_scans(plan[0]["Plan"]) if t in ("apartments", "users")]
+            if tables:
+                failures.append(f"{name}: sequential scan on {', '.join(tables)}")
+    return failures
+
+
+def check_feature_masks(engine):
+    """Feature lists where the SQL features_mask() disagrees with features.py"""
+    samples = [None, [], ["Something else"], *([name] for name in FEATURES), list(FEATURES)]
+    failures = []
+    with engine.connect() as conn:
+        for features in samples:
+            mask = conn.execute(text("SELECT features_mask(CAST(:features AS VARCHAR[]))"),
+                                {"features": features}).scalar()
+            if mask != features_mask(features):
+                failures.append(f"features_mask({features!r}): SQL {mask}, features.py {features_mask(features)}")
+    return failures
+
+
+def check_geo_cells(engine):
+    """Points where the SQL geo_cell() disagrees with geo.grid_cell"""
+    samples = [(32.0853, 34.7818), (31.7683, 35.2137), (-33.8688, 151.2093),
+               (0.0, 0.0), (-0.01, -0.01), (51.5074, -0.1278), (89.99, 179.99), (-89.99, -180.0)]
+    failures = []
+    with engine.connect() as conn:
+        for latitude, longitude in samples:
+            cell = conn.execute(text("SELECT geo_cell(:latitude, :longitude)"),
+                                {"latitude": latitude, "longitude": longitude}).scalar()
+            if cell != grid_cell(latitude, longitude):
+                failures.append(f"geo_cell({latitude}, {longitude}): SQL {cell}, geo.py {grid_cell(latitude, longitude)}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply migrations / check query plans")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--check", action="store_true", help="EXPLAIN the hot-path queries")
+    args = parser.parse_args(argv)
+    engine = create_engine(args.database_url)
+
+    if args.check:
+        failures = check_query_plans(engine) + check_feature_masks(engine) + check_geo_cells(engine)
+        for failure in failures:
+            print(failure)
+        return 1 if failures else 0
+
+    for name in migrate(engine):
+        print(f"applied {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
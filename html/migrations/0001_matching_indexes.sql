@@ -0,0 +1,17 @@
+-- Indexes for the matching hot path (see Apartment/User __table_args__ in models.py)
+
+-- get_apartment_matches: city equality, then price range and entry date
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_city_price_entry
+    ON apartments (city, price_per_month, date_of_entry);
+
+-- get_roommate_matches: roommate_id @> ARRAY[user_id]
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_roommate_id
+    ON apartments USING gin (roommate_id);
+
+-- feature overlap pre-filtering: features && ARRAY[...]
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_features
+    ON apartments USING gin (features);
+
+-- get_roommate_matches: users looking for an apartment
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_user_type
+    ON users (user_type);
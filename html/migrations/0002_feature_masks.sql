@@ -0,0 +1,68 @@
+-- Feature bitmasks next to the feature arrays (see features.py)
+
+ALTER TABLE apartments ADD COLUMN IF NOT EXISTS features_mask BIGINT;
+ALTER TABLE user_apartment_search_preferences ADD COLUMN IF NOT EXISTS preferred_features_mask BIGINT;
+
+-- Same result as features.features_mask: bit i for FEATURES[i], bit 62 for
+-- anything else, NULL for a NULL array. Keep the list in sync with features.py.
+CREATE OR REPLACE FUNCTION features_mask(features VARCHAR[]) RETURNS BIGINT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN features IS NULL THEN NULL ELSE coalesce(bit_or(coalesce(v.bit, 4611686018427387904)), 0) END
+    FROM unnest(features) AS f(name)
+    LEFT JOIN (VALUES
+        ('Balcony', 1::BIGINT),
+        ('Elevator', 2),
+        ('Mamad', 4),
+        ('Wifi', 8),
+        ('Parking', 16),
+        ('Storage', 32),
+        ('Accessible', 64)
+    ) AS v(name, bit) ON v.name = f.name
+$$;
+
+-- Keep the masks in sync for writers that bypass the ORM (e.g. server.js)
+CREATE OR REPLACE FUNCTION apartments_features_mask() RETURNS trigger AS $$
+BEGIN
+    NEW.features_mask := features_mask(NEW.features);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS apartments_features_mask ON apartments;
+CREATE TRIGGER apartments_features_mask BEFORE INSERT OR UPDATE OF features, features_mask ON apartments
+    FOR EACH ROW EXECUTE FUNCTION apartments_features_mask();
+
+CREATE OR REPLACE FUNCTION preferences_features_mask() RETURNS trigger AS $$
+BEGIN
+    NEW.preferred_features_mask := features_mask(NEW.preferred_features);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS preferences_features_mask ON user_apartment_search_preferences;
+CREATE TRIGGER preferences_features_mask
+    BEFORE INSERT OR UPDATE OF preferred_features, preferred_features_mask ON user_apartment_search_preferences
+    FOR EACH ROW EXECUTE FUNCTION preferences_features_mask();
+
+-- Backfill existing rows
+UPDATE apartments SET features_mask = features_mask(features)
+    WHERE features_mask IS DISTINCT FROM features_mask(features);
+UPDATE user_apartment_search_preferences SET preferred_features_mask = features_mask(preferred_features)
+    WHERE preferred_features_mask IS DISTINCT FROM features_mask(preferred_features);
+
+-- "Has any of these features" pre-filter: one partial index per bit (see Apartment in models.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_0 ON apartments (id) WHERE features_mask & 1 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_1 ON apartments (id) WHERE features_mask & 2 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_2 ON apartments (id) WHERE features_mask & 4 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_3 ON apartments (id) WHERE features_mask & 8 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_4 ON apartments (id) WHERE features_mask & 16 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_5 ON apartments (id) WHERE features_mask & 32 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_6 ON apartments (id) WHERE features_mask & 64 <> 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_feature_bit_62 ON apartments (id) WHERE features_mask & 4611686018427387904 <> 0;
+
+-- Per-bit statistics, so the planner sees how selective each bit test is and picks the indexes
+CREATE STATISTICS IF NOT EXISTS st_apartments_feature_bits ON
+    (features_mask & 1), (features_mask & 2), (features_mask & 4), (features_mask & 8),
+    (features_mask & 16), (features_mask & 32), (features_mask & 64), (features_mask & 4611686018427387904)
+    FROM apartments;
+ANALYZE apartments;
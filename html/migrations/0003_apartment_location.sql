@@ -0,0 +1,33 @@
+-- Apartment coordinates, their grid cell, and the seeker's preferred location (see geo.py)
+
+ALTER TABLE apartments ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+ALTER TABLE apartments ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+ALTER TABLE apartments ADD COLUMN IF NOT EXISTS geo_cell INTEGER;
+ALTER TABLE user_apartment_search_preferences ADD COLUMN IF NOT EXISTS preferred_latitude DOUBLE PRECISION;
+ALTER TABLE user_apartment_search_preferences ADD COLUMN IF NOT EXISTS preferred_longitude DOUBLE PRECISION;
+
+-- Same result as geo.grid_cell with CELLS_PER_DEGREE = 20; keep in sync with geo.py
+CREATE OR REPLACE FUNCTION geo_cell(latitude DOUBLE PRECISION, longitude DOUBLE PRECISION) RETURNS INTEGER
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT ((floor(latitude * 20)::INTEGER + 1800) * 7200
+            + mod(floor(longitude * 20)::INTEGER + 3600, 7200))
+$$;
+
+-- Keep geo_cell in sync for writers that bypass the ORM (e.g. server.js)
+CREATE OR REPLACE FUNCTION apartments_geo_cell() RETURNS trigger AS $$
+BEGIN
+    NEW.geo_cell := geo_cell(NEW.latitude, NEW.longitude);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS apartments_geo_cell ON apartments;
+CREATE TRIGGER apartments_geo_cell BEFORE INSERT OR UPDATE OF latitude, longitude, geo_cell ON apartments
+    FOR EACH ROW EXECUTE FUNCTION apartments_geo_cell();
+
+-- Backfill existing rows
+UPDATE apartments SET geo_cell = geo_cell(latitude, longitude)
+    WHERE geo_cell IS DISTINCT FROM geo_cell(latitude, longitude);
+
+-- Radius queries: geo_cell IN (cells covering the circle)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_geo_cell ON apartments (geo_cell);
@@ -0,0 +1,13 @@
+-- Optional PostGIS path for radius queries (MATCH_POSTGIS=1, see geo.near).
+-- A no-op where the postgis extension isn't available.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'postgis') THEN
+        CREATE EXTENSION IF NOT EXISTS postgis;
+        -- Same expression as geo._geography, so ST_DWithin can use it
+        EXECUTE 'CREATE INDEX IF NOT EXISTS ix_apartments_geography ON apartments USING gist '
+                '((CAST(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) AS geography)))';
+    END IF;
+END;
+$$;
@@ -0,0 +1,61 @@
+-- Change feed for the match service's in-memory data (see change_feed.py):
+-- an updated_at column on every table it holds, for the polling fallback,
+-- and a NOTIFY on match_changes per written row, for LISTEN.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+ALTER TABLE apartments ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+ALTER TABLE user_apartment_search_preferences ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+ALTER TABLE user_preferences ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+
+-- Stamp every write, including the frontend's (server.js and Supabase clients bypass the ORM)
+CREATE OR REPLACE FUNCTION match_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Payload "<table>:<key>"; the consumer rereads the row, so deletes need no more
+CREATE OR REPLACE FUNCTION match_notify_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('match_changes', TG_TABLE_NAME || ':' || (to_jsonb(OLD) ->> TG_ARGV[0]));
+    ELSE
+        PERFORM pg_notify('match_changes', TG_TABLE_NAME || ':' || (to_jsonb(NEW) ->> TG_ARGV[0]));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_touch_updated_at ON users;
+CREATE TRIGGER users_touch_updated_at BEFORE INSERT OR UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION match_touch_updated_at();
+DROP TRIGGER IF EXISTS apartments_touch_updated_at ON apartments;
+CREATE TRIGGER apartments_touch_updated_at BEFORE INSERT OR UPDATE ON apartments
+    FOR EACH ROW EXECUTE FUNCTION match_touch_updated_at();
+DROP TRIGGER IF EXISTS user_apartment_search_preferences_touch_updated_at ON user_apartment_search_preferences;
+CREATE TRIGGER user_apartment_search_preferences_touch_updated_at BEFORE INSERT OR UPDATE
+    ON user_apartment_search_preferences FOR EACH ROW EXECUTE FUNCTION match_touch_updated_at();
+DROP TRIGGER IF EXISTS user_preferences_touch_updated_at ON user_preferences;
+CREATE TRIGGER user_preferences_touch_updated_at BEFORE INSERT OR UPDATE ON user_preferences
+    FOR EACH ROW EXECUTE FUNCTION match_touch_updated_at();
+
+DROP TRIGGER IF EXISTS users_notify_change ON users;
+CREATE TRIGGER users_notify_change AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION match_notify_change('id');
+DROP TRIGGER IF EXISTS apartments_notify_change ON apartments;
+CREATE TRIGGER apartments_notify_change AFTER INSERT OR UPDATE OR DELETE ON apartments
+    FOR EACH ROW EXECUTE FUNCTION match_notify_change('id');
+DROP TRIGGER IF EXISTS user_apartment_search_preferences_notify_change ON user_apartment_search_preferences;
+CREATE TRIGGER user_apartment_search_preferences_notify_change AFTER INSERT OR UPDATE OR DELETE
+    ON user_apartment_search_preferences FOR EACH ROW EXECUTE FUNCTION match_notify_change('user_id');
+DROP TRIGGER IF EXISTS user_preferences_notify_change ON user_preferences;
+CREATE TRIGGER user_preferences_notify_change AFTER INSERT OR UPDATE OR DELETE ON user_preferences
+    FOR EACH ROW EXECUTE FUNCTION match_notify_change('user_id');
+
+-- Polling reads rows written since its last watermark
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_updated_at ON users (updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_apartments_updated_at ON apartments (updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_apartment_search_preferences_updated_at
+    ON user_apartment_search_preferences (updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_preferences_updated_at ON user_preferences (updated_at);
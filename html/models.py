@@ -1,34 +1,112 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, Date, ARRAY
+from sqlalchemy import (BigInteger, Column, Integer, String, Boolean, Float, Date, DateTime, ForeignKey, Index, JSON,
+                        event, func, text)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql.functions import FunctionElement
+
+from features import FEATURES, OTHER_FEATURES, features_mask
+from geo import grid_cell
 
 Base = declarative_base()
 
+def array_of(item_type):
+    # Postgres ARRAY, stored as JSON on SQLite so the schema can be created locally
+    return ARRAY(item_type).with_variant(JSON(), 'sqlite')
+
+class write_time(FunctionElement):
+    # now(); on SQLite with milliseconds, since CURRENT_TIMESTAMP stops at seconds and
+    # change_feed.py tells two writes of a row apart by their updated_at
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(write_time)
+def _write_time(element, compiler, **kw):
+    return compiler.process(func.now(), **kw)
+
+@compiles(write_time, 'sqlite')
+def _sqlite_write_time(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+def updated_at():
+    # Last write, for change_feed.py's polling; triggers keep it for writers that bypass the ORM
+    return Column(DateTime, server_default=write_time(), onupdate=write_time())
+
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    name = Column('full_name', String)
+    email = Column(String)
+    age = Column(Integer)
+    interests = Column(array_of(String))
+    gender = Column(String)
+    bio = Column(String)
+    photo = Column('profile_image_url', String)
+    user_type = Column(String)
+    updated_at = updated_at()
+    user_preferences = relationship('UserPreference', uselist=False)
+    apartment_preferences = relationship('UserApartmentPref', uselist=False)
+    __table_args__ = (
+        Index('ix_users_user_type', 'user_type'),
+        Index('ix_users_updated_at', 'updated_at'),
+    )
+
 class Apartment(Base):
     __tablename__ = 'apartments'
     id = Column(Integer, primary_key=True)
+    address = Column(String)
     city = Column(String)
     area = Column(String)
     contract_type = Column(String)
     price_per_month = Column(Integer)
     num_rooms = Column(Integer)
-    features = Column(ARRAY(String))
+    features = Column(array_of(String))
+    features_mask = Column(BigInteger)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    geo_cell = Column(Integer)
+    description = Column(String)
     date_of_entry = Column(Date)
+    image_urls = Column(array_of(String))
+    roommate_id = Column(array_of(Integer))
+    updated_at = updated_at()
+    __table_args__ = (
+        Index('ix_apartments_city_price_entry', 'city', 'price_per_month', 'date_of_entry'),
+        Index('ix_apartments_roommate_id', 'roommate_id', postgresql_using='gin'),
+        Index('ix_apartments_features', 'features', postgresql_using='gin'),
+        Index('ix_apartments_geo_cell', 'geo_cell'),
+        Index('ix_apartments_updated_at', 'updated_at'),
+        # One partial index per feature bit, so "has any of these features" is a BitmapOr
+        *(Index(f'ix_apartments_feature_bit_{bit}', 'id',
+                postgresql_where=text(f'features_mask & {1 << bit} <> 0'),
+                sqlite_where=text(f'features_mask & {1 << bit} <> 0'))
+          for bit in [*range(len(FEATURES)), OTHER_FEATURES.bit_length() - 1]),
+    )
 
 class UserApartmentPref(Base):
     __tablename__ = 'user_apartment_search_preferences'
-    user_id = Column(Integer, primary_key=True)
+    id = Column(Integer)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     preferred_city = Column(String)
     preferred_area = Column(String)
     preferred_contract_type = Column(String)
-    preferred_features = Column(ARRAY(String))
-    preferred_num_rooms = Column(ARRAY(Float))
+    preferred_features = Column(array_of(String))
+    preferred_features_mask = Column(BigInteger)
+    preferred_num_rooms = Column(array_of(Float))
     preferred_price_min = Column(Integer)
     preferred_price_max = Column(Integer)
     preferred_date_of_entry = Column(Date)
+    preferred_latitude = Column(Float)
+    preferred_longitude = Column(Float)
+    updated_at = updated_at()
+    __table_args__ = (
+        Index('ix_user_apartment_search_preferences_updated_at', 'updated_at'),
+    )
 
 class UserPreference(Base):
     __tablename__ = 'user_preferences'
-    user_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     works_from_home = Column(Boolean)
     shares_cleaning = Column(Boolean)
     has_or_wants_pet = Column(Boolean)
@@ -38,3 +116,60 @@ class UserPreference(Base):
     cleaning_frequency = Column(String)
     guest_frequency = Column(String)
     noise_sensitivity = Column(String)
+    updated_at = updated_at()
+    __table_args__ = (
+        Index('ix_user_preferences_updated_at', 'updated_at'),
+    )
+
+class MatchIndex(Base):
+    __tablename__ = 'match_index'
+    user_id = Column(Integer, primary_key=True)
+    mode = Column(String, primary_key=True)
+    target_id = Column(Integer, primary_key=True)
+    score = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('ix_match_index_feed', 'user_id', 'mode', score.desc(), 'target_id'),
+    )
+
+class MutualMatch(Base):
+    # Two-sided ranking written by stable_match.py, one city at a time
+    __tablename__ = 'mutual_matches'
+    user_id = Column(Integer, primary_key=True)
+    mode = Column(String, primary_key=True)
+    target_id = Column(Integer, primary_key=True)
+    score = Column(Integer, nullable=False)
+    assigned = Column(Boolean, nullable=False, default=False)
+    city = Column(String)
+    __table_args__ = (
+        Index('ix_mutual_matches_feed', 'user_id', 'mode', assigned.desc(), score.desc(), 'target_id'),
+        Index('ix_mutual_matches_city', 'city'),
+    )
+
+class MatchIndexChange(Base):
+    __tablename__ = 'match_index_changes'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+
+class MatchIndexState(Base):
+    # One row: the weights match_index was last rebuilt with (match_index.plan_version)
+    __tablename__ = 'match_index_state'
+    id = Column(Integer, primary_key=True)
+    plan_version = Column(String, nullable=False)
+
+# Keep the feature masks in step with the feature arrays on ORM writes
+@event.listens_for(Apartment, 'before_insert')
+@event.listens_for(Apartment, 'before_update')
+def _sync_features_mask(mapper, connection, target):
+    target.features_mask = features_mask(target.features)
+
+# Same for the grid cell of the coordinates
+@event.listens_for(Apartment, 'before_insert')
+@event.listens_for(Apartment, 'before_update')
+def _sync_geo_cell(mapper, connection, target):
+    target.geo_cell = grid_cell(target.latitude, target.longitude)
+
+@event.listens_for(UserApartmentPref, 'before_insert')
+@event.listens_for(UserApartmentPref, 'before_update')
+def _sync_preferred_features_mask(mapper, connection, target):
+    target.preferred_features_mask = features_mask(target.preferred_features)
@@ -0,0 +1,195 @@
+"""Approximate nearest-neighbour retrieval for user-to-user matching.
+
+match_users is a sum of per-criterion terms, each a lookup on the two
+users' values: the three flags and the three categories score on equality,
+smoking on the (smokes, ok_with_smoker) states of both users, cleanliness on
+the band the two levels fall in. So each user is encoded as a one-hot vector
+x with one slot per criterion state (exactly 8 ones), and each query user as
+a vector q holding, per slot, the weight that state would earn against
+them. q . x is then the raw match_users sum, and since every x has the same
+norm, the best matches by inner product are the nearest by L2 distance.
+
+Users with the same x share a code. The index clusters the codes with
+k-means (an IVF coarse quantizer); a search scores the query against the
+centroids, opens the nprobe best lists, rescores their codes exactly with
+score_user_records (the same scores as match_users) and expands the best
+codes to their users, ties by lower id. nprobe of 0, or at least the list
+count, scans every list and is exact. count() gives the exact number of
+matches for a feed's total by scoring every code, which stays cheap. Users without a cleanliness_importance
+can't be scored by match_users and are left out.
+
+    python -m benchmarks.ann --users 100000
+
+reports recall and latency per nprobe against exhaustive scoring.
+"""
+import os
+
+import numpy as np
+
+from preference_store import CATEGORY_FIELDS, CLEANLINESS_UNKNOWN, flag_shift
+from vector_scoring import score_user_records
+
+# Lists opened per search (MATCH_USER_ANN_PROBES; 0 scans them all)
+ANN_PROBES = int(os.environ.get("MATCH_USER_ANN_PROBES", 8))
+
+# Weight of each criterion, in slot order: three flags, smoking, cleanliness, three categories
+FLAG_CRITERIA = (('works_from_home', 'works_from_home'), ('shares_cleaning', 'shares_cleaning'),
+                 ('has_or_wants_pet', 'pet'))
+CATEGORY_CRITERIA = (('cleaning_frequency', 'cleaning_frequency'), ('guest_frequency', 'guest_frequency'),
+                     ('noise_sensitivity', 'noise'))
+
+
+def _flag_state(flags, field):
+    # 0 = None, 1 = False, 2 = True
+    code = flags >> flag_shift(field) & 3
+    return np.where(code == 0, 0, code - 1)
+
+
+class PreferenceEncoder:
+    """Criterion states of store records, and their one-hot slots"""
+
+    def __init__(self, store):
+        records = store.records
+        self.levels = np.unique(records['cleanliness'][records['cleanliness'] != CLEANLINESS_UNKNOWN])
+        self.sizes = [3, 3, 3, 9, max(1, len(self.levels)),
+                      *(max(1, len(store.vocab[field])) for field in CATEGORY_FIELDS)]
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        self.dim = int(sum(self.sizes))
+
+    def states(self, records):
+        """(n, 8) state index per criterion"""
+        flags = records['flags'].astype(np.int32)
+        smoking = 3 * _flag_state(flags, 'smokes') + _flag_state(flags, 'ok_with_smoker')
+        cleanliness = np.searchsorted(self.levels, records['cleanliness'])
+        return np.stack([
+            *(_flag_state(flags, field) for field, _ in FLAG_CRITERIA),
+            smoking,
+            cleanliness,
+            *(records[field].astype(np.int64) for field, _ in CATEGORY_CRITERIA),
+        ], axis=1)
+
+    def vectors(self, states):
+        """One-hot rows for states"""
+        x = np.zeros((len(states), self.dim), dtype=np.float64)
+        x[np.arange(len(states))[:, None], self.offsets + states] = 1
+        return x
+
+    def query(self, record, weights):
+        """q for one record: the weight each state earns against it"""
+        states = self.states(record[None])[0]
+        blocks = []
+        for position, (_, criterion) in enumerate(FLAG_CRITERIA):
+            blocks.append(np.where(np.arange(3) == states[position], weights[criterion], 0.0))
+        smokes, ok_with_smoker = divmod(int(states[3]), 3)
+        other_smokes, other_ok = np.divmod(np.arange(9), 3)
+        blocks.append(np.where((smokes == other_ok) | (other_smokes == ok_with_smoker), weights['smoking'], 0.0))
+        diff = np.abs(self.levels.astype(np.int64) - int(record['cleanliness']))
+        blocks.append(np.where(diff <= 1, weights['cleanliness'], np.where(diff <= 2, weights['cleanliness'] * 0.5, 0.0))
+                      if len(self.levels) else np.zeros(1))
+        for position, (_, criterion) in enumerate(CATEGORY_CRITERIA, start=5):
+            blocks.append(np.where(np.arange(self.sizes[position]) == states[position], weights[criterion], 0.0))
+        return np.concatenate(blocks)
+
+
+def kmeans(x, clusters, iterations=10, seed=0):
+    """Centroids and assignment of the rows of x (Lloyd's algorithm)"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), clusters, replace=False)].copy()
+    squared = (x * x).sum(axis=1)
+    for _ in range(iterations):
+        distance = squared[:, None] - 2 * x @ centroids.T + (centroids * centroids).sum(axis=1)[None, :]
+        assignment = distance.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Restart empty clusters on random rows
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids, assignment
+
+
+class PreferenceANN:
+    """IVF index over the encoded preference codes of one PreferenceStore"""
+
+    def __init__(self, store, lists=None, iterations=10, seed=0):
+        self.store = store
+        self.encoder = PreferenceEncoder(store)
+        known = np.flatnonzero(store.records['cleanliness'] != CLEANLINESS_UNKNOWN)
+        codes, first, inverse, counts = np.unique(
+            self.encoder.states(store.records[known]), axis=0,
+            return_index=True, return_inverse=True, return_counts=True)
+        # Users of each code, in id order (the store is sorted by user_id)
+        order = np.argsort(inverse.ravel(), kind='stable')
+        self.members = known[order]
+        self.member_start = np.concatenate([[0], np.cumsum(counts)])
+        self.representatives = store.records[known[first]]
+        self.counts = counts
+        # Code of each store position, -1 for users left out
+        self.code_of = np.full(len(store), -1, dtype=np.int64)
+        self.code_of[self.members] = np.repeat(np.arange(len(counts)), counts)
+        x = self.encoder.vectors(codes)
+        self.lists = min(len(codes), lists or max(1, int(np.sqrt(len(codes)))))
+        if self.lists:
+            self.centroids, assignment = kmeans(x, self.lists, iterations, seed)
+        else:
+            self.centroids, assignment = np.zeros((0, self.encoder.dim)), np.zeros(0, dtype=np.int64)
+        list_order = np.argsort(assignment, kind='stable')
+        self.list_codes = list_order
+        self.list_start = np.searchsorted(assignment[list_order], np.arange(self.lists + 1))
+
+    def __len__(self):
+        return len(self.members)
+
+    def _probe(self, q, probes):
+        if not probes or probes >= self.lists:
+            return np.arange(len(self.counts))
+        best = np.argpartition(-(self.centroids @ q), probes - 1)[:probes]
+        return np.concatenate([self.list_codes[self.list_start[i]:self.list_start[i + 1]] for i in best])
+
+    def search(self, user_id, weights, k, min_score=0, probes=ANN_PROBES):
+        """Top k other users for user_id as (ids, scores, candidates).
+
+        candidates counts the other users in the opened lists scoring at
+        least min_score (every such user when the search is exact).
+        """
+        position = self.store.index_of(user_id)
+        empty = np.zeros(0, dtype=np.int64)
+        if position is None or self.code_of[position] < 0:
+            return empty, empty, 0
+        record = self.store.records[position]
+        codes = self._probe(self.encoder.query(record, weights), probes)
+        scores = score_user_records(record, self.representatives[codes], weights)
+        keep = scores >= min_score
+        codes, scores = codes[keep], scores[keep]
+        counts = self.counts[codes]
+        candidates = int(counts.sum()) - int(np.isin(self.code_of[position], codes))
+
+        # Expand codes best first until k other users, keeping whole score levels
+        order = np.argsort(-scores, kind='stable')
+        cut = int(np.searchsorted(np.cumsum(counts[order]), k + 1))
+        if cut < len(order):
+            cut = int(np.searchsorted(-scores[order], -scores[order][cut], side='right'))
+        chosen = codes[order[:cut]]
+        users = np.concatenate([self.members[self.member_start[c]:self.member_start[c + 1]] for c in chosen]) \
+            if len(chosen) else empty
+        ids = self.store.ids[users]
+        user_scores = np.repeat(scores[order[:cut]], self.counts[chosen])
+        others = ids != user_id
+        ids, user_scores = ids[others], user_scores[others]
+        ranked = np.lexsort((ids, -user_scores))[:k]
+        return ids[ranked], user_scores[ranked], candidates
+
+    def count(self, user_id, weights, min_score=0):
+        """Other users scoring at least min_score against user_id, exactly.
+
+        Scores every code once (no list is skipped), which costs far less
+        than scoring the users: there are only as many codes as distinct
+        answer combinations.
+        """
+        position = self.store.index_of(user_id)
+        if position is None or self.code_of[position] < 0:
+            return 0
+        scores = score_user_records(self.store.records[position], self.representatives, weights)
+        qualifying = scores >= min_score
+        return int(self.counts[qualifying].sum()) - int(qualifying[self.code_of[position]])
@@ -0,0 +1,176 @@
+"""Compact in-memory store of users' lifestyle preferences.
+
+Each user is one fixed-width 14-byte record in a contiguous NumPy array
+(RECORD_DTYPE), against a kilobyte or more for a UserPreference ORM instance
+with its identity-map and attribute state:
+
+    user_id             int64
+    flags               uint16, two bits per boolean in FLAG_FIELDS order:
+                        0 = None, 2 = False, 3 = True
+    cleanliness         int8, CLEANLINESS_UNKNOWN when missing
+    cleaning_frequency  uint8 codes, interned per store (0 = None)
+    guest_frequency
+    noise_sensitivity
+
+store[i] and store.get(user_id) return PreferenceRecord views with the same
+attribute names as UserPreference, so match_users scores them as they are;
+vector_scoring.score_user_pairs scores whole record arrays at once.
+"""
+import numpy as np
+
+from models import UserPreference
+
+# Columns a store is loaded from
+PREFERENCE_COLUMNS = (
+    UserPreference.user_id,
+    UserPreference.works_from_home,
+    UserPreference.shares_cleaning,
+    UserPreference.has_or_wants_pet,
+    UserPreference.smokes,
+    UserPreference.ok_with_smoker,
+    UserPreference.cleanliness_importance,
+    UserPreference.cleaning_frequency,
+    UserPreference.guest_frequency,
+    UserPreference.noise_sensitivity,
+)
+
+FLAG_FIELDS = ('works_from_home', 'shares_cleaning', 'has_or_wants_pet', 'smokes', 'ok_with_smoker')
+CATEGORY_FIELDS = ('cleaning_frequency', 'guest_frequency', 'noise_sensitivity')
+
+RECORD_DTYPE = np.dtype([
+    ('user_id', '<i8'),
+    ('flags', '<u2'),
+    ('cleanliness', 'i1'),
+    ('cleaning_frequency', 'u1'),
+    ('guest_frequency', 'u1'),
+    ('noise_sensitivity', 'u1'),
+])
+
+CLEANLINESS_UNKNOWN = -128
+
+_FLAG_CODES = {None: 0, False: 2, True: 3}
+_FLAG_VALUES = (None, None, False, True)
+
+
+def flag_shift(field):
+    """Bit offset of a boolean field inside the flags word"""
+    return 2 * FLAG_FIELDS.index(field)
+
+
+class PreferenceRecord:
+    """One user's preferences, read from a store with UserPreference attribute names"""
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._row = store.records[index].item()
+
+    @property
+    def user_id(self):
+        return self._row[0]
+
+    @property
+    def cleanliness_importance(self):
+        value = self._row[2]
+        return None if value == CLEANLINESS_UNKNOWN else value
+
+    def __repr__(self):
+        return f"<PreferenceRecord user_id={self.user_id}>"
+
+
+def _flag_property(shift):
+    return property(lambda self: _FLAG_VALUES[self._row[1] >> shift & 3])
+
+
+def _category_property(field, position):
+    return property(lambda self: self._store.vocab[field][self._row[position]])
+
+
+for _field in FLAG_FIELDS:
+    setattr(PreferenceRecord, _field, _flag_property(flag_shift(_field)))
+for _position, _field in enumerate(CATEGORY_FIELDS, start=3):
+    setattr(PreferenceRecord, _field, _category_property(_field, _position))
+
+
+class PreferenceStore:
+    """Preference records sorted by user_id, plus the interned category values"""
+
+    def __init__(self, records, vocab):
+        self.records = records
+        # Per category field, code -> value (code 0 is None)
+        self.vocab = vocab
+
+    @classmethod
+    def from_rows(cls, rows, vocab=None):
+        """Encode rows with UserPreference attributes (ORM instances or column rows).
+
+        vocab seeds the category codes, so the records line up with another
+        store's (see updated).
+        """
+        rows = sorted(rows, key=lambda r: r.user_id)
+        if vocab is None:
+            codes = {field: {None: 0} for field in CATEGORY_FIELDS}
+        else:
+            codes = {field: {value: code for code, value in enumerate(vocab[field])} for field in CATEGORY_FIELDS}
+        records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+        for i, row in enumerate(rows):
+            flags = 0
+            for shift, field in enumerate(FLAG_FIELDS):
+                flags |= _FLAG_CODES[getattr(row, field)] << 2 * shift
+            cleanliness = row.cleanliness_importance
+            if cleanliness is None:
+                cleanliness = CLEANLINESS_UNKNOWN
+            elif not CLEANLINESS_UNKNOWN < cleanliness <= 127:
+                raise ValueError(f"cleanliness_importance {cleanliness} of user {row.user_id} "
+                                 f"doesn't fit in a byte")
+            category_codes = []
+            for field in CATEGORY_FIELDS:
+                interned = codes[field]
+                code = interned.setdefault(getattr(row, field), len(interned))
+                if code > 255:
+                    raise ValueError(f"more than 255 distinct {field} values")
+                category_codes.append(code)
+            records[i] = (row.user_id, flags, cleanliness, *category_codes)
+        vocab = {field: list(interned) for field, interned in codes.items()}
+        return cls(records, vocab)
+
+    def updated(self, rows, deleted=()):
+        """A new store with rows upserted and the users in deleted removed"""
+        changed = self.from_rows(rows, self.vocab)
+        drop = np.isin(self.records['user_id'], np.concatenate([
+            changed.records['user_id'], np.fromiter(deleted, dtype=np.int64)]))
+        records = np.concatenate([self.records[~drop], changed.records])
+        return PreferenceStore(records[np.argsort(records['user_id'], kind='stable')], changed.vocab)
+
+    def subset(self, user_ids):
+        """A store of just the given users' records, sharing this one's vocabulary"""
+        return PreferenceStore(self.records[np.isin(self.records['user_id'], user_ids)], self.vocab)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return PreferenceRecord(self, index)
+
+    def __iter__(self):
+        return (PreferenceRecord(self, i) for i in range(len(self.records)))
+
+    @property
+    def ids(self):
+        return self.records['user_id']
+
+    def index_of(self, user_id):
+        """Position of user_id in the store, or None"""
+        i = int(np.searchsorted(self.records['user_id'], user_id))
+        if i < len(self.records) and self.records['user_id'][i] == user_id:
+            return i
+        return None
+
+    def get(self, user_id):
+        i = self.index_of(user_id)
+        return None if i is None else PreferenceRecord(self, i)
+
+
+def load_preference_store(db, *criteria):
+    """Load the preferences of users matching criteria into a store"""
+    return PreferenceStore.from_rows(db.query(*PREFERENCE_COLUMNS).filter(*criteria).all())
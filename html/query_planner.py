@@ -0,0 +1,307 @@
+"""Push match filtering, min_score and pagination down into SQL.
+
+Apart from features and location, every weighted criterion is a yes/no
+match, so an apartment falls into one of 64 match patterns, computed in SQL
+as a bitmask. The planner knows, for each pattern, the lowest score it can
+get (no feature overlap, out of range) and the highest (full overlap, same
+spot). From that it derives:
+
+- which patterns can still reach min_score (others are filtered out in SQL),
+- which criteria every such pattern needs (plain, index-friendly predicates),
+- a best-first order of patterns, so apartments can be fetched in keyset
+  chunks and the scan can stop once nothing left can enter the page.
+
+User matches get the same treatment from UserQueryPlan. There every
+criterion is a yes/no match (cleanliness in three steps), so each pattern's
+score is exact and SQL can rank and cut off the page on its own.
+"""
+import math
+
+import numpy as np
+from sqlalchemy import and_, case, false, func, literal, or_
+
+from features import OTHER_FEATURES, REGISTERED_FEATURES, features_mask, mask_bits
+from geo import KM_PER_DEGREE, LOCATION_RADIUS_KM, near, preferred_location
+from models import Apartment, UserPreference
+from ranking import TopK
+from scoring import apartment_weights
+from vector_scoring import CATALOG_COLUMNS, ApartmentCatalog, score_apartments
+
+# Yes/no criteria in the order the scorers add them up
+CRITERIA = ('city', 'area', 'contract_type', 'price', 'date', 'rooms')
+
+
+def criterion_predicates(user_pref):
+    """SQL predicate per criterion, with the same semantics as score_apartments"""
+    price_known = (user_pref.preferred_price_min is not None and
+                   user_pref.preferred_price_max is not None)
+    rooms = sorted({int(x) for x in user_pref.preferred_num_rooms or () if x is not None})
+    return {
+        'city': Apartment.city == user_pref.preferred_city,
+        'area': Apartment.area == user_pref.preferred_area,
+        'contract_type': Apartment.contract_type == user_pref.preferred_contract_type,
+        'price': Apartment.price_per_month.between(
+            user_pref.preferred_price_min, user_pref.preferred_price_max
+        ) if price_known else false(),
+        'date': Apartment.date_of_entry <= user_pref.preferred_date_of_entry
+        if user_pref.preferred_date_of_entry is not None else false(),
+        'rooms': Apartment.num_rooms.in_(rooms) if rooms else false(),
+    }
+
+
+class ApartmentQueryPlan:
+    """Candidate filter and best-first order for one user's preferences"""
+
+    def __init__(self, user_pref, weights, min_score=0):
+        self.min_score = min_score
+        weights = apartment_weights(user_pref, weights)
+        total_weight = sum(weights.values())
+        max_features = weights['features'] if user_pref.preferred_features else 0
+        max_location = weights.get('location', 0)
+        predicates = criterion_predicates(user_pref)
+
+        self.weights, self.total_weight = weights, total_weight
+
+        # Score range of each match pattern, summed in the scorer's order
+        self.bounds, self.base = {}, {}
+        for mask in range(1 << len(CRITERIA)):
+            base = 0
+            for bit, criterion in enumerate(CRITERIA):
+                if mask >> bit & 1:
+                    base += weights[criterion]
+            self.base[mask] = base
+            self.bounds[mask] = (round((base / total_weight) * 100),
+                                 round(((base + max_features + max_location) / total_weight) * 100))
+
+        self.allowed = [m for m, (_, high) in self.bounds.items() if high >= min_score]
+        self.definite = [m for m in self.allowed if self.bounds[m][0] >= min_score]
+        self.uncertain = [m for m in self.allowed if self.bounds[m][0] < min_score]
+        self.mandatory = [
+            criterion for bit, criterion in enumerate(CRITERIA)
+            if self.allowed and all(m >> bit & 1 for m in self.allowed)
+        ]
+
+        self.mask = sum(
+            case((predicates[criterion], 1 << bit), else_=0)
+            for bit, criterion in enumerate(CRITERIA)
+        )
+        self.criteria = [predicates[criterion] for criterion in self.mandatory]
+        if not self.allowed:
+            self.criteria.append(false())
+        elif len(self.allowed) < len(self.bounds):
+            self.criteria.append(self.mask.in_(self.allowed))
+
+        # Uncertain patterns only reach min_score with at least one wanted
+        # feature (one arm per bit so the per-bit partial indexes apply) or
+        # inside the location radius (the grid cell index)
+        wanted = features_mask(user_pref.preferred_features)
+        extra = [Apartment.features_mask.op('&')(bit) != 0 for bit in mask_bits(wanted or 0)]
+        if max_location:
+            extra.append(near(Apartment, *preferred_location(user_pref), LOCATION_RADIUS_KM))
+        if self.uncertain and extra:
+            if self.definite:
+                extra.insert(0, self.mask.in_(self.definite))
+            self.criteria.append(or_(*extra))
+
+        # Patterns ordered by the best score they can reach
+        ordered = sorted(self.allowed, key=lambda m: -self.bounds[m][1])
+        self.rank_bound = [self.bounds[m][1] for m in ordered]
+        self.rank = case({m: rank for rank, m in enumerate(ordered)}, value=self.mask) \
+            if ordered else self.mask
+
+
+def ranked_prefix(db, plan, user_pref, weights, need):
+    """Best `need` apartments as (ids, scores, total) without scoring the rest.
+
+    Fetches candidates best pattern first in keyset-paginated chunks and stops
+    once no remaining pattern can beat the current k-th best score. total is
+    the exact number of apartments scoring at least plan.min_score.
+    """
+    selector = TopK(need)
+    query = db.query(*CATALOG_COLUMNS, plan.rank.label('plan_rank')).filter(
+        *plan.criteria).order_by(plan.rank, Apartment.id)
+    chunk = max(need, 64)
+    last = None
+    exhausted = False
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(or_(plan.rank > last[0],
+                                   and_(plan.rank == last[0], Apartment.id > last[1])))
+        rows = page.limit(chunk).all()
+        scores = score_apartments(user_pref, ApartmentCatalog(rows), weights).tolist()
+        for row, score in zip(rows, scores):
+            if score >= plan.min_score:
+                selector.push(score, row.id)
+        if len(rows) < chunk:
+            exhausted = True
+            break
+        last = (rows[-1].plan_rank, rows[-1].id)
+        threshold = selector.threshold
+        if threshold is not None and plan.rank_bound[last[0]] < threshold:
+            break
+        chunk *= 2
+
+    if exhausted:
+        total = selector.seen
+    else:
+        # Definite patterns always pass; uncertain ones need features and location scored
+        total = db.query(func.count(Apartment.id)).filter(
+            *plan.criteria, plan.mask.in_(plan.definite)).scalar() if plan.definite else 0
+        if plan.uncertain:
+            total += count_uncertain(db, plan, user_pref)
+
+    ranked = selector.results()
+    return (np.array([id for _, id, _ in ranked], dtype=np.int64),
+            np.array([score for score, _, _ in ranked], dtype=np.int64),
+            total)
+
+
+def count_uncertain(db, plan, user_pref):
+    """Apartments in plan's uncertain patterns that reach plan.min_score.
+
+    Per pattern and number of wanted features the apartment has, the score
+    either reaches min_score outright or needs the location term, i.e. a
+    distance below some radius; both are compared in SQL (squared, so no
+    sqrt is needed). Only apartments whose overlap needs the feature arrays
+    (an unmasked row, or feature strings outside the registry on both
+    sides) are loaded and scored.
+    """
+    weights, total_weight = plan.weights, plan.total_weight
+    preferred = user_pref.preferred_features or ()
+    wanted = features_mask(preferred) or 0
+    bits = mask_bits(wanted & REGISTERED_FEATURES)
+    overlap = sum(case((Apartment.features_mask.op('&')(bit) != 0, 1), else_=0) for bit in bits) \
+        if bits else literal(0)
+    location = weights.get('location', 0)
+    if location:
+        latitude, longitude = preferred_location(user_pref)
+        north = (Apartment.latitude - latitude) * KM_PER_DEGREE
+        east = (Apartment.longitude - longitude) * (KM_PER_DEGREE * math.cos(math.radians(latitude)))
+        distance_squared = north * north + east * east
+    # Raw score at which the percentage rounds up to min_score
+    needed = (plan.min_score - 0.5) * total_weight / 100
+
+    arms = []
+    for base in sorted({plan.base[m] for m in plan.uncertain}):
+        reach = []
+        for matching in range(len(bits) + 1):
+            partial = base + (matching / len(preferred)) * weights['features'] if matching else base
+            if round((partial / total_weight) * 100) >= plan.min_score:
+                reach.append(overlap >= matching)
+                break
+            if location:
+                radius = LOCATION_RADIUS_KM * (1 - (needed - partial) / location)
+                if radius > 0:
+                    reach.append(and_(overlap == matching, distance_squared <= radius * radius))
+        if reach:
+            arms.append(and_(plan.mask.in_([m for m in plan.uncertain if plan.base[m] == base]),
+                             or_(*reach)))
+
+    spelled_out = Apartment.features_mask.is_(None)
+    if wanted & OTHER_FEATURES:
+        spelled_out = or_(spelled_out, Apartment.features_mask.op('&')(OTHER_FEATURES) != 0)
+    band = (*plan.criteria, plan.mask.in_(plan.uncertain))
+    total = db.query(func.count(Apartment.id)).filter(
+        *band, ~spelled_out, or_(*arms)).scalar() if arms else 0
+    rows = ApartmentCatalog(db.query(*CATALOG_COLUMNS).filter(*band, spelled_out).all())
+    return total + int((score_apartments(user_pref, rows, weights) >= plan.min_score).sum())
+
+
+# Yes/no lifestyle criteria in the order match_users adds them up, with
+# cleanliness (two bits: 0, half or full weight) between smoking and
+# cleaning_frequency
+USER_CRITERIA = ('works_from_home', 'shares_cleaning', 'pet', 'smoking',
+                 'cleaning_frequency', 'guest_frequency', 'noise')
+CLEANLINESS_SHIFT = len(USER_CRITERIA)
+
+
+def _same(column, value):
+    # Python's ==, where None matches None
+    return column.is_(None) if value is None else column == value
+
+
+def user_criterion_predicates(current):
+    """SQL predicate per user criterion, scoring others against current like match_users"""
+    return {
+        'works_from_home': _same(UserPreference.works_from_home, current.works_from_home),
+        'shares_cleaning': _same(UserPreference.shares_cleaning, current.shares_cleaning),
+        'pet': _same(UserPreference.has_or_wants_pet, current.has_or_wants_pet),
+        'smoking': or_(_same(UserPreference.ok_with_smoker, current.smokes),
+                       _same(UserPreference.smokes, current.ok_with_smoker)),
+        'cleaning_frequency': _same(UserPreference.cleaning_frequency, current.cleaning_frequency),
+        'guest_frequency': _same(UserPreference.guest_frequency, current.guest_frequency),
+        'noise': _same(UserPreference.noise_sensitivity, current.noise_sensitivity),
+    }
+
+
+class UserQueryPlan:
+    """Candidate filter and best-first order for one user's roommate matches.
+
+    Every lifestyle criterion is a match or not (cleanliness in three steps),
+    so a pair falls into one of 384 patterns whose score is exact, not a
+    range: SQL filters and orders by score and the page needs no rescoring.
+    """
+
+    def __init__(self, current, weights, min_score=0):
+        self.min_score = min_score
+        total_weight = sum(weights.values())
+        predicates = user_criterion_predicates(current)
+        cleanliness = current.cleanliness_importance
+
+        # Score of each match pattern, summed in match_users' order
+        self.scores = {}
+        for level in range(3):
+            for bits in range(1 << CLEANLINESS_SHIFT):
+                score = 0
+                for bit, criterion in enumerate(USER_CRITERIA):
+                    if bit == USER_CRITERIA.index('cleaning_frequency') and level:
+                        score += weights['cleanliness'] * (1 if level == 2 else 0.5)
+                    if bits >> bit & 1:
+                        score += weights[criterion]
+                self.scores[bits | level << CLEANLINESS_SHIFT] = round((score / total_weight) * 100)
+
+        self.allowed = [m for m, score in self.scores.items() if score >= min_score]
+        self.mandatory = [
+            criterion for bit, criterion in enumerate(USER_CRITERIA)
+            if self.allowed and all(m >> bit & 1 for m in self.allowed)
+        ]
+        # Patterns that don't exclude anyone leave nothing to push down
+        self.selective = len(self.allowed) < len(self.scores)
+
+        # match_users can't score a pair with a missing cleanliness_importance
+        self.criteria = [UserPreference.user_id != current.user_id,
+                         UserPreference.cleanliness_importance.isnot(None)]
+        if cleanliness is None or not self.allowed:
+            self.criteria.append(false())
+            cleanliness = 0
+        distance = func.abs(UserPreference.cleanliness_importance - cleanliness)
+        self.mask = sum(
+            case((predicates[criterion], 1 << bit), else_=0)
+            for bit, criterion in enumerate(USER_CRITERIA)
+        ) + case((distance <= 1, 2 << CLEANLINESS_SHIFT),
+                 (distance <= 2, 1 << CLEANLINESS_SHIFT), else_=0)
+        self.criteria += [predicates[criterion] for criterion in self.mandatory]
+        lowest_level = min((m >> CLEANLINESS_SHIFT for m in self.allowed), default=0)
+        if lowest_level:
+            self.criteria.append(distance <= 3 - lowest_level)
+        if self.allowed and self.selective:
+            self.criteria.append(self.mask.in_(self.allowed))
+
+        # Patterns with equal scores share a rank, so ties go by user_id
+        ordered = sorted({self.scores[m] for m in self.allowed}, reverse=True)
+        self.rank = case({m: ordered.index(self.scores[m]) for m in self.allowed}, value=self.mask) \
+            if self.allowed else self.mask
+
+
+def ranked_users(db, plan, need):
+    """Best `need` other users as (ids, scores, total), ranked and cut off in SQL"""
+    rows = db.query(UserPreference.user_id, plan.mask.label('pattern')).filter(
+        *plan.criteria).order_by(plan.rank, UserPreference.user_id).limit(need).all()
+    if len(rows) < need:
+        total = len(rows)
+    else:
+        total = db.query(func.count(UserPreference.user_id)).filter(*plan.criteria).scalar()
+    return (np.array([row.user_id for row in rows], dtype=np.int64),
+            np.array([plan.scores[row.pattern] for row in rows], dtype=np.int64),
+            total)
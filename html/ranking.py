@@ -0,0 +1,106 @@
+import heapq
+from itertools import count
+
+import numpy as np
+
+
+class TopK:
+    """Streaming top-k selector over (score, id) candidates.
+
+    Keeps at most k candidates in a min-heap, so ranking n candidates costs
+    O(n log k) time and O(k) memory. Ties on score are broken by ascending id,
+    which makes the ranking stable across requests.
+    """
+
+    def __init__(self, k):
+        self.k = max(0, k)
+        self.seen = 0
+        self._heap = []
+        self._tiebreak = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def threshold(self):
+        """Score a new candidate must reach to enter, or None while not full"""
+        if len(self._heap) < self.k or not self._heap:
+            return None
+        return self._heap[0][0]
+
+    def could_enter(self, score, id):
+        """Whether a candidate with this score and id would currently get in"""
+        if self.k == 0:
+            return False
+        return len(self._heap) < self.k or (score, -id) > self._heap[0][:2]
+
+    def push(self, score, id, item=None):
+        """Offer a candidate; returns True if it is currently in the top k"""
+        self.seen += 1
+        if self.k == 0:
+            return False
+        entry = (score, -id, next(self._tiebreak), id, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] <= self._heap[0][:2]:
+            return False
+        heapq.heapreplace(self._heap, entry)
+        return True
+
+    def results(self):
+        """Survivors as (score, id, item), best first"""
+        ranked = sorted(self._heap, key=lambda e: (-e[0], e[3]))
+        return [(score, id, item) for score, _, _, id, item in ranked]
+
+
+def top_k(candidates, k):
+    """Best k of an iterable of (score, id, item), best first"""
+    selector = TopK(k)
+    for score, id, item in candidates:
+        selector.push(score, id, item)
+    return selector.results()
+
+
+def bounded_top_k(candidates, k, bound, score):
+    """Best k of (id, item) candidates, scoring as few of them as possible.
+
+    bound(item) must never be below score(item). Candidates are visited by
+    descending bound (ties by id) and the scan stops at the first one whose
+    bound can't get into the top k, since no later one can either. Returns
+    (results, pruned) where results match top_k over every score(item).
+    """
+    selector = TopK(k)
+    ordered = sorted(((bound(item), id, item) for id, item in candidates), key=lambda c: (-c[0], c[1]))
+    for visited, (upper, id, item) in enumerate(ordered):
+        if not selector.could_enter(upper, id):
+            return selector.results(), len(ordered) - visited
+        selector.push(score(item), id, item)
+    return selector.results(), 0
+
+
+def page_of(candidates, page, per_page, min_score=0):
+    """Select one page of ranked candidates without sorting all of them.
+
+    Keeps the top page * per_page candidates scoring at least min_score and
+    returns (page_items, total_results), where total_results counts every
+    candidate that passed min_score.
+    """
+    selector = TopK(page * per_page)
+    total = 0
+    for score, id, item in candidates:
+        if score >= min_score:
+            total += 1
+            selector.push(score, id, item)
+    start = max(0, (page - 1) * per_page)
+    return selector.results()[start:start + per_page], total
+
+
+def rank_scores(scores, ids, min_score=0):
+    """Full ranking of score/id arrays as (ids, scores), best first, ties by id"""
+    scores = np.asarray(scores, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    keep = scores >= min_score
+    scores, ids = scores[keep], ids[keep]
+    order = np.lexsort((ids, -scores))
+    return ids[order], scores[order]
@@ -0,0 +1,219 @@
+from features import feature_overlap
+from geo import distance_km, location_decay, preferred_location
+
+# Weights for apartment matching criteria
+APARTMENT_WEIGHTS = {
+    'city': 20,              # Location is very important
+    'area': 15,              # Specific area is important
+    'contract_type': 10,     # Contract type is somewhat important
+    'price': 20,             # Price range is very important
+    'date': 10,              # Entry date is somewhat important
+    'rooms': 15,             # Number of rooms is important
+    'features': 10,          # Features are somewhat important
+    'location': 15           # Distance from where the seeker wants to live is important
+}
+
+# Weights for user matching criteria
+USER_WEIGHTS = {
+    'works_from_home': 15,    # Work style is important
+    'shares_cleaning': 15,    # Cleaning responsibility is important
+    'pet': 10,               # Pet compatibility is somewhat important
+    'smoking': 15,           # Smoking compatibility is important
+    'cleanliness': 15,       # Cleanliness is important
+    'cleaning_frequency': 10, # Cleaning frequency is somewhat important
+    'guest_frequency': 10,   # Guest frequency is somewhat important
+    'noise': 10              # Noise sensitivity is somewhat important
+}
+
+# Seekers whose apartment score for the owner's listing is below this are not matched
+ROOMMATE_APARTMENT_THRESHOLD = 50
+
+# משקלים לפי המשתמש
+def apartment_weights(user_pref, weights=APARTMENT_WEIGHTS):
+    """weights as they apply to a seeker: location only counts once they have set one"""
+    if 'location' in weights and preferred_location(user_pref) is None:
+        return {criterion: weight for criterion, weight in weights.items() if criterion != 'location'}
+    return weights
+
+# פרופיל משקלים מחושב מראש
+class ScoringPlan:
+    """One weight profile, resolved once for the scalar scorers.
+
+    Checks the weights and works out the totals up front (with and without
+    'location', see apartment_weights), so scoring a pair doesn't re-sum
+    them. The module-level functions below score with DEFAULT_PLAN;
+    weight_profiles.py builds a plan per configured profile.
+    """
+
+    def __init__(self, apartment=APARTMENT_WEIGHTS, user=USER_WEIGHTS,
+                 roommate_threshold=ROOMMATE_APARTMENT_THRESHOLD, name="default"):
+        self.name = name
+        self.apartment_weights = _checked_weights("apartment", apartment, APARTMENT_WEIGHTS, optional={'location'})
+        self.user_weights = _checked_weights("user", user, USER_WEIGHTS)
+        self.roommate_threshold = roommate_threshold
+        without_location = {c: w for c, w in self.apartment_weights.items() if c != 'location'}
+        self._apartment_totals = {
+            True: (self.apartment_weights, sum(self.apartment_weights.values())),
+            False: (without_location, sum(without_location.values())),
+        }
+        self.user_total = sum(self.user_weights.values())
+        # Changes whenever anything that affects a score does
+        self.fingerprint = (tuple(sorted(self.apartment_weights.items())),
+                            tuple(sorted(self.user_weights.items())), roommate_threshold)
+
+    def __repr__(self):
+        return f"<ScoringPlan {self.name}>"
+
+    def apartment_profile(self, user_pref):
+        """(weights, total weight) that apply to a seeker"""
+        return self._apartment_totals['location' in self.apartment_weights
+                                      and preferred_location(user_pref) is not None]
+
+    # התאמה בין משתמש לדירה
+    def match_user_to_apartment(self, user_pref, apt):
+        score = 0
+        weights, total_weight = self.apartment_profile(user_pref)
+        
+        # City match
+        if apt.city == user_pref.preferred_city:
+            score += weights['city']
+        
+        # Area match
+        if apt.area == user_pref.preferred_area:
+            score += weights['area']
+        
+        # Contract type match
+        if apt.contract_type == user_pref.preferred_contract_type:
+            score += weights['contract_type']
+        
+        # Price range match
+        if user_pref.preferred_price_min <= apt.price_per_month <= user_pref.preferred_price_max:
+            score += weights['price']
+        
+        # Date of entry match
+        if apt.date_of_entry <= user_pref.preferred_date_of_entry:
+            score += weights['date']
+        
+        # Number of rooms match
+        if int(apt.num_rooms) in [int(x) for x in user_pref.preferred_num_rooms]:
+            score += weights['rooms']
+        
+        # Features match
+        matching_features = feature_overlap(user_pref, apt)
+        if matching_features:
+            feature_score = (matching_features / len(user_pref.preferred_features)) * weights['features']
+            score += feature_score
+        
+        # Location, decaying with distance
+        if 'location' in weights and apt.latitude is not None and apt.longitude is not None:
+            latitude, longitude = preferred_location(user_pref)
+            distance = distance_km(latitude, longitude, apt.latitude, apt.longitude)
+            score += weights['location'] * location_decay(distance)
+        
+        return round((score / total_weight) * 100)
+
+    # חסם עליון לציון הדירה
+    def apartment_score_bound(self, user_pref, apt):
+        """Upper bound of the apartment score from the two heaviest criteria, city and price"""
+        weights, total_weight = self.apartment_profile(user_pref)
+        lost = 0
+        if apt.city != user_pref.preferred_city:
+            lost += weights['city']
+        if not user_pref.preferred_price_min <= apt.price_per_month <= user_pref.preferred_price_max:
+            lost += weights['price']
+        return round(((total_weight - lost) / total_weight) * 100)
+
+    # התאמה בין משתמש למשתמש
+    def match_users(self, p1, p2):
+        score = 0
+        weights = self.user_weights
+        
+        # Work from home compatibility
+        if p1.works_from_home == p2.works_from_home:
+            score += weights['works_from_home']
+        
+        # Cleaning responsibility compatibility
+        if p1.shares_cleaning == p2.shares_cleaning:
+            score += weights['shares_cleaning']
+        
+        # Pet compatibility
+        if p1.has_or_wants_pet == p2.has_or_wants_pet:
+            score += weights['pet']
+        
+        # Smoking compatibility
+        if p1.smokes == p2.ok_with_smoker or p2.smokes == p1.ok_with_smoker:
+            score += weights['smoking']
+        
+        # Cleanliness importance compatibility
+        cleanliness_diff = abs(p1.cleanliness_importance - p2.cleanliness_importance)
+        if cleanliness_diff <= 1:
+            score += weights['cleanliness']
+        elif cleanliness_diff <= 2:
+            score += weights['cleanliness'] * 0.5
+        
+        # Cleaning frequency compatibility
+        if p1.cleaning_frequency == p2.cleaning_frequency:
+            score += weights['cleaning_frequency']
+        
+        # Guest frequency compatibility
+        if p1.guest_frequency == p2.guest_frequency:
+            score += weights['guest_frequency']
+        
+        # Noise sensitivity compatibility
+        if p1.noise_sensitivity == p2.noise_sensitivity:
+            score += weights['noise']
+        
+        return round((score / self.user_total) * 100)
+
+    # חסם עליון לציון בין משתמשים
+    def match_users_bound(self, p1, p2):
+        """Upper bound of match_users from smoking and cleanliness alone"""
+        weights = self.user_weights
+        lost = 0
+        if not (p1.smokes == p2.ok_with_smoker or p2.smokes == p1.ok_with_smoker):
+            lost += weights['smoking']
+        # A missing value makes match_users raise; leave that to the full score
+        if p1.cleanliness_importance is not None and p2.cleanliness_importance is not None:
+            cleanliness_diff = abs(p1.cleanliness_importance - p2.cleanliness_importance)
+            if cleanliness_diff > 2:
+                lost += weights['cleanliness']
+            elif cleanliness_diff > 1:
+                lost += weights['cleanliness'] * 0.5
+        return round(((self.user_total - lost) / self.user_total) * 100)
+
+    # התאמת שותף לדירה של בעליה
+    def roommate_score(self, user_apt, owner_prefs, seeker):
+        """A seeker's score for an owner's listing: lifestyle compatibility with
+        the owner, or 0 when the listing scores below roommate_threshold for them"""
+        if self.match_user_to_apartment(seeker.apartment_preferences, user_apt) < self.roommate_threshold \
+                or not (owner_prefs and seeker.user_preferences):
+            return 0
+        return self.match_users(owner_prefs, seeker.user_preferences)
+
+    def roommate_score_bound(self, user_apt, owner_prefs, seeker):
+        """Upper bound of roommate_score from the two cheap bounds"""
+        if self.apartment_score_bound(seeker.apartment_preferences, user_apt) < self.roommate_threshold \
+                or not (owner_prefs and seeker.user_preferences):
+            return 0
+        return self.match_users_bound(owner_prefs, seeker.user_preferences)
+
+def _checked_weights(kind, weights, reference, optional=()):
+    weights = dict(weights)
+    missing = set(reference) - set(optional) - set(weights)
+    unknown = set(weights) - set(reference)
+    if missing or unknown:
+        raise ValueError(f"{kind} weights: missing {sorted(missing)}, unknown {sorted(unknown)}")
+    for criterion, weight in weights.items():
+        if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+            raise ValueError(f"{kind} weight {criterion!r} must be a non-negative number")
+    if not sum(weight for criterion, weight in weights.items() if criterion != 'location'):
+        raise ValueError(f"{kind} weights must not all be zero")
+    return weights
+
+# הפרופיל המובנה, לפונקציות שלמטה
+DEFAULT_PLAN = ScoringPlan()
+
+match_user_to_apartment = DEFAULT_PLAN.match_user_to_apartment
+apartment_score_bound = DEFAULT_PLAN.apartment_score_bound
+match_users = DEFAULT_PLAN.match_users
+match_users_bound = DEFAULT_PLAN.match_users_bound
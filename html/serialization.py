@@ -0,0 +1,119 @@
+"""Build match responses from column tuples and encode them quickly.
+
+Serializers only need attribute access on a row, so routes can select just
+the columns a response uses (SQLAlchemy Row tuples) instead of hydrating ORM
+instances; ORM instances still work. Payloads are encoded with orjson when
+it is installed and with the standard library otherwise; both write dates
+as ISO strings, so rows need no per-field conversion.
+
+A `fields=` query parameter (comma-separated) projects every record down to
+the named fields, e.g. `?fields=price_per_month,city,area` for a feed card.
+"""
+import datetime
+import json
+from operator import attrgetter
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if hasattr(value, "tolist"):  # NumPy scalars and arrays
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Encode payload as UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+
+def ndjson_response(records):
+    """Stream an iterable of records as newline-delimited JSON, one chunk per record"""
+    return Response((dumps(record) + b"\n" for record in records), mimetype="application/x-ndjson")
+
+
+def parse_fields(value):
+    """Field names from a `fields=` value, or None for all"""
+    if not value:
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def requested_fields():
+    """Field names from the current Flask request's `fields=` parameter"""
+    return parse_fields(request.args.get("fields"))
+
+
+class RecordSerializer:
+    """Turns rows into dicts, mapping output names to row attributes"""
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self.names = tuple(self.fields)
+        attributes = tuple(self.fields.values())
+        if len(attributes) == 1:
+            get = attrgetter(attributes[0])
+            self._values = lambda row: (get(row),)
+        elif attributes:
+            self._values = attrgetter(*attributes)
+        else:
+            self._values = lambda row: ()
+
+    def project(self, names):
+        """Serializer for just the named fields (all of them when names is None)"""
+        if names is None:
+            return self
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return RecordSerializer({name: self.fields[name] for name in names})
+
+    def columns(self, model, *extra):
+        """Model columns to select for this serializer, after any extra ones"""
+        attributes = list(extra)
+        for attribute in self.fields.values():
+            if attribute not in attributes:
+                attributes.append(attribute)
+        return [getattr(model, attribute) for attribute in attributes]
+
+    def __call__(self, row):
+        return dict(zip(self.names, self._values(row)))
+
+
+# Records returned by the root engine (and app.py)
+APARTMENT_RECORD = RecordSerializer({
+    "id": "id",
+    "address": "address",
+    "city": "city",
+    "area": "area",
+    "contract_type": "contract_type",
+    "features": "features",
+    "num_rooms": "num_rooms",
+    "price_per_month": "price_per_month",
+    "description": "description",
+    "date_of_entry": "date_of_entry",
+    "image_urls": "image_urls",
+    "roommate_id": "roommate_id",
+})
+ROOMMATE_RECORD = RecordSerializer({
+    "id": "id",
+    "name": "name",
+    "email": "email",
+    "age": "age",
+    "interests": "interests",
+    "photo": "photo",
+    "user_type": "user_type",
+})
@@ -0,0 +1,301 @@
+"""Two-sided matching of apartment seekers to listings, a city at a time.
+
+    python stable_match.py --city "Tel Aviv" --table
+    python stable_match.py --all-cities --table [--list-size 20]
+    python stable_match.py --city Haifa --output assignment.ndjson
+
+Both feeds rank one side only: a popular listing tops every seeker's
+apartment feed, and its owner gets every seeker. Here each pair gets a score
+from both sides:
+
+- the seeker's: the listing's apartment score for their search preferences;
+- the listing's: lifestyle compatibility of the seeker with its owner (the
+  first user in roommate_id), as in ScoringPlan.roommate_score, so a pair
+  only counts when the listing reaches roommate_threshold for the seeker.
+
+The mutual score is the mean of the two, rounded. Each seeker keeps their
+--list-size best listings; seekers then propose in that order and each
+listing holds up to its capacity (free rooms: num_rooms less the current
+occupants, at least one, or --capacity), preferring higher compatibility
+and then lower user id. This is seeker-proposing Gale-Shapley with
+capacities: no seeker and listing both prefer each other over what they got.
+
+The lifestyle preferences are loaded once and each city keeps the records
+of its own seekers and owners. Scores are computed in blocks of seekers: score_apartments per seeker over
+the city's catalogue, top-k selection in NumPy, then score_user_records for
+just the kept pairs; only those lists reach the Python proposal loop.
+
+With --table the city's rows in mutual_matches are replaced: per seeker the
+listings on their list ("apartments"), per owner the seekers who listed
+them ("roommates"), with the mutual score and whether the pair was
+assigned. The feeds serve them with ?ranking=mutual, assigned pairs first.
+"""
+import argparse
+import heapq
+import json
+import sys
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Apartment, Base, MutualMatch, User, UserApartmentPref
+from preference_store import load_preference_store
+from vector_scoring import CATALOG_COLUMNS, ApartmentCatalog, score_apartments, score_user_records
+from weight_profiles import profiles
+
+APARTMENTS = 'apartments'
+ROOMMATES = 'roommates'
+
+LOOKING_FOR_APT = "Looking for Apt"
+
+# Key of a listing that must never be chosen (below threshold, own listing)
+EXCLUDED = np.iinfo(np.int64).max
+
+
+def capacity(num_rooms, occupants):
+    """Seekers a listing can take: free rooms, at least one"""
+    return max(1, int(num_rooms or 0) - len(occupants or ()))
+
+
+class CityMarket:
+    """A city's listings and seekers, ready to score.
+
+    lifestyles is a preference store covering (at least) the city's seekers
+    and owners, e.g. everyone's when matching city after city; by default
+    it is loaded here.
+    """
+
+    def __init__(self, db, city, plan, capacity_override=None, lifestyles=None):
+        self.city = city
+        self.plan = plan
+        self.catalog = ApartmentCatalog(
+            db.query(*CATALOG_COLUMNS).filter(Apartment.city == city).order_by(Apartment.id).all())
+        occupancy = {id: (occupants, num_rooms) for id, occupants, num_rooms in db.query(
+            Apartment.id, Apartment.roommate_id, Apartment.num_rooms).filter(Apartment.city == city)}
+        listings = [occupancy[id] for id in self.catalog.ids.tolist()]
+        self.owner_ids = np.array([(occupants or [-1])[0] for occupants, _ in listings], dtype=np.int64)
+        self.capacity = np.array([capacity_override or capacity(num_rooms, occupants)
+                                  for occupants, num_rooms in listings], dtype=np.int64)
+        self.seekers = db.query(UserApartmentPref).join(User, User.id == UserApartmentPref.user_id).filter(
+            User.user_type == LOOKING_FOR_APT, UserApartmentPref.preferred_city == city
+        ).order_by(UserApartmentPref.user_id).all()
+        self.seeker_ids = np.array([pref.user_id for pref in self.seekers], dtype=np.int64)
+        if lifestyles is None:
+            lifestyles = load_preference_store(db)
+        self.lifestyles = lifestyles.subset(np.concatenate([self.seeker_ids, self.owner_ids]))
+        self._owner_positions = self._store_positions(self.owner_ids)
+
+    def _store_positions(self, user_ids):
+        """Positions of user_ids in the preference store, and which are there"""
+        ids = self.lifestyles.ids
+        if not len(ids):
+            return np.zeros(len(user_ids), dtype=np.int64), np.zeros(len(user_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(ids, user_ids), len(ids) - 1)
+        return positions, ids[positions] == user_ids
+
+    def compatibility(self, seekers, listings):
+        """Owner-side scores for pairs (seekers[i], listings[i]), 0 when unknown"""
+        if not len(self.lifestyles):
+            return np.zeros(len(seekers), dtype=np.int64)
+        seeker_pos, seeker_found = self._store_positions(self.seeker_ids[seekers])
+        owner_pos, owner_found = self._owner_positions
+        scores = score_user_records(self.lifestyles.records[seeker_pos],
+                                    self.lifestyles.records[owner_pos[listings]], self.plan.user_weights)
+        return np.where(seeker_found & owner_found[listings], np.maximum(scores, 0), 0)
+
+    def preference_lists(self, list_size, block_size=256):
+        """Per seeker, (listing indices best first, seeker scores, owner scores)"""
+        n = len(self.catalog)
+        columns = np.arange(n)
+        lists = []
+        for start in range(0, len(self.seekers), block_size):
+            stop = min(len(self.seekers), start + block_size)
+            seeker_scores = np.stack([
+                score_apartments(pref, self.catalog, self.plan.apartment_weights)
+                for pref in self.seekers[start:stop]
+            ]) if n else np.zeros((stop - start, 0), dtype=np.int64)
+            # Smaller key = better: higher score first, then lower listing id
+            keys = (100 - seeker_scores) * n + columns
+            keys[(seeker_scores < self.plan.roommate_threshold) |
+                 (self.owner_ids[None, :] == self.seeker_ids[start:stop, None])] = EXCLUDED
+            if n > list_size:
+                keys = np.partition(keys, list_size - 1, axis=1)[:, :list_size]
+            keys.sort(axis=1)
+            # Owner-side scores only for the pairs kept
+            rows, kept = np.nonzero(keys != EXCLUDED)
+            listings = keys[rows, kept] % n
+            owner_scores = self.compatibility(start + rows, listings)
+            bounds = np.searchsorted(rows, np.arange(stop - start + 1))
+            for row in range(stop - start):
+                chosen = slice(bounds[row], bounds[row + 1])
+                lists.append((listings[chosen], seeker_scores[row, listings[chosen]], owner_scores[chosen]))
+        return lists
+
+
+def stable_assignment(lists, capacities):
+    """Seeker-proposing deferred acceptance with listing capacities.
+
+    lists[s] is (listing indices in seeker s's order, seeker scores, owner
+    scores). A listing holds its best `capacity` proposers by owner score,
+    then lower seeker index. Returns the listing index per seeker, -1 if none.
+    """
+    choices = [(listings.tolist(), owner_scores.tolist()) for listings, _, owner_scores in lists]
+    capacities = capacities.tolist()
+    held = [[] for _ in capacities]
+    assigned = np.full(len(lists), -1, dtype=np.int64)
+    next_choice = [0] * len(lists)
+    free = list(range(len(lists)))
+    while free:
+        seeker = free.pop()
+        listings, owner_scores = choices[seeker]
+        while next_choice[seeker] < len(listings):
+            choice = next_choice[seeker]
+            next_choice[seeker] += 1
+            listing = listings[choice]
+            # Heap of the held seekers, worst on top
+            rank = (owner_scores[choice], -seeker)
+            heap = held[listing]
+            if len(heap) < capacities[listing]:
+                heapq.heappush(heap, (rank, seeker))
+            elif rank > heap[0][0]:
+                _, rejected = heapq.heapreplace(heap, (rank, seeker))
+                assigned[rejected] = -1
+                free.append(rejected)
+            else:
+                continue
+            assigned[seeker] = listing
+            break
+    return assigned
+
+
+def mutual_score(seeker_scores, owner_scores):
+    return np.rint((seeker_scores + owner_scores) / 2).astype(np.int64)
+
+
+def match_city(db, city, plan, list_size=20, capacity_override=None, lifestyles=None):
+    """(market, lists, assignment) for one city"""
+    market = CityMarket(db, city, plan, capacity_override, lifestyles)
+    lists = market.preference_lists(list_size)
+    return market, lists, stable_assignment(lists, market.capacity)
+
+
+def result_rows(market, lists, assignment):
+    """mutual_matches rows for a matched city, both directions"""
+    listing_ids = market.catalog.ids
+    rows = []
+    roommates = {}
+    for seeker, (listings, seeker_scores, owner_scores) in enumerate(lists):
+        seeker_id = int(market.seeker_ids[seeker])
+        for listing, score in zip(listings.tolist(), mutual_score(seeker_scores, owner_scores).tolist()):
+            is_assigned = listing == assignment[seeker]
+            rows.append({"user_id": seeker_id, "mode": APARTMENTS, "target_id": int(listing_ids[listing]),
+                         "score": score, "assigned": is_assigned, "city": market.city})
+            owner_id = int(market.owner_ids[listing])
+            if owner_id < 0:
+                continue
+            # An owner with several listings keeps the best row per seeker
+            key = (owner_id, seeker_id)
+            row = {"user_id": owner_id, "mode": ROOMMATES, "target_id": seeker_id,
+                   "score": score, "assigned": is_assigned, "city": market.city}
+            if key not in roommates or (is_assigned, score) > (roommates[key]["assigned"], roommates[key]["score"]):
+                roommates[key] = row
+    rows.extend(roommates.values())
+    return rows
+
+
+def write_table(db, city, rows, batch_size=10000):
+    """Replace one city's mutual_matches rows, in one transaction"""
+    db.execute(delete(MutualMatch).where(MutualMatch.city == city))
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(MutualMatch), rows[start:start + batch_size])
+    db.commit()
+
+
+def write_ndjson(out, market, lists, assignment):
+    for seeker, (listings, seeker_scores, owner_scores) in enumerate(lists):
+        listing = int(assignment[seeker])
+        out.write(json.dumps({
+            "user_id": int(market.seeker_ids[seeker]),
+            "city": market.city,
+            "assigned": int(market.catalog.ids[listing]) if listing >= 0 else None,
+            "matches": list(zip(market.catalog.ids[listings].tolist(),
+                                mutual_score(seeker_scores, owner_scores).tolist())),
+        }) + "\n")
+
+
+def read_page(db, user_id, mode, page, per_page, min_score=0):
+    """One page of (target_id, score, assigned), assigned first then best first, and the total"""
+    query = db.query(MutualMatch.target_id, MutualMatch.score, MutualMatch.assigned).filter(
+        MutualMatch.user_id == user_id,
+        MutualMatch.mode == mode,
+        MutualMatch.score >= min_score
+    )
+    total = query.count()
+    rows = query.order_by(MutualMatch.assigned.desc(), MutualMatch.score.desc(), MutualMatch.target_id).offset(
+        max(0, (page - 1) * per_page)).limit(per_page).all()
+    return rows, total
+
+
+def has_ranking(db, user_id, mode):
+    return db.query(MutualMatch.user_id).filter(
+        MutualMatch.user_id == user_id, MutualMatch.mode == mode).first() is not None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assign apartment seekers to listings, both sides ranked")
+    parser.add_argument("--database-url", help="defaults to the service database (db.py)")
+    cities = parser.add_mutually_exclusive_group(required=True)
+    cities.add_argument("--city", action="append", help="city to match (repeatable)")
+    cities.add_argument("--all-cities", action="store_true")
+    parser.add_argument("--list-size", type=int, default=20, help="listings each seeker ranks")
+    parser.add_argument("--capacity", type=int, help="seekers per listing (default: free rooms)")
+    parser.add_argument("--profile", help="weight profile (weight_profiles.py); defaults to the default one")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="write NDJSON here ('-' for stdout)")
+    target.add_argument("--table", action="store_true", help="replace the cities' mutual_matches rows")
+    args = parser.parse_args(argv)
+    if args.list_size < 1 or (args.capacity is not None and args.capacity < 1):
+        parser.error("--list-size and --capacity must be positive")
+    try:
+        plan = profiles.plan(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        session_factory = sessionmaker(bind=engine)
+    else:
+        from db import engine, SessionLocal as session_factory
+
+    db = session_factory()
+    out = None
+    try:
+        if args.table:
+            Base.metadata.create_all(engine, tables=[MutualMatch.__table__])
+        else:
+            out = sys.stdout if args.output == "-" else open(args.output, "w")
+        names = args.city or [city for (city,) in db.query(Apartment.city).distinct().order_by(Apartment.city)
+                              if city is not None]
+        lifestyles = load_preference_store(db)
+        for city in names:
+            start = time.perf_counter()
+            market, lists, assignment = match_city(db, city, plan, args.list_size, args.capacity, lifestyles)
+            matched = time.perf_counter()
+            if args.table:
+                write_table(db, city, result_rows(market, lists, assignment))
+            else:
+                write_ndjson(out, market, lists, assignment)
+            print(f"{city}: {len(market.seekers)} seekers x {len(market.catalog)} listings, "
+                  f"{int((assignment >= 0).sum())} assigned in {matched - start:.2f}s "
+                  f"(write {time.perf_counter() - matched:.2f}s)", file=sys.stderr)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
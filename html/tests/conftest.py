@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules under test live next to match-engine.py and import each other flat
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# db.py connects to DATABASE_URL on import: point it at a scratch SQLite file
+# and keep the configured URL for the PostgreSQL-only checks
+POSTGRES_URL = os.environ.get("DATABASE_URL", "")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="roomatch-tests-"), "test.db")
+
+
+@pytest.fixture(scope="session")
+def postgres_url():
+    """The configured DATABASE_URL; skips unless it is PostgreSQL"""
+    if not POSTGRES_URL.startswith("postgresql"):
+        pytest.skip("DATABASE_URL is not a PostgreSQL database")
+    return POSTGRES_URL
+
+
+@pytest.fixture
+def db():
+    """A session on an empty schema in the scratch SQLite database, with cold caches"""
+    from db import SessionLocal, engine
+    from match_cache import candidate_versions, match_cache, preference_index, preference_snapshot
+    from models import Base
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    for cache in (match_cache, candidate_versions, preference_snapshot, preference_index):
+        cache.invalidate()
+    session = SessionLocal()
+    yield session
+    session.close()
@@ -0,0 +1,63 @@
+"""The ASGI app over aiosqlite against the synchronous MatchService"""
+import asyncio
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+from benchmarks.synthetic import generate
+from match_service import MatchService
+from serialization import ROOMMATE_RECORD, dumps
+
+
+@pytest.fixture
+def client(db):
+    ids = generate(db, 200, 120, seed=4)
+    with TestClient(asgi.app) as client:
+        yield client, ids
+
+
+def expected(payload):
+    return json.loads(dumps(payload))
+
+
+def test_routes_match_the_service(client, db):
+    client, ids = client
+    service = MatchService(db)
+    for user_id in ids["seekers"][:3]:
+        response = client.get(f"/api/match/apartments/{user_id}?min_score=30&page=2&per_page=5")
+        assert response.status_code == 200
+        assert response.json() == expected(service.apartment_feed(user_id, 30, 2, 5))
+        response = client.get(f"/api/match/users/{user_id}?per_page=7")
+        assert response.json() == expected(service.user_feed(user_id, per_page=7))
+    for user_id in ids["owners"][:3]:
+        response = client.get(f"/api/match/roommates/{user_id}")
+        assert response.json() == expected(service.roommate_feed(user_id, ROOMMATE_RECORD))
+        assert response.json()["results"]
+
+    # Index reads go through aiosqlite
+    response = client.get("/api/match/apartments/nearby?lat=32.08&lon=34.78&radius_km=3&limit=8")
+    assert response.status_code == 200
+    assert response.json() == expected(service.nearby_feed(32.08, 34.78, 3, 8))
+    assert response.json()["results"]
+    response = client.get(f"/api/match/apartments/{ids['seekers'][0]}?ranking=mutual")
+    assert response.status_code == 404
+
+    assert client.get("/api/match/apartments/99999").status_code == 404
+    assert client.get(f"/api/match/users/{ids['seekers'][0]}?weights=nope").status_code == 400
+
+
+def test_scoring_runs_off_the_event_loop(client, monkeypatch):
+    client, ids = client
+    loops = []
+
+    def apartment_feed(service, *args):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return {"results": []}
+    monkeypatch.setattr(MatchService, "apartment_feed", apartment_feed)
+    assert client.get(f"/api/match/apartments/{ids['seekers'][0]}").json() == {"results": []}
+    assert loops == [None]
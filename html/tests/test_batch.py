@@ -0,0 +1,62 @@
+"""The :batch routes against the single-user routes they batch"""
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+import feeds
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture
+def client(db):
+    ids = generate(db, 200, 150, seed=12)
+    with TestClient(asgi.app) as client:
+        yield client, ids
+
+
+def test_batches_equal_single_responses(client, monkeypatch):
+    client, ids = client
+    selective = []
+    ranked_users = feeds.ranked_users
+    monkeypatch.setattr(feeds, "ranked_users", lambda *args: selective.append(args) or ranked_users(*args))
+    seekers = ids["seekers"][:4]
+    users = [seekers[0], {"user_id": seekers[1], "page": 2, "per_page": 3},
+             {"user_id": seekers[2], "min_score": 70}, 99999, {"user_id": seekers[3], "min_score": 20}]
+    singles = [(seekers[0], "per_page=4"), (seekers[1], "page=2&per_page=3"), (seekers[2], "min_score=70&per_page=4"),
+               (99999, None), (seekers[3], "min_score=20&per_page=4")]
+
+    # Batches first, so their rankings aren't cache hits left by the single routes
+    for route in ("apartments", "users"):
+        response = client.post(f"/api/match/{route}:batch?per_page=4", json={"users": users})
+        assert response.status_code == 200
+        if route == "users":
+            # min_score=70 is selective for the lifestyle weights: ranked in SQL, as by user_feed
+            assert selective
+        entries = response.json()["results"]
+        assert [entry["user_id"] for entry in entries] == [user_id for user_id, _ in singles]
+        for entry, (user_id, query) in zip(entries, singles):
+            if query is None:
+                assert entry == {"user_id": 99999, "error": "User preferences not found"}
+                assert client.get(f"/api/match/{route}/{user_id}").status_code == 404
+                continue
+            single = client.get(f"/api/match/{route}/{user_id}?{query}")
+            assert entry == {"user_id": user_id, **single.json()}
+            assert entry["results"]
+
+    owners = ids["owners"][:3]
+    response = client.post("/api/match/roommates:batch", json={"users": owners + [99999]})
+    entries = response.json()["results"]
+    for entry, user_id in zip(entries, owners):
+        assert entry == {"user_id": user_id, **client.get(f"/api/match/roommates/{user_id}").json()}
+    assert entries[-1] == {"user_id": 99999, "results": []}
+
+
+@pytest.mark.parametrize("body", [b"not json", b'{"users": []}', b'{"people": [1]}', b'{"users": [{"user_id": "1"}]}',
+                                  b'{"users": [{"user_id": 1, "page": 0}]}', b'[1, 2]'])
+def test_malformed_body(client, body):
+    client, _ = client
+    for route in ("apartments", "users", "roommates"):
+        response = client.post(f"/api/match/{route}:batch", content=body,
+                               headers={"Content-Type": "application/json"})
+        assert response.status_code == 400
+        assert "error" in response.json()
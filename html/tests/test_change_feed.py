@@ -0,0 +1,151 @@
+"""The change feed's polling mode on SQLite: LiveData converges on the tables"""
+import datetime
+import time
+
+import pytest
+
+import change_feed
+from benchmarks.synthetic import generate
+from change_feed import ChangeConsumer, LiveData
+from models import Apartment, UserApartmentPref, UserPreference
+from preference_store import CATEGORY_FIELDS, FLAG_FIELDS
+
+SEARCH_COLUMNS = [column.key for column in UserApartmentPref.__table__.columns if column.key != 'updated_at']
+
+
+def contents(data):
+    """Everything LiveData holds, decoded so stores with different vocabularies compare"""
+    return (
+        sorted(tuple(row) for row in data.catalog.rows),
+        sorted((r.user_id, r.cleanliness_importance, *(getattr(r, f) for f in FLAG_FIELDS + CATEGORY_FIELDS))
+               for r in data.preferences),
+        {user_id: tuple(getattr(pref, c) for c in SEARCH_COLUMNS) for user_id, pref in data.search_prefs.items()},
+    )
+
+
+def assert_converged(data, session):
+    fresh = LiveData()
+    fresh.load(session)
+    session.rollback()
+    assert contents(data) == contents(fresh)
+
+
+@pytest.fixture
+def feed(db):
+    from db import SessionLocal
+    generate(db, 50, 60, seed=8)
+    clock = [0.0]
+    consumer = ChangeConsumer(LiveData(), mode="poll", clock=lambda: clock[0])
+    session = SessionLocal()
+    consumer.load(session)
+    # The first poll rereads the rows stamped inside the overlap of the load
+    cycle(consumer, session)
+    yield consumer, session, clock
+    session.close()
+
+
+def cycle(consumer, session, catch_up=False):
+    """One round of _poll_loop (or of _listen after a batch of notifications)"""
+    changes = {} if catch_up else consumer.poll(session)
+    consumer._due_resync(session, changes, catch_up)
+    return consumer.apply(session, changes)
+
+
+def stamp(db, model, key, updated_at):
+    db.query(model).filter(change_feed.TABLES[model.__tablename__] == key).update(
+        {"updated_at": updated_at}, synchronize_session=False)
+
+
+def test_inserts_updates_and_deletes(feed, db):
+    consumer, session, clock = feed
+    versions = dict(consumer.data.versions)
+    apartment = db.get(Apartment, 3)
+    apartment.price_per_month = 1234
+    apartment.features = ["Balcony", "Sauna"]
+    db.add(Apartment(id=51, city="Haifa", area="North", contract_type="Sublet", price_per_month=3000,
+                     num_rooms=2, features=["Wifi"], date_of_entry=datetime.date(2025, 4, 1)))
+    search = db.query(UserApartmentPref).first()
+    search.preferred_city = "Jerusalem"
+    db.get(UserPreference, 4).noise_sensitivity = "something new"
+    db.commit()
+
+    assert cycle(consumer, session) >= 4
+    assert consumer.data.versions[Apartment.__tablename__] > versions[Apartment.__tablename__]
+    assert_converged(consumer.data, session)
+    # Rows inside the overlap come back once, not on every poll
+    assert cycle(consumer, session) == 0
+
+    # Deletes only show up at the resync
+    db.delete(db.get(Apartment, 7))
+    db.delete(db.get(UserPreference, 9))
+    db.delete(search)
+    db.commit()
+    cycle(consumer, session)
+    assert 7 in consumer.data.keys(Apartment.__tablename__)
+    clock[0] += change_feed.RESYNC_INTERVAL
+    assert cycle(consumer, session) == 3
+    assert consumer.stats["resyncs"] == 1
+    assert_converged(consumer.data, session)
+
+
+def test_watermark_overlap(feed, db):
+    consumer, session, _ = feed
+    watermark = consumer.watermarks[Apartment.__tablename__]
+    # A transaction that started (and was stamped) before the last write seen,
+    # but committed after it
+    db.get(Apartment, 5).price_per_month = 999
+    db.flush()
+    stamp(db, Apartment, 5, watermark - change_feed.POLL_OVERLAP / 2)
+    # One stamped before the overlap is only caught by a full reload
+    db.get(Apartment, 6).price_per_month = 888
+    db.flush()
+    stamp(db, Apartment, 6, watermark - 2 * change_feed.POLL_OVERLAP)
+    db.commit()
+
+    assert cycle(consumer, session) == 1
+    prices = dict(zip(consumer.data.catalog.ids.tolist(), consumer.data.catalog.price.tolist()))
+    assert prices[5] == 999 and prices[6] != 888
+    assert consumer.watermarks[Apartment.__tablename__] == watermark
+
+
+def test_resync_after_lost_notifications(feed, db):
+    consumer, session, clock = feed
+    # Written while the listener was disconnected: no notifications arrive
+    db.add(UserPreference(user_id=61, works_from_home=True, shares_cleaning=False, has_or_wants_pet=False,
+                          smokes=False, ok_with_smoker=True, cleanliness_importance=3,
+                          cleaning_frequency="Once a week", guest_frequency="Once a month",
+                          noise_sensitivity="very sensitive"))
+    lifestyle = db.get(UserPreference, 2)
+    lifestyle.smokes = not lifestyle.smokes
+    db.delete(db.get(Apartment, 11))
+    db.commit()
+
+    assert cycle(consumer, session, catch_up=True) == 0
+    clock[0] += change_feed.RESYNC_INTERVAL
+    assert cycle(consumer, session, catch_up=True) == 3
+    assert_converged(consumer.data, session)
+
+
+def test_notify_falls_back_to_polling(db, monkeypatch):
+    from db import SessionLocal, engine
+    generate(db, 20, 30, seed=2)
+    monkeypatch.setattr(change_feed, "POLL_INTERVAL", 0.02)
+    consumer = ChangeConsumer(LiveData(), mode="notify")
+    consumer.start(engine, SessionLocal)
+    try:
+        deadline = time.monotonic() + 10
+        while not consumer.ready or consumer.mode != "poll":
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        db.get(Apartment, 2).price_per_month = 4321
+        db.commit()
+        session = SessionLocal()
+        try:
+            while 4321 not in consumer.data.catalog.price:
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+            assert_converged(consumer.data, session)
+        finally:
+            session.close()
+    finally:
+        consumer.stop()
@@ -0,0 +1,23 @@
+"""Cold-start-to-ready gate (benchmarks.coldstart) for both Flask engines"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.engines import HTML_DIR
+
+BUDGET = float(os.environ.get("MATCH_COLD_START_BUDGET", 10))
+
+
+@pytest.mark.parametrize("engine", ["html", "root"])
+def test_ready_within_budget(engine):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.coldstart", "--engine", engine, "--runs", "1",
+         "--apartments", "2000", "--users", "1000", "--budget", str(BUDGET)],
+        cwd=HTML_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    [run] = json.loads(result.stdout)["runs"]
+    assert run["health"]["status"] == "ready"
+    assert run["ready_s"] <= BUDGET
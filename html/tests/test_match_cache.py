@@ -0,0 +1,109 @@
+"""MatchCache eviction, expiry and versioning, and candidate set versions"""
+import datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from match_cache import ENTRY_OVERHEAD_BYTES, CandidateVersions, MatchCache, candidate_set_version
+from models import Apartment
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def ranked(n, total=None):
+    ids = np.arange(n, dtype=np.int64)
+    return ids, ids[::-1].copy(), n if total is None else total
+
+
+def entry_bytes(n):
+    return 2 * n * 8 + ENTRY_OVERHEAD_BYTES
+
+
+def test_lru_eviction_under_budget():
+    cache = MatchCache(max_bytes=2 * entry_bytes(10), ttl=60, clock=Clock())
+    cache.put("a", 1, ranked(10))
+    cache.put("b", 1, ranked(10))
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a", 1) is not None
+    cache.put("c", 1, ranked(10))
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) is not None and cache.get("c", 1) is not None
+    assert cache.bytes == 2 * entry_bytes(10) and cache.stats["evictions"] == 1
+    # Larger than the whole budget: not stored, nothing evicted
+    cache.put("d", 1, ranked(100))
+    assert cache.get("d", 1) is None and len(cache) == 2
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    cache = MatchCache(ttl=30, clock=clock)
+    cache.put("a", 1, ranked(5))
+    clock.now = 29.9
+    assert cache.get("a", 1) is not None
+    clock.now = 30
+    assert cache.get("a", 1) is None
+    assert cache.stats["expirations"] == 1 and len(cache) == 0 and cache.bytes == 0
+
+
+def test_version_mismatch_drops_entry():
+    cache = MatchCache(ttl=60, clock=Clock())
+    cache.put("a", ("prefs", 1), ranked(5))
+    assert cache.get("a", ("prefs", 2)) is None
+    assert cache.stats["invalidations"] == 1 and len(cache) == 0
+    # The old version is gone too
+    assert cache.get("a", ("prefs", 1)) is None
+
+
+def test_get_or_rank_reranks_short_prefix():
+    cache = MatchCache(ttl=60, clock=Clock())
+    calls = []
+
+    def rank(need):
+        calls.append(need)
+        return ranked(min(2 * need, 100), total=100)
+
+    assert len(cache.get_or_rank("a", 1, rank, 10)[0]) == 20
+    cache.get_or_rank("a", 1, rank, 20)
+    assert calls == [10]
+    # Page beyond the cached prefix: ranked again, longer
+    assert len(cache.get_or_rank("a", 1, rank, 30)[0]) == 60
+    assert calls == [10, 30]
+    # A prefix holding every result covers any page
+    cache.get_or_rank("a", 1, rank, 1000)
+    cache.get_or_rank("a", 1, rank, 5000)
+    assert calls == [10, 30, 1000]
+
+
+def test_candidate_version_follows_edits_by_other_writers(db):
+    db.add_all([Apartment(id=i, city="Haifa", price_per_month=4000) for i in (1, 2, 3)])
+    db.commit()
+    clock = Clock()
+    versions = CandidateVersions(ttl=1, clock=clock)
+    before = versions.get(db, Apartment.id)
+    # Reused within the TTL, without a query
+    assert versions.get(db, Apartment.id) == before and versions.stats["reads"] == 1
+
+    # An edit in place from another connection, stamped as the triggers do
+    with db.get_bind().begin() as conn:
+        conn.execute(text("UPDATE apartments SET price_per_month = 4500, updated_at = :at WHERE id = 2"),
+                     {"at": datetime.datetime(2099, 1, 1)})
+    assert versions.get(db, Apartment.id) == before
+    clock.now = 1
+    after = versions.get(db, Apartment.id)
+    assert after != before and after[:2] == before[:2]
+
+
+def test_orm_writes_drop_candidate_version(db):
+    db.add(Apartment(id=1, city="Haifa", price_per_month=4000))
+    db.commit()
+    assert candidate_set_version(db, Apartment.id)[0] == 1
+    # Within the TTL, but the write went through this process's ORM
+    db.add(Apartment(id=2, city="Haifa", price_per_month=3000))
+    db.commit()
+    assert candidate_set_version(db, Apartment.id)[0] == 2
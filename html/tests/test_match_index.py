@@ -0,0 +1,95 @@
+"""Incremental match index updates against a full rebuild"""
+import datetime
+
+import numpy as np
+
+import feeds
+import match_index
+from benchmarks.synthetic import generate
+from models import Apartment, MatchIndex, MatchIndexChange, UserApartmentPref, UserPreference
+from scoring import APARTMENT_WEIGHTS, ScoringPlan
+from vector_scoring import load_apartment_catalog, score_apartments, score_seekers
+from weight_profiles import profiles
+
+
+def index_rows(db):
+    return sorted(db.query(MatchIndex.user_id, MatchIndex.mode, MatchIndex.target_id, MatchIndex.score).all())
+
+
+def drain(db):
+    while match_index.apply_changes(db, batch_size=3):
+        pass
+
+
+def test_score_seekers_matches_score_apartments(db):
+    generate(db, 40, 120, seed=5)
+    seekers = db.query(UserApartmentPref).all()
+    # Gaps the synthetic data never has: no range, no date, no rooms, no features
+    seekers[0].preferred_price_min = None
+    seekers[1].preferred_date_of_entry = None
+    seekers[2].preferred_num_rooms = [None]
+    seekers[3].preferred_features = ["Balcony", "Sauna", "Balcony"]
+    seekers[4].preferred_features = None
+    near_first = ScoringPlan({**APARTMENT_WEIGHTS, "location": 30})
+    for apartment_id in (1, 2, 3, 17):
+        catalog = load_apartment_catalog(db, Apartment.id == apartment_id)
+        for weights in (profiles.plan().apartment_weights, near_first.apartment_weights):
+            expected = [int(score_apartments(seeker, catalog, weights)[0]) for seeker in seekers]
+            assert score_seekers(seekers, catalog, weights).tolist() == expected
+
+
+def test_incremental_updates_equal_rebuild(db):
+    generate(db, 60, 80, seed=7)
+    match_index.rebuild(db)
+    before = index_rows(db)
+
+    apartment = db.get(Apartment, 5)
+    apartment.price_per_month = 4000
+    apartment.city = "Haifa"
+    apartment.features = ["Balcony", "Sauna"]
+    apartment.date_of_entry = datetime.date(2025, 2, 1)
+    db.delete(db.get(Apartment, 9))
+    db.add(Apartment(id=61, city="Tel Aviv", area="Center", contract_type="Long term", price_per_month=6000,
+                     num_rooms=3, features=["Wifi"], date_of_entry=datetime.date(2025, 3, 1),
+                     latitude=32.08, longitude=34.78))
+    search = db.query(UserApartmentPref).first()
+    search.preferred_features = ["Elevator", "Sauna"]
+    search.preferred_latitude, search.preferred_longitude = 32.8, 34.99
+    lifestyle = db.get(UserPreference, 2)
+    lifestyle.smokes = not lifestyle.smokes
+    lifestyle.cleanliness_importance = 1
+    db.commit()
+    assert db.query(MatchIndexChange).count() >= 5
+
+    drain(db)
+    incremental = index_rows(db)
+    assert incremental != before
+    assert db.query(MatchIndexChange).count() == 0
+
+    match_index.rebuild(db)
+    assert incremental == index_rows(db)
+
+
+def test_profile_change_falls_back_then_rebuilds(db, monkeypatch):
+    ids = generate(db, 30, 40, seed=9)
+    match_index.rebuild(db)
+    monkeypatch.setattr(feeds, "USE_MATCH_INDEX", True)
+    user_id = ids["seekers"][0]
+    assert match_index.built_for(db, profiles.plan())
+
+    # A hot reload: the default profile now has different weights
+    near_first = ScoringPlan({**APARTMENT_WEIGHTS, "location": 30}, name="near_first")
+    monkeypatch.setattr(profiles, "plan", lambda name=None, user_id=None: near_first)
+    assert not feeds._index_serves(db, near_first)
+    catalog = load_apartment_catalog(db)
+    pref = db.get(UserApartmentPref, user_id)
+    scores = score_apartments(pref, catalog, near_first.apartment_weights)
+    best = int(np.max(scores))
+    payload = feeds.apartment_feed(db, user_id, per_page=1, plan=near_first)
+    assert payload["results"][0]["match_score"] == best
+
+    # The worker rebuilds under the new weights before applying changes
+    match_index.apply_changes(db)
+    assert feeds._index_serves(db, near_first)
+    rows, total = match_index.read_page(db, user_id, match_index.APARTMENTS, 1, 1)
+    assert rows[0].score == best and total == len(catalog)
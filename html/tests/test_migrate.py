@@ -0,0 +1,27 @@
+"""EXPLAIN check of the hot-path queries (migrate.py --check).
+
+Needs PostgreSQL: set DATABASE_URL to a scratch database, which gets the
+schema and every migration. Skipped otherwise.
+"""
+import pytest
+from sqlalchemy import create_engine
+
+from migrate import check_feature_masks, check_geo_cells, check_query_plans, migrate
+from models import Base
+
+
+@pytest.fixture(scope="module")
+def engine(postgres_url):
+    engine = create_engine(postgres_url)
+    Base.metadata.create_all(engine)
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_no_sequential_scans(engine):
+    assert check_query_plans(engine) == []
+
+
+def test_sql_functions_agree_with_python(engine):
+    assert check_feature_masks(engine) + check_geo_cells(engine) == []
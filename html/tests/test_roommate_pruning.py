@@ -0,0 +1,84 @@
+"""Branch-and-bound roommate ranking (feeds.roommate_feed) against exhaustive scoring"""
+import pytest
+from flask import Flask, g
+
+import feeds
+from benchmarks.synthetic import generate
+from instrumentation import init_app
+from models import Apartment, UserPreference
+from ranking import bounded_top_k
+from scoring import ScoringPlan
+
+PLAN = ScoringPlan()
+
+
+@pytest.fixture
+def market(db):
+    """(session, [(owner, listing, owner_prefs)], seekers) of a small fixed population"""
+    ids = generate(db, 40, 300, seed=3)
+    owners = []
+    for owner_id in ids["owners"][:8]:
+        listing = db.query(Apartment).filter(feeds._owned_by(db, owner_id)).order_by(Apartment.id).first()
+        owners.append((owner_id, listing, db.get(UserPreference, owner_id)))
+    seekers = [seeker for seeker in feeds._seekers(db).all() if seeker.apartment_preferences]
+    return db, owners, seekers
+
+
+def exhaustive(owner_id, listing, owner_prefs, seekers, k):
+    scored = sorted(((PLAN.roommate_score(listing, owner_prefs, seeker), seeker.id)
+                     for seeker in seekers if seeker.id != owner_id), key=lambda s: (-s[0], s[1]))
+    return scored[:k], scored
+
+
+def test_bound_never_below_score(market):
+    _, owners, seekers = market
+    below_threshold = 0
+    for _, listing, owner_prefs in owners:
+        for seeker in seekers:
+            assert PLAN.roommate_score_bound(listing, owner_prefs, seeker) >= \
+                PLAN.roommate_score(listing, owner_prefs, seeker)
+            if PLAN.match_user_to_apartment(seeker.apartment_preferences, listing) < PLAN.roommate_threshold:
+                below_threshold += 1
+    # The population has to exercise the apartment gate
+    assert below_threshold
+
+
+def test_same_ranking_as_exhaustive(market):
+    _, owners, seekers = market
+    ties = 0
+    for owner_id, listing, owner_prefs in owners:
+        candidates = [(seeker.id, seeker) for seeker in seekers if seeker.id != owner_id]
+        for k in (1, 5, len(candidates) + 3):
+            results, _ = bounded_top_k(
+                candidates, k,
+                lambda seeker: PLAN.roommate_score_bound(listing, owner_prefs, seeker),
+                lambda seeker: PLAN.roommate_score(listing, owner_prefs, seeker))
+            expected, scored = exhaustive(owner_id, listing, owner_prefs, seekers, k)
+            assert [(score, id) for score, id, _ in results] == expected
+            if k < len(scored) and scored[k][0] == scored[k - 1][0]:
+                ties += 1
+    # Ties at the k-th score must be broken by id, as exhaustive sorting does
+    assert ties
+
+
+def test_pruned_counter(market, monkeypatch):
+    db, owners, seekers = market
+    scored = []
+    score = ScoringPlan.roommate_score
+    monkeypatch.setattr(ScoringPlan, "roommate_score",
+                        lambda self, *args: scored.append(args) or score(self, *args))
+    app = init_app(Flask(__name__))
+    pruned_any = False
+    for owner_id, listing, owner_prefs in owners:
+        candidates = sum(1 for seeker in seekers if seeker.id != owner_id)
+        with app.test_request_context():
+            # Starts the request's counters, as for a real request
+            app.preprocess_request()
+            scored.clear()
+            feed = feeds.roommate_feed(db, owner_id, lambda seeker: seeker.id, k=5, plan=PLAN)
+            pruned = g.match_stats["counters"].get("roommate_candidates_pruned", 0)
+        assert pruned == candidates - len(scored)
+        expected, _ = exhaustive(owner_id, listing, owner_prefs, seekers, 5)
+        assert [(r["match_score"], r["roommate"]) for r in feed["results"]] == expected
+        pruned_any = pruned_any or pruned > 0
+    assert pruned_any
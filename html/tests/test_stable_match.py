@@ -0,0 +1,108 @@
+"""Deferred acceptance with capacities against the definition of stability"""
+import itertools
+import random
+
+import numpy as np
+
+import stable_match
+from benchmarks.synthetic import generate
+from scoring import ScoringPlan
+
+
+def market(choices):
+    """lists for stable_assignment from {seeker: [(listing, owner score), ...]}, best first"""
+    return [(np.array([l for l, _ in ranked], dtype=np.int64), np.zeros(len(ranked), dtype=np.int64),
+             np.array([o for _, o in ranked], dtype=np.int64)) for _, ranked in sorted(choices.items())]
+
+
+def owner_rank(lists, seeker, listing):
+    listings, _, owner_scores = lists[seeker]
+    return (int(owner_scores[listings.tolist().index(listing)]), -seeker)
+
+
+def seeker_rank(lists, seeker, listing):
+    """Position of listing on the seeker's list (lower is better), len(list) when unassigned"""
+    listings = lists[seeker][0].tolist()
+    return listings.index(listing) if listing >= 0 else len(listings)
+
+
+def is_stable(lists, capacities, assigned):
+    for listing, capacity in enumerate(capacities):
+        if (assigned == listing).sum() > capacity:
+            return False
+    for seeker, (listings, _, _) in enumerate(lists):
+        if assigned[seeker] >= 0 and assigned[seeker] not in listings:
+            return False
+        for listing in listings.tolist():
+            if seeker_rank(lists, seeker, listing) >= seeker_rank(lists, seeker, assigned[seeker]):
+                break
+            # The seeker would rather have this listing: does it have room, or someone it likes less?
+            held = np.flatnonzero(assigned == listing).tolist()
+            if len(held) < capacities[listing] or any(
+                    owner_rank(lists, other, listing) < owner_rank(lists, seeker, listing) for other in held):
+                return False
+    return True
+
+
+def stable_matchings(lists, capacities):
+    options = [[-1] + listings.tolist() for listings, _, _ in lists]
+    for assigned in itertools.product(*options):
+        assigned = np.array(assigned, dtype=np.int64)
+        if is_stable(lists, capacities, assigned):
+            yield assigned
+
+
+def check(lists, capacities):
+    assigned = stable_match.stable_assignment(lists, np.array(capacities, dtype=np.int64))
+    assert is_stable(lists, capacities, assigned)
+    # Seeker-optimal: every seeker does at least as well as in any stable matching
+    for other in stable_matchings(lists, capacities):
+        for seeker in range(len(lists)):
+            assert seeker_rank(lists, seeker, assigned[seeker]) <= seeker_rank(lists, seeker, other[seeker])
+    return assigned
+
+
+def test_hand_made_market():
+    # Listing 0 takes two seekers, 1 and 2 one each; everyone wants listing 0 first
+    lists = market({
+        0: [(0, 50), (1, 90)],
+        1: [(0, 80), (2, 40)],
+        2: [(0, 80), (1, 70), (2, 60)],
+        3: [(0, 10), (1, 95)],
+        4: [(0, 80), (2, 30)],
+    })
+    assigned = check(lists, [2, 1, 1])
+    # 4 ties 1 and 2 on listing 0 and loses to the lower ids; 3 displaces 0 from listing 1
+    assert assigned.tolist() == [-1, 0, 0, 1, 2]
+
+
+def test_random_markets():
+    rng = random.Random(20)
+    for _ in range(40):
+        seekers, listings = rng.randint(1, 6), rng.randint(1, 4)
+        lists = market({seeker: [(listing, rng.randint(0, 3) * 10)
+                                 for listing in rng.sample(range(listings), rng.randint(0, listings))]
+                        for seeker in range(seekers)})
+        check(lists, [rng.randint(1, 2) for _ in range(listings)])
+
+
+def test_preference_store_loaded_once(db, tmp_path, monkeypatch):
+    generate(db, 120, 200, seed=6)
+    loads = []
+    load_preference_store = stable_match.load_preference_store
+    monkeypatch.setattr(stable_match, "load_preference_store",
+                        lambda *args: loads.append(args) or load_preference_store(*args))
+    assert stable_match.main(["--all-cities", "--output", str(tmp_path / "out.ndjson")]) == 0
+    assert len(loads) == 1
+
+    # A city's share of the shared store matches what it would load itself
+    plan = ScoringPlan()
+    shared = load_preference_store(db)
+    for city in ("Haifa", "Tel Aviv"):
+        own = stable_match.match_city(db, city, plan)
+        split = stable_match.match_city(db, city, plan, lifestyles=shared)
+        assert set(split[0].lifestyles.ids.tolist()) <= set(split[0].seeker_ids.tolist()) | set(
+            split[0].owner_ids.tolist())
+        assert np.array_equal(own[2], split[2])
+        for (a, sa, oa), (b, sb, ob) in zip(own[1], split[1]):
+            assert np.array_equal(a, b) and np.array_equal(sa, sb) and np.array_equal(oa, ob)
@@ -0,0 +1,45 @@
+"""The ANN user feed reports the exact number of matches"""
+import feeds
+from benchmarks.synthetic import generate
+from models import UserPreference
+from preference_ann import PreferenceANN
+from preference_store import load_preference_store
+from scoring import ScoringPlan
+
+PLAN = ScoringPlan()
+
+
+def exact_total(prefs, current, min_score):
+    total = 0
+    for other in prefs:
+        if other.user_id == current.user_id:
+            continue
+        try:
+            total += PLAN.match_users(current, other) >= min_score
+        except TypeError:
+            # No cleanliness_importance: match_users can't score the pair
+            pass
+    return total
+
+
+def test_ann_total_is_exact(db, monkeypatch):
+    generate(db, 10, 500, seed=13)
+    db.query(UserPreference).filter(UserPreference.user_id % 50 == 0).update(
+        {"cleanliness_importance": None}, synchronize_session=False)
+    db.commit()
+    prefs = db.query(UserPreference).all()
+    store = load_preference_store(db)
+    index = PreferenceANN(store)
+    monkeypatch.setattr(feeds, "USE_USER_ANN", True)
+
+    approximate = 0
+    for current in prefs[:25:3] + [prefs[49]]:
+        for min_score in (0, 55, 80):
+            expected = exact_total(prefs, current, min_score)
+            assert index.count(current.user_id, PLAN.user_weights, min_score) == expected
+            _, _, candidates = index.search(current.user_id, PLAN.user_weights, 5, min_score, probes=2)
+            approximate += candidates != expected
+            payload = feeds.user_feed(db, current.user_id, min_score, per_page=5, plan=PLAN)
+            assert payload["pagination"]["total_results"] == expected
+    # The lists a search opens don't cover everyone, so their count alone would be off
+    assert approximate
@@ -0,0 +1,111 @@
+"""score_apartments against the scalar scorer it vectorizes"""
+import datetime
+import random
+
+import pytest
+
+from features import FEATURES, features_mask
+from models import Apartment, UserApartmentPref
+from scoring import APARTMENT_WEIGHTS, ScoringPlan
+from vector_scoring import CATALOG_COLUMNS, ApartmentCatalog, score_apartments
+
+CITIES = ["Tel Aviv", "Jerusalem", "Haifa", None]
+AREAS = ["Center", "North", "South", None]
+CONTRACTS = ["long", "short", None]
+# Strings outside the registry take the OTHER_FEATURES path
+FEATURE_NAMES = list(FEATURES) + ["Garden", "Sauna"]
+TODAY = datetime.date(2026, 1, 1)
+
+
+def _location(rng):
+    if rng.random() < 0.2:
+        return None, None
+    return 32.0 + rng.uniform(-0.1, 0.1), 34.8 + rng.uniform(-0.1, 0.1)
+
+
+def random_apartment(rng, apartment_id):
+    features = rng.sample(FEATURE_NAMES, rng.randint(0, 4))
+    latitude, longitude = _location(rng)
+    return Apartment(
+        id=apartment_id,
+        city=rng.choice(CITIES),
+        area=rng.choice(AREAS),
+        contract_type=rng.choice(CONTRACTS),
+        price_per_month=rng.randrange(2000, 9000, 250),
+        num_rooms=rng.randint(1, 6),
+        features=features,
+        features_mask=features_mask(features),
+        date_of_entry=TODAY + datetime.timedelta(days=rng.randint(-30, 120)),
+        latitude=latitude,
+        longitude=longitude,
+    )
+
+
+def random_pref(rng, user_id, whole_rooms):
+    price_min = rng.randrange(2000, 7000, 250)
+    features = rng.sample(FEATURE_NAMES, rng.randint(0, 4))
+    rooms = [rng.randint(1, 6) for _ in range(rng.randint(1, 3))]
+    if not whole_rooms:
+        rooms = [room + rng.choice([0, 0.5]) for room in rooms]
+    latitude, longitude = _location(rng)
+    return UserApartmentPref(
+        user_id=user_id,
+        preferred_city=rng.choice(CITIES),
+        preferred_area=rng.choice(AREAS),
+        preferred_contract_type=rng.choice(CONTRACTS),
+        preferred_features=features,
+        preferred_features_mask=features_mask(features),
+        preferred_num_rooms=[float(room) for room in rooms],
+        preferred_price_min=price_min,
+        preferred_price_max=price_min + rng.randrange(0, 4000, 250),
+        preferred_date_of_entry=TODAY + datetime.timedelta(days=rng.randint(0, 90)),
+        preferred_latitude=latitude,
+        preferred_longitude=longitude,
+    )
+
+
+def random_weights(rng, floats):
+    if floats:
+        return {criterion: round(rng.uniform(0, 30), 3) for criterion in APARTMENT_WEIGHTS}
+    return {criterion: rng.randint(0, 30) for criterion in APARTMENT_WEIGHTS}
+
+
+def catalog_of(apartments):
+    return ApartmentCatalog([tuple(getattr(apt, column.key) for column in CATALOG_COLUMNS)
+                             for apt in apartments])
+
+
+# Exact room equality only agrees with the scalar int() rule on whole room counts
+@pytest.mark.parametrize("truncate_rooms, whole_rooms", [(True, False), (True, True), (False, True)])
+@pytest.mark.parametrize("floats", [False, True])
+def test_matches_scalar_scorer(truncate_rooms, whole_rooms, floats):
+    rng = random.Random(f"{truncate_rooms}-{whole_rooms}-{floats}")
+    apartments = [random_apartment(rng, i) for i in range(1, 501)]
+    catalog = catalog_of(apartments)
+    for user_id in range(1, 51):
+        pref = random_pref(rng, user_id, whole_rooms)
+        weights = random_weights(rng, floats)
+        if not sum(w for criterion, w in weights.items() if criterion != 'location'):
+            weights['city'] = 1
+        plan = ScoringPlan(apartment=weights)
+        scores = score_apartments(pref, catalog, plan.apartment_weights, truncate_rooms)
+        assert scores.tolist() == [plan.match_user_to_apartment(pref, apt) for apt in apartments]
+
+
+def test_default_weights_and_updated_catalog():
+    rng = random.Random(7)
+    apartments = [random_apartment(rng, i) for i in range(1, 301)]
+    catalog = catalog_of(apartments[:200])
+    # Upsert a changed half and delete a few, as the change feed does
+    changed = [random_apartment(rng, i) for i in range(150, 301)]
+    catalog = catalog.updated(catalog_of(changed).rows, deleted={3, 4, 5})
+    by_id = {apt.id: apt for apt in apartments[:200]}
+    by_id.update({apt.id: apt for apt in changed})
+    for i in (3, 4, 5):
+        del by_id[i]
+    plan = ScoringPlan()
+    for user_id in range(1, 31):
+        pref = random_pref(rng, user_id, whole_rooms=False)
+        scores = score_apartments(pref, catalog, plan.apartment_weights)
+        expected = [plan.match_user_to_apartment(pref, by_id[i]) for i in catalog.ids.tolist()]
+        assert scores.tolist() == expected
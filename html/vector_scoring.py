@@ -0,0 +1,333 @@
+import numpy as np
+
+from features import FEATURE_BITS, OTHER_FEATURES
+from geo import LOCATION_RADIUS_KM, distance_km, preferred_location
+from models import Apartment, UserApartmentPref
+from preference_store import CLEANLINESS_UNKNOWN, flag_shift
+from scoring import apartment_weights
+
+# Columns needed to score an apartment, in catalogue row order
+CATALOG_COLUMNS = (
+    Apartment.id,
+    Apartment.city,
+    Apartment.area,
+    Apartment.contract_type,
+    Apartment.price_per_month,
+    Apartment.num_rooms,
+    Apartment.features,
+    Apartment.date_of_entry,
+    Apartment.features_mask,
+    Apartment.latitude,
+    Apartment.longitude,
+)
+
+# Columns needed to score apartments for a seeker (score_seekers)
+SEEKER_COLUMNS = (
+    UserApartmentPref.user_id,
+    UserApartmentPref.preferred_city,
+    UserApartmentPref.preferred_area,
+    UserApartmentPref.preferred_contract_type,
+    UserApartmentPref.preferred_price_min,
+    UserApartmentPref.preferred_price_max,
+    UserApartmentPref.preferred_date_of_entry,
+    UserApartmentPref.preferred_num_rooms,
+    UserApartmentPref.preferred_features,
+    UserApartmentPref.preferred_latitude,
+    UserApartmentPref.preferred_longitude,
+)
+
+
+def _encode(values, vocab):
+    """Map each value to a small integer code, growing the vocabulary as needed"""
+    return np.fromiter(
+        (vocab.setdefault(value, len(vocab)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+
+
+def _popcount(words):
+    """Count set bits per row of a (rows, words) uint64 array"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    bits = np.unpackbits(words.view(np.uint8), axis=1)
+    return bits.sum(axis=1, dtype=np.int64)
+
+
+class ApartmentCatalog:
+    """Apartment rows stored as column arrays for vectorized scoring"""
+
+    # Per-row arrays, in the order updated() splices them
+    ARRAYS = ('ids', 'city', 'area', 'contract_type', 'price', 'num_rooms', 'latitude', 'longitude',
+              'has_entry_date', 'entry_date', 'features')
+
+    def __init__(self, rows, base=None):
+        """base: a catalogue whose vocabularies to extend, so codes line up with it"""
+        self.rows = list(rows)
+        n = len(self.rows)
+
+        self.ids = np.fromiter((r[0] for r in self.rows), dtype=np.int64, count=n)
+
+        # Categorical columns as integer codes (None gets a code of its own,
+        # since the scalar scorers treat None == None as a match)
+        if base is None:
+            self.city_vocab, self.area_vocab, self.contract_vocab = {}, {}, {}
+        else:
+            self.city_vocab, self.area_vocab, self.contract_vocab = (
+                dict(base.city_vocab), dict(base.area_vocab), dict(base.contract_vocab))
+        self.city = _encode([r[1] for r in self.rows], self.city_vocab)
+        self.area = _encode([r[2] for r in self.rows], self.area_vocab)
+        self.contract_type = _encode([r[3] for r in self.rows], self.contract_vocab)
+
+        # Numeric columns, NaN where the value is missing
+        self.price = np.array(
+            [np.nan if r[4] is None else r[4] for r in self.rows], dtype=np.float64
+        )
+        self.num_rooms = np.array(
+            [np.nan if r[5] is None else r[5] for r in self.rows], dtype=np.float64
+        )
+        self.latitude = np.array(
+            [np.nan if r[9] is None or r[10] is None else r[9] for r in self.rows], dtype=np.float64
+        )
+        self.longitude = np.array(
+            [np.nan if r[9] is None or r[10] is None else r[10] for r in self.rows], dtype=np.float64
+        )
+
+        # Entry date as a proleptic Gregorian ordinal
+        self.has_entry_date = np.array([r[7] is not None for r in self.rows], dtype=bool)
+        self.entry_date = np.fromiter(
+            (r[7].toordinal() if r[7] is not None else 0 for r in self.rows),
+            dtype=np.int64,
+            count=n,
+        )
+
+        # Features as a bitmask: the persisted features_mask where it covers
+        # every feature, else one bit per distinct string after the registry's
+        if base is None:
+            self.feature_vocab = {name: bit.bit_length() - 1 for name, bit in FEATURE_BITS.items()}
+        else:
+            self.feature_vocab = dict(base.feature_vocab)
+        spelled_out = [
+            i for i, r in enumerate(self.rows)
+            if r[6] and (r[8] is None or r[8] & OTHER_FEATURES)
+        ]
+        for i in spelled_out:
+            for feature in self.rows[i][6]:
+                self.feature_vocab.setdefault(feature, len(self.feature_vocab))
+        self.features = np.zeros((n, max(1, -(-len(self.feature_vocab) // 64))), dtype=np.uint64)
+        self.features[:, 0] = [r[8] or 0 for r in self.rows]
+        for i in spelled_out:
+            self.features[i] = 0
+            for feature in set(self.rows[i][6]):
+                bit = self.feature_vocab[feature]
+                self.features[i, bit // 64] |= np.uint64(1 << (bit % 64))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def updated(self, rows, deleted=()):
+        """A new catalogue with rows upserted (by id) and the ids in deleted removed"""
+        changed = ApartmentCatalog(rows, base=self)
+        keep = np.flatnonzero(~np.isin(self.ids, np.concatenate([
+            changed.ids, np.fromiter(deleted, dtype=np.int64)])))
+        merged = ApartmentCatalog((), base=changed)
+        merged.rows = [self.rows[i] for i in keep] + changed.rows
+        words = changed.features.shape[1]
+        for name in self.ARRAYS:
+            old, new = getattr(self, name)[keep], getattr(changed, name)
+            if name == 'features' and old.shape[1] < words:
+                # New feature strings took more bitmask words
+                old = np.pad(old, ((0, 0), (0, words - old.shape[1])))
+            setattr(merged, name, np.concatenate([old, new]))
+        return merged
+
+    def feature_mask(self, features):
+        """Bitmask for a list of feature strings (unknown features set no bits)"""
+        mask = np.zeros(self.features.shape[1], dtype=np.uint64)
+        for feature in set(features or ()):
+            bit = self.feature_vocab.get(feature)
+            if bit is not None:
+                mask[bit // 64] |= np.uint64(1 << (bit % 64))
+        return mask
+
+
+def load_apartment_catalog(db, *criteria):
+    """Load apartments matching the given filter criteria as a catalogue"""
+    return ApartmentCatalog(db.query(*CATALOG_COLUMNS).filter(*criteria).all())
+
+
+def score_apartments(user_pref, catalog, weights, truncate_rooms=True):
+    """Score every apartment in the catalogue for one user's preferences.
+
+    Mirrors the scalar scorers term by term (same weights, same order of
+    additions, same rounding), so the scores are identical to calling
+    ScoringPlan.match_user_to_apartment per row. truncate_rooms selects the
+    shared room rule (int() on both sides) over exact equality.
+    """
+    weights = apartment_weights(user_pref, weights)
+    total_weight = sum(weights.values())
+    score = np.zeros(len(catalog), dtype=np.float64)
+
+    # City, area and contract type match
+    score += np.where(catalog.city == catalog.city_vocab.get(user_pref.preferred_city, -1),
+                      weights['city'], 0)
+    score += np.where(catalog.area == catalog.area_vocab.get(user_pref.preferred_area, -1),
+                      weights['area'], 0)
+    score += np.where(
+        catalog.contract_type == catalog.contract_vocab.get(user_pref.preferred_contract_type, -1),
+        weights['contract_type'], 0)
+
+    # Price range match (NaN prices compare False)
+    if user_pref.preferred_price_min is not None and user_pref.preferred_price_max is not None:
+        in_range = ((catalog.price >= user_pref.preferred_price_min) &
+                    (catalog.price <= user_pref.preferred_price_max))
+        score += np.where(in_range, weights['price'], 0)
+
+    # Date of entry match
+    if user_pref.preferred_date_of_entry is not None:
+        on_time = catalog.has_entry_date & (
+            catalog.entry_date <= user_pref.preferred_date_of_entry.toordinal())
+        score += np.where(on_time, weights['date'], 0)
+
+    # Number of rooms match
+    wanted_rooms = np.array(
+        [x for x in user_pref.preferred_num_rooms or () if x is not None], dtype=np.float64)
+    rooms = catalog.num_rooms
+    if truncate_rooms:
+        rooms, wanted_rooms = np.trunc(rooms), np.trunc(wanted_rooms)
+    score += np.where(np.isin(rooms, wanted_rooms), weights['rooms'], 0)
+
+    # Features match
+    if user_pref.preferred_features:
+        matching = _popcount(catalog.features & catalog.feature_mask(user_pref.preferred_features))
+        feature_score = (matching / len(user_pref.preferred_features)) * weights['features']
+        score += np.where(matching > 0, feature_score, 0.0)
+
+    # Location, decaying with distance (NaN coordinates compare False)
+    if 'location' in weights:
+        distance = distance_km(*preferred_location(user_pref), catalog.latitude, catalog.longitude)
+        near = distance < LOCATION_RADIUS_KM
+        score += weights['location'] * np.where(near, 1.0 - distance / LOCATION_RADIUS_KM, 0.0)
+
+    return np.rint((score / total_weight) * 100).astype(np.int64)
+
+
+def score_seekers(seekers, catalog, weights, truncate_rooms=True):
+    """Score the first apartment of the catalogue for many seekers at once.
+
+    seekers are rows with UserApartmentPref attributes (ORM instances or
+    SEEKER_COLUMNS rows). Entry i equals score_apartments(seekers[i],
+    catalog, weights)[0]: the terms are added in the same order, so the
+    scores are identical, but the apartment is scored once per term rather
+    than once per seeker.
+    """
+    seekers = list(seekers)
+    n = len(seekers)
+    city, area, contract_type = catalog.rows[0][1:4]
+    score = np.zeros(n, dtype=np.float64)
+
+    def column(values, dtype=bool):
+        return np.fromiter(values, dtype=dtype, count=n)
+
+    # City, area and contract type match
+    score += np.where(column(s.preferred_city == city for s in seekers), weights['city'], 0)
+    score += np.where(column(s.preferred_area == area for s in seekers), weights['area'], 0)
+    score += np.where(column(s.preferred_contract_type == contract_type for s in seekers),
+                      weights['contract_type'], 0)
+
+    # Price range match (a missing bound or price compares False)
+    has_range = column(s.preferred_price_min is not None and s.preferred_price_max is not None for s in seekers)
+    low = column((s.preferred_price_min if has else np.nan for s, has in zip(seekers, has_range)), np.float64)
+    high = column((s.preferred_price_max if has else np.nan for s, has in zip(seekers, has_range)), np.float64)
+    score += np.where((low <= catalog.price[0]) & (catalog.price[0] <= high), weights['price'], 0)
+
+    # Date of entry match
+    entry = column((s.preferred_date_of_entry.toordinal() if s.preferred_date_of_entry is not None else -1
+                    for s in seekers), np.int64)
+    on_time = (entry >= 0) & catalog.has_entry_date[0] & (catalog.entry_date[0] <= entry)
+    score += np.where(on_time, weights['date'], 0)
+
+    # Number of rooms match: every wanted count, tagged with its seeker
+    wanted = [(i, x) for i, s in enumerate(seekers) for x in s.preferred_num_rooms or () if x is not None]
+    owner = np.array([i for i, _ in wanted], dtype=np.int64)
+    wanted_rooms = np.array([x for _, x in wanted], dtype=np.float64)
+    rooms = catalog.num_rooms[0]
+    if truncate_rooms:
+        rooms, wanted_rooms = np.trunc(rooms), np.trunc(wanted_rooms)
+    has_rooms = np.zeros(n, dtype=bool)
+    has_rooms[owner[wanted_rooms == rooms]] = True
+    score += np.where(has_rooms, weights['rooms'], 0)
+
+    # Features match
+    wanted_count = column((len(s.preferred_features or ()) for s in seekers), np.int64)
+    masks = np.zeros((n, catalog.features.shape[1]), dtype=np.uint64)
+    for i, s in enumerate(seekers):
+        if s.preferred_features:
+            masks[i] = catalog.feature_mask(s.preferred_features)
+    matching = _popcount(masks & catalog.features[0])
+    feature_score = (matching / np.maximum(wanted_count, 1)) * weights['features']
+    score += np.where(matching > 0, feature_score, 0.0)
+
+    # Location, decaying with distance, for seekers who set one
+    located = column(preferred_location(s) is not None for s in seekers)
+    if 'location' in weights:
+        distance = column((distance_km(*preferred_location(s), catalog.latitude[0], catalog.longitude[0])
+                           if has else np.nan for s, has in zip(seekers, located)), np.float64)
+        near = distance < LOCATION_RADIUS_KM
+        score += np.where(located, weights['location'] * np.where(near, 1.0 - distance / LOCATION_RADIUS_KM, 0.0),
+                          0.0)
+
+    # Location only counts towards the total for seekers who set one (apartment_weights)
+    total_weight = np.where(located & ('location' in weights), sum(weights.values()),
+                            sum(w for criterion, w in weights.items() if criterion != 'location'))
+    return np.rint((score / total_weight) * 100).astype(np.int64)
+
+
+def score_user_pairs(a, b, weights):
+    """match_users for every pair of two preference record arrays.
+
+    a and b are PreferenceStore.records (or slices of them) from the same
+    store, so category codes agree. Returns an int64 (len(a), len(b)) matrix
+    with the same scores as match_users, and -1 where match_users would
+    raise because a cleanliness_importance is missing.
+    """
+    return score_user_records(a[:, None], b[None, :], weights)
+
+
+def score_user_records(a, b, weights):
+    """score_user_pairs for record arrays broadcast against each other, e.g.
+    two equal-length arrays to score just the pairs a[i], b[i]"""
+    total_weight = sum(weights.values())
+    flags_a = a['flags'].astype(np.int32)
+    flags_b = b['flags'].astype(np.int32)
+
+    def flag(flags, field):
+        return flags >> flag_shift(field) & 3
+
+    def same_flag(field):
+        return flag(flags_a, field) == flag(flags_b, field)
+
+    def same(field):
+        return a[field] == b[field]
+
+    score = np.zeros(np.broadcast_shapes(a.shape, b.shape), dtype=np.float64)
+    score += np.where(same_flag('works_from_home'), weights['works_from_home'], 0)
+    score += np.where(same_flag('shares_cleaning'), weights['shares_cleaning'], 0)
+    score += np.where(same_flag('has_or_wants_pet'), weights['pet'], 0)
+    smoking = ((flag(flags_a, 'smokes') == flag(flags_b, 'ok_with_smoker')) |
+               (flag(flags_b, 'smokes') == flag(flags_a, 'ok_with_smoker')))
+    score += np.where(smoking, weights['smoking'], 0)
+
+    cleanliness_a = a['cleanliness'].astype(np.int16)
+    cleanliness_b = b['cleanliness'].astype(np.int16)
+    cleanliness_diff = np.abs(cleanliness_a - cleanliness_b)
+    score += np.where(cleanliness_diff <= 1, weights['cleanliness'],
+                      np.where(cleanliness_diff <= 2, weights['cleanliness'] * 0.5, 0))
+
+    score += np.where(same('cleaning_frequency'), weights['cleaning_frequency'], 0)
+    score += np.where(same('guest_frequency'), weights['guest_frequency'], 0)
+    score += np.where(same('noise_sensitivity'), weights['noise'], 0)
+
+    scores = np.rint((score / total_weight) * 100).astype(np.int64)
+    scores[(cleanliness_a == CLEANLINESS_UNKNOWN) | (cleanliness_b == CLEANLINESS_UNKNOWN)] = -1
+    return scores
@@ -0,0 +1,158 @@
+"""Startup warm-up and readiness for the match service.
+
+With MATCH_WARMUP=1 the service warms itself in the background right after
+start-up, before it reports ready:
+
+- connections: opens the connection pool up to MATCH_WARM_CONNECTIONS
+  (the pool size by default), so first requests skip the handshakes;
+- preferences: loads and encodes every user's lifestyle preferences into
+  the shared store user feeds rank against (match_cache.preference_snapshot);
+- apartments: ranks the first page for one seeker in each of the
+  MATCH_WARM_CITIES most wanted cities, which compiles the planner's SQL,
+  reads those cities' apartments into the database cache and fills the
+  match cache for those seekers.
+
+/api/health answers 503 until that is done (and when it failed) and 200
+afterwards, so Cloud Run's startup probe holds traffic back until the
+instance is warm. Without MATCH_WARMUP the service is ready at once.
+
+    python -m benchmarks.coldstart --budget 5
+
+measures import and cold-start-to-ready time against a budget (CI runs it
+through tests/test_coldstart.py). Both match-engine.py files start it.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import func, text
+
+from feeds import apartment_feed, shared_preference_store
+from match_cache import candidate_set_version
+from models import UserApartmentPref, UserPreference
+
+log = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.environ.get("MATCH_WARMUP") == "1"
+WARM_CITIES = int(os.environ.get("MATCH_WARM_CITIES", 20))
+
+
+def warm_connections(engine):
+    """Number of connections to open: MATCH_WARM_CONNECTIONS, else the pool size"""
+    if "MATCH_WARM_CONNECTIONS" in os.environ:
+        return int(os.environ["MATCH_WARM_CONNECTIONS"])
+    size = getattr(engine.pool, "size", None)
+    return size() if size else 1
+
+
+class Warmup:
+    """Progress of the start-up warm-up: state, time per step and any error"""
+
+    def __init__(self, enabled=WARMUP_ENABLED, clock=time.perf_counter):
+        self.clock = clock
+        self.state = "cold" if enabled else "ready"
+        self.steps = {}
+        self.error = None
+        self._started = None
+        self.seconds = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def begin(self):
+        self.state = "warming"
+        self._started = self.clock()
+
+    @contextmanager
+    def step(self, name):
+        start = self.clock()
+        yield
+        self.steps[name] = self.clock() - start
+
+    def finish(self, error=None):
+        self.seconds = self.clock() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+            self.state = "failed"
+            log.error("warm-up failed after %.2fs: %s", self.seconds, self.error)
+        else:
+            self.state = "ready"
+            log.info("warm-up done in %.2fs: %s", self.seconds, self.steps)
+
+    def run(self, engine, session_factory):
+        """Warm a synchronous engine and its sessions; returns True once ready"""
+        self.begin()
+        try:
+            with self.step("connections"):
+                warm_pool(engine, warm_connections(engine))
+            db = session_factory()
+            try:
+                with self.step("preferences"):
+                    warm_preferences(db)
+                with self.step("apartments"):
+                    warm_apartments(db)
+            finally:
+                db.close()
+        except Exception as e:
+            self.finish(e)
+        else:
+            self.finish()
+        return self.ready
+
+    def start(self, engine, session_factory):
+        """run() on a background thread, so the server can accept health checks meanwhile"""
+        thread = threading.Thread(target=self.run, args=(engine, session_factory),
+                                  name="match-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self):
+        return {"status": self.state, "seconds": self.seconds, "steps": dict(self.steps),
+                "error": self.error}
+
+
+def warm_pool(engine, connections):
+    """Open `connections` connections at once and hand them back to the pool"""
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+async def warm_async_pool(engine, connections):
+    """warm_pool for an AsyncEngine"""
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = await engine.connect()
+            opened.append(conn)
+            await conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            await conn.close()
+
+
+def warm_preferences(db):
+    """Load the shared preference store user feeds rank against"""
+    current = db.query(UserPreference).first()
+    if current is not None:
+        shared_preference_store(db, current, candidate_set_version(db, UserPreference.user_id))
+
+
+def warm_apartments(db, cities=WARM_CITIES):
+    """Rank page one for a seeker in each of the most wanted cities"""
+    seekers = db.query(func.min(UserApartmentPref.user_id)).group_by(
+        UserApartmentPref.preferred_city).order_by(func.count().desc()).limit(cities).all()
+    for (user_id,) in seekers:
+        apartment_feed(db, user_id)
+
+
+warmup = Warmup()
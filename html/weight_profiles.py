@@ -0,0 +1,139 @@
+"""Weight profiles for the match engines, read from a JSON file and hot-reloaded.
+
+    {
+      "default": "standard",
+      "profiles": {
+        "standard": {},
+        "near_first": {"apartment": {"location": 30}, "roommate_threshold": 40}
+      },
+      "split": {"standard": 90, "near_first": 10}
+    }
+
+A profile lists only what it changes from the built-in weights in
+scoring.py ("apartment", "user", "roommate_threshold") and is compiled once
+into a ScoringPlan. Requests may name a profile (?weights=); otherwise
+"split", when present, assigns each user a profile by a stable hash of their
+id (for A/B runs), and "default" applies to everything else.
+
+MATCH_WEIGHTS_FILE names the file (match_weights.json next to this module by
+default). Its mtime is checked at most every MATCH_WEIGHTS_RELOAD_SECONDS, so
+edits apply without a restart; a file that fails to parse or validate is
+logged and skipped, and the profiles already loaded stay in force.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from scoring import APARTMENT_WEIGHTS, ROOMMATE_APARTMENT_THRESHOLD, USER_WEIGHTS, ScoringPlan
+
+log = logging.getLogger(__name__)
+
+WEIGHTS_FILE = os.environ.get(
+    "MATCH_WEIGHTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "match_weights.json"))
+RELOAD_SECONDS = float(os.environ.get("MATCH_WEIGHTS_RELOAD_SECONDS", 5))
+
+# Profile in force when there is no file
+BUILTIN = "standard"
+
+
+def compile_profiles(config):
+    """(default name, {name: ScoringPlan}, split) from a parsed config; raises ValueError"""
+    profiles = config.get("profiles") or {BUILTIN: {}}
+    plans = {}
+    for name, profile in profiles.items():
+        unknown = set(profile) - {"apartment", "user", "roommate_threshold"}
+        if unknown:
+            raise ValueError(f"profile {name!r}: unknown keys {sorted(unknown)}")
+        plans[name] = ScoringPlan(
+            {**APARTMENT_WEIGHTS, **profile.get("apartment", {})},
+            {**USER_WEIGHTS, **profile.get("user", {})},
+            profile.get("roommate_threshold", ROOMMATE_APARTMENT_THRESHOLD),
+            name=name,
+        )
+    default = config.get("default", next(iter(plans)))
+    split = {name: int(share) for name, share in (config.get("split") or {}).items()}
+    for name in [default, *split]:
+        if name not in plans:
+            raise ValueError(f"unknown profile {name!r}")
+    if split and (min(split.values()) < 0 or not sum(split.values())):
+        raise ValueError("split shares must be non-negative and not all zero")
+    return default, plans, split
+
+
+class WeightProfiles:
+    """The configured ScoringPlans, reloaded when the file changes"""
+
+    def __init__(self, path=WEIGHTS_FILE, reload_seconds=RELOAD_SECONDS, clock=time.monotonic):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.clock = clock
+        self.stats = {"reloads": 0, "reload_errors": 0}
+        self.default, self.plans, self.split = BUILTIN, {BUILTIN: ScoringPlan(name=BUILTIN)}, {}
+        self._mtime = None
+        self._checked = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self, force=False):
+        """Re-read the file if it changed (or always, with force); returns True if profiles changed"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            self._checked = self.clock()
+            if mtime == self._mtime and not force:
+                return False
+            self._mtime = mtime
+            try:
+                if mtime is None:
+                    config = {}
+                else:
+                    with open(self.path) as f:
+                        config = json.load(f)
+                self.default, self.plans, self.split = compile_profiles(config)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                self.stats["reload_errors"] += 1
+                log.warning("keeping the current weight profiles; %s is invalid: %s", self.path, e)
+                return False
+            self.stats["reloads"] += 1
+            return True
+
+    def _maybe_reload(self):
+        if self._checked is None or self.clock() - self._checked >= self.reload_seconds:
+            self.reload()
+
+    def plan(self, name=None, user_id=None):
+        """ScoringPlan for a named profile, else the user's split share, else the default"""
+        self._maybe_reload()
+        plans, split = self.plans, self.split
+        if name is not None:
+            if name not in plans:
+                raise ValueError(f"Unknown weight profile: {name}")
+            return plans[name]
+        if split and user_id is not None:
+            bucket = zlib.crc32(str(user_id).encode()) % sum(split.values())
+            for profile, share in split.items():
+                if bucket < share:
+                    return plans[profile]
+                bucket -= share
+        return plans[self.default]
+
+    def snapshot(self):
+        self._maybe_reload()
+        return {
+            "default": self.default,
+            "split": dict(self.split),
+            "profiles": {
+                name: {"apartment": plan.apartment_weights, "user": plan.user_weights,
+                       "roommate_threshold": plan.roommate_threshold}
+                for name, plan in self.plans.items()
+            },
+            **self.stats,
+        }
+
+
+profiles = WeightProfiles()